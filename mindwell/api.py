@@ -0,0 +1,279 @@
+# mindwell/api.py
+# Gracious Ogyiri Asare - gpoa@bu.edu
+# Read-only JSON API (v1) with field selection, cursor pagination and conditional GET
+
+import hashlib
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, Max
+from django.db.models.fields.files import FieldFile
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.functional import cached_property
+from django.utils.http import http_date
+from django.views import View
+from .inbox import user_plans
+from .models import HealthProvider, Session, TherapyPlan
+from .pagination import InvalidCursor, KeysetPaginator, cursor_query
+from .thumbnails import thumbnail_urls
+from . import slots
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# clients must revalidate every time; a 304 costs one aggregate query
+CACHE_CONTROL = 'private, no-cache'
+
+
+class ApiError(ValueError):
+    '''A request the API rejects, returned as {"error": ...}'''
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def compact_json(data, status=200):
+    '''JsonResponse without the whitespace of the default separators'''
+    return JsonResponse(data, status=status, json_dumps_params={'separators': (',', ':')})
+
+
+def make_etag(*parts):
+    '''Strong ETag of any JSON-serializable values'''
+    raw = json.dumps(parts, cls=DjangoJSONEncoder, separators=(',', ':'))
+    return f'"{hashlib.md5(raw.encode()).hexdigest()}"'
+
+
+class ApiView(View):
+    '''Conditional GET of one JSON resource
+
+    validate_params() parses the query string first, so bad parameters are
+    rejected before anything is read. get_validators() returns (parts,
+    last_modified) computed cheaply from the database; the ETag hashes them
+    with the path, user and query string, so an unchanged resource is
+    answered 304 before get_data() runs. Views that return None hash the
+    rendered data instead, saving bandwidth only.
+    '''
+    login_required = True
+
+    def dispatch(self, request, *args, **kwargs):
+        if self.login_required and not request.user.is_authenticated:
+            return compact_json({'error': 'authentication required'}, status=401)
+        return super().dispatch(request, *args, **kwargs)
+
+    def validate_params(self):
+        '''Parse the query parameters, raising ApiError before any query runs'''
+
+    def get_validators(self):
+        return None
+
+    def get_data(self):
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        try:
+            self.validate_params()
+            validators = self.get_validators()
+            data = None
+            if validators is None:
+                data = self.get_data()
+                validators = ([data], None)
+            parts, last_modified = validators
+            etag = make_etag(request.path, request.user.pk, sorted(request.GET.lists()), *parts)
+            timestamp = int(last_modified.timestamp()) if last_modified else None
+
+            response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+            if response is None:
+                response = compact_json(self.get_data() if data is None else data)
+        except ApiError as error:
+            return compact_json({'error': str(error)}, status=error.status)
+
+        response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+        response['Cache-Control'] = CACHE_CONTROL
+        patch_vary_headers(response, ['Cookie'])
+        return response
+
+
+class FieldsMixin:
+    '''?fields=a,b selection among the serializable fields of a model'''
+    model = None
+    fields = ()
+
+    def validate_params(self):
+        super().validate_params()
+        self.selected_fields = self.parse_fields()
+
+    def parse_fields(self):
+        '''Requested field names, all of them when fields= is absent'''
+        requested = self.request.GET.get('fields')
+        if not requested:
+            return list(self.fields)
+        names = list(dict.fromkeys(name.strip() for name in requested.split(',') if name.strip()))
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            raise ApiError(f'unknown fields: {", ".join(unknown)}; choose from {", ".join(self.fields)}')
+        return names
+
+    def columns(self, *extra):
+        '''Model field names to load for the selected fields'''
+        names = {self.model._meta.get_field(name).name for name in self.selected_fields}
+        return names | set(extra)
+
+    def serialize(self, obj):
+        data = {}
+        for name in self.selected_fields:
+            value = getattr(obj, name)
+            if isinstance(value, FieldFile):
+                # images are served as their thumbnails, see thumbnails.py
+                value = thumbnail_urls(value) if value else None
+            data[name] = value
+        return data
+
+
+class ApiListView(FieldsMixin, ApiView):
+    '''One keyset page of a queryset: {"results": [...], "next": url, "previous": url}
+
+    Validators are the row count and latest updated_at of the whole filtered
+    queryset, so edits, inserts and deletes all change the ETag. No
+    Last-Modified is sent: deleting an older row leaves the latest updated_at
+    as it was, and If-Modified-Since would then answer a stale 304.
+    '''
+    ordering = ()
+
+    def get_queryset(self):
+        raise NotImplementedError
+
+    @cached_property
+    def queryset(self):
+        return self.get_queryset()
+
+    def validate_params(self):
+        super().validate_params()
+        self.per_page = self.parse_limit()
+
+    def parse_limit(self):
+        '''Page size from limit=, clamped to MAX_PAGE_SIZE'''
+        try:
+            limit = int(self.request.GET.get('limit', PAGE_SIZE))
+        except ValueError:
+            raise ApiError('limit must be an integer')
+        return max(1, min(limit, MAX_PAGE_SIZE))
+
+    def get_validators(self):
+        stats = self.queryset.order_by().aggregate(count=Count('pk'), last_modified=Max('updated_at'))
+        return [stats['count'], stats['last_modified']], None
+
+    def get_data(self):
+        keys = [name.lstrip('-') for name in self.ordering]
+        paginator = KeysetPaginator(self.queryset.only(*self.columns(*keys)), self.ordering, self.per_page)
+        try:
+            page = paginator.page(after=self.request.GET.get('after'), before=self.request.GET.get('before'))
+        except InvalidCursor:
+            raise ApiError('invalid cursor')
+        prev_query, next_query = cursor_query(self.request.GET, page)
+        return {
+            'results': [self.serialize(obj) for obj in page],
+            'next': f'{self.request.path}?{next_query}' if next_query else None,
+            'previous': f'{self.request.path}?{prev_query}' if prev_query else None,
+        }
+
+
+def integer_param(request, name):
+    '''Optional integer query parameter'''
+    value = request.GET.get(name)
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ApiError(f'{name} must be an integer')
+
+
+class ProviderFieldsMixin:
+    model = HealthProvider
+    # contact details are left to the profile page
+    fields = (
+        'id', 'first_name', 'last_name', 'gender', 'occupation', 'specialization',
+        'languages', 'experience_years', 'bio', 'address', 'profile_img', 'verified', 'updated_at',
+    )
+
+
+class ProviderListApiView(ProviderFieldsMixin, ApiListView):
+    '''Directory of providers, by name'''
+    login_required = False
+    ordering = ('last_name', 'first_name', 'id')
+
+    def get_queryset(self):
+        return HealthProvider.objects.all()
+
+
+class ProviderDetailApiView(ProviderFieldsMixin, FieldsMixin, ApiView):
+    '''One provider'''
+    login_required = False
+
+    @cached_property
+    def provider(self):
+        provider = HealthProvider.objects.filter(pk=self.kwargs['pk']).only(*self.columns('updated_at')).first()
+        if provider is None:
+            raise ApiError('provider not found', status=404)
+        return provider
+
+    def get_validators(self):
+        return [self.provider.updated_at], self.provider.updated_at
+
+    def get_data(self):
+        return self.serialize(self.provider)
+
+
+class ProviderSlotsApiView(ApiView):
+    '''Free session starts of a provider, {date: [HH:MM, ...]}
+
+    Slots also change as time passes, so the ETag hashes the slots themselves.
+    '''
+    login_required = False
+
+    def get_data(self):
+        provider = HealthProvider.objects.filter(pk=self.kwargs['pk']).first()
+        if provider is None:
+            raise ApiError('provider not found', status=404)
+        try:
+            return slots.slots_for_query(provider, self.request.GET)
+        except slots.SlotQueryError as error:
+            raise ApiError(str(error))
+
+
+class PlanListApiView(ApiListView):
+    '''Therapy plans of the request user, newest first; ?status= filters'''
+    model = TherapyPlan
+    fields = (
+        'id', 'patient_id', 'health_provider_id', 'plan_type_id', 'status',
+        'start_date', 'cost', 'created_at', 'updated_at',
+    )
+    ordering = ('-created_at', '-id')
+
+    def get_queryset(self):
+        queryset = user_plans(self.request.user)
+        if self.request.GET.get('status'):
+            queryset = queryset.filter(status=self.request.GET['status'])
+        return queryset
+
+
+class SessionListApiView(ApiListView):
+    '''Sessions of the request user's plans, latest first; ?plan= and ?status= filter'''
+    model = Session
+    # session notes are the provider's own and stay out of the API
+    fields = (
+        'id', 'therapy_plan_id', 'session_date', 'session_time', 'duration', 'status',
+        'session_type', 'payment_status', 'follow_up_required', 'created_at', 'updated_at',
+    )
+    ordering = ('-session_date', '-session_time', '-id')
+
+    def get_queryset(self):
+        queryset = Session.objects.filter(therapy_plan__in=user_plans(self.request.user).values('pk'))
+        plan = integer_param(self.request, 'plan')
+        if plan is not None:
+            queryset = queryset.filter(therapy_plan=plan)
+        if self.request.GET.get('status'):
+            queryset = queryset.filter(status=self.request.GET['status'])
+        return queryset
@@ -0,0 +1,84 @@
+# mindwell/archive.py
+# Gracious Ogyiri Asare - gpoa@bu.edu
+# Hot/cold split of messages: old and closed-plan threads move to ArchivedMessage
+
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .locking import retry_on_locked
+from .models import ArchivedMessage, Message, TherapyPlan
+from . import unread
+
+BATCH_SIZE = 1000
+CLOSED_STATUSES = ('completed', 'cancelled')
+ARCHIVE_FIELDS = ('id', 'therapy_plan_id', 'sender_id', 'recipient_id', 'message', 'created_at')
+
+
+def archive_cutoff(days=None, now=None):
+    '''Messages created before this are archived'''
+    if days is None:
+        days = getattr(settings, 'MINDWELL_MESSAGE_ARCHIVE_DAYS', 365)
+    return (now or timezone.now()) - timedelta(days=days)
+
+
+def archivable_messages(days=None, now=None):
+    '''Live messages that are old enough, or belong to a completed or cancelled plan'''
+    closed = TherapyPlan.objects.filter(status__in=CLOSED_STATUSES).values('pk')
+    return Message.objects.filter(Q(created_at__lt=archive_cutoff(days, now)) | Q(therapy_plan__in=closed))
+
+
+@retry_on_locked
+def archive_batch(batch_size=BATCH_SIZE, days=None, now=None):
+    '''Move the oldest batch_size archivable messages in one transaction, return how many moved
+
+    Archived messages that were still unread stop counting, as for a delete,
+    but the counters of the batch are updated in bulk and the rows deleted
+    without the per-message post_delete handler.
+    '''
+    with transaction.atomic():
+        rows = list(archivable_messages(days, now).order_by('id').values(*ARCHIVE_FIELDS)[:batch_size])
+        if not rows:
+            return 0
+        ArchivedMessage.objects.bulk_create([ArchivedMessage(**row) for row in rows])
+        unread.forget_messages(rows)
+        delete_messages([row['id'] for row in rows])
+    return len(rows)
+
+
+def delete_messages(ids, chunk_size=500):
+    '''DELETE the messages with these ids directly
+
+    Message.delete() would fire the post_delete handler, which forgets each
+    unread message a second time after forget_messages already did. Nothing
+    references Message, so skipping the ORM loses no cascade. Chunked to stay
+    under SQLite's limit on query parameters.
+    '''
+    table = connection.ops.quote_name(Message._meta.db_table)
+    with connection.cursor() as cursor:
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            cursor.execute(f'DELETE FROM {table} WHERE id IN ({", ".join(["%s"] * len(chunk))})', chunk)
+
+
+def archive_messages(batch_size=BATCH_SIZE, days=None, now=None, log=None):
+    '''Archive every archivable message batch by batch, return the total moved
+
+    Each batch commits on its own, so the write lock is only held briefly
+    and an interrupted run resumes where it stopped.
+    '''
+    now = now or timezone.now()
+    total = 0
+    while True:
+        moved = archive_batch(batch_size, days, now)
+        total += moved
+        if log and moved:
+            log(f'Archived {total} messages')
+        if moved < batch_size:
+            return total
+
+
+def archived_thread(therapy_plan):
+    '''Archived messages of a plan, oldest first, read only when asked for'''
+    return ArchivedMessage.objects.filter(therapy_plan=therapy_plan).select_related('sender').order_by('created_at', 'id')
@@ -0,0 +1,60 @@
+# mindwell/benchmarks.py
+# Gracious Ogyiri Asare - gpoa@bu.edu
+# Helpers shared by the bench_* management commands
+
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings, setup_databases, teardown_databases
+
+
+@contextmanager
+def scratch_cache():
+    '''Point the default cache at a throwaway directory, so scratch pages and versions stay out of the live cache'''
+    with tempfile.TemporaryDirectory(prefix='mindwell-bench-cache-') as location:
+        with override_settings(CACHES={'default': {**settings.CACHES['default'], 'LOCATION': location}}):
+            yield
+
+
+@contextmanager
+def scratch_database(verbosity=0):
+    '''Run a benchmark against a throwaway test database and cache instead of db.sqlite3 and the live cache'''
+    with scratch_cache():
+        old_config = setup_databases(verbosity, interactive=False, aliases={'default'})
+        try:
+            yield
+        finally:
+            teardown_databases(old_config, verbosity)
+
+
+@contextmanager
+def explicit_timestamps(model, *field_names):
+    '''Let bulk_create keep the given auto_now_add values instead of stamping now()'''
+    fields = [model._meta.get_field(name) for name in field_names]
+    saved = [field.auto_now_add for field in fields]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, value in zip(fields, saved):
+            field.auto_now_add = value
+
+
+def measure(func, repeat=5):
+    '''Call func repeatedly and return timing (ms) and query count of the calls'''
+    timings = []
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        'p50_ms': round(statistics.median(timings), 2),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 2),
+        'queries': len(ctx.captured_queries),
+    }
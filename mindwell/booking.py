@@ -0,0 +1,158 @@
+# mindwell/booking.py
+# Gracious Ogyiri Asare - gpoa@bu.edu
+# Atomic, overlap-aware session reservation
+
+from datetime import datetime, timedelta
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .locking import retry_on_locked
+from .models import HealthProvider, Session
+from . import slots
+
+RESERVATION_ATTEMPTS = 8
+# a year of weekly sessions
+MAX_OCCURRENCES = 52
+
+
+class BookingConflict(ValidationError):
+    '''The requested session cannot be booked'''
+
+
+def lock_provider_schedule(provider_id):
+    '''Serialize bookings of one provider until the transaction ends
+
+    A no-op UPDATE of the provider row takes a row lock on databases with row
+    locking, and makes SQLite take its write lock before we read the schedule,
+    so two bookings cannot both check the same free slot.
+    '''
+    HealthProvider.objects.filter(pk=provider_id).update(verified=F('verified'))
+
+
+def overlaps(start, duration, booked):
+    '''True if [start, start + duration) minutes intersects any booked (start, end)'''
+    end = start + duration
+    return any(begin < end and start < finish for begin, finish in booked)
+
+
+def slot_conflict(session_date, session_time, duration, windows, booked, now):
+    '''BookingConflict for one slot given the weekly windows and that day's booked intervals, or None'''
+    if duration <= 0:
+        return BookingConflict('Session duration must be positive.', code='duration')
+    if datetime.combine(session_date, session_time) <= now.replace(tzinfo=None):
+        return BookingConflict('Sessions must be booked in the future.', code='past')
+
+    start = slots.to_minutes(session_time)
+    if not any(begin <= start and start + duration <= end for begin, end in windows.get(session_date.weekday(), [])):
+        return BookingConflict("That time is outside the provider's availability.", code='unavailable')
+    if overlaps(start, duration, booked.get(session_date, [])):
+        return BookingConflict('That time overlaps a session that is already booked.', code='overlap')
+    return None
+
+
+def check_slot(provider, session_date, session_time, duration, now=None):
+    '''Raise BookingConflict unless the slot is in the future, inside availability and free'''
+    now = timezone.localtime(now) if now else timezone.localtime()
+    conflict = slot_conflict(
+        session_date, session_time, duration,
+        slots.weekly_windows(provider),
+        slots.booked_intervals(provider, session_date, session_date),
+        now,
+    )
+    if conflict is not None:
+        raise conflict
+
+
+def with_schedule_lock(provider_id, book):
+    '''Run book() in a transaction holding the provider's schedule lock, retrying lock timeouts'''
+    @retry_on_locked(attempts=RESERVATION_ATTEMPTS)
+    def locked():
+        with transaction.atomic():
+            lock_provider_schedule(provider_id)
+            return book()
+    return locked()
+
+
+def reserve_session(therapy_plan, session_date, session_time, duration=60, **fields):
+    '''Book a scheduled session for therapy_plan, or raise BookingConflict'''
+    provider = therapy_plan.health_provider
+    fields.setdefault('status', 'scheduled')
+    fields.setdefault('payment_status', 'unpaid')
+
+    def book():
+        check_slot(provider, session_date, session_time, duration)
+        return Session.objects.create(
+            therapy_plan=therapy_plan,
+            session_date=session_date,
+            session_time=session_time,
+            duration=duration,
+            **fields,
+        )
+    return with_schedule_lock(provider.pk, book)
+
+
+class SeriesConflict(BookingConflict):
+    '''Some occurrences of a series cannot be booked; conflicts maps each date to its BookingConflict'''
+
+    def __init__(self, conflicts):
+        super().__init__([
+            ValidationError(f"{day:%a %b %d}: {conflict.message}", code=conflict.code)
+            for day, conflict in sorted(conflicts.items())
+        ])
+        self.conflicts = conflicts
+
+
+def series_dates(first_date, interval_weeks=1, occurrences=None, until=None):
+    '''Dates of a series every interval_weeks weeks, for occurrences dates or up to until'''
+    if occurrences is None and until is None:
+        raise ValueError('Give occurrences or until')
+    dates = []
+    day = first_date
+    while len(dates) < MAX_OCCURRENCES and (occurrences is None or len(dates) < occurrences) \
+            and (until is None or day <= until):
+        dates.append(day)
+        day += timedelta(weeks=interval_weeks)
+    return dates
+
+
+def check_series(provider, dates, session_time, duration, now=None):
+    '''{date: BookingConflict} of the occurrences that cannot be booked
+
+    Availability is read once and the booked sessions of the whole span with
+    one range query, however many occurrences there are.
+    '''
+    if not dates:
+        return {}
+    now = timezone.localtime(now) if now else timezone.localtime()
+    windows = slots.weekly_windows(provider)
+    booked = slots.booked_intervals(provider, min(dates), max(dates))
+    conflicts = {}
+    for day in dates:
+        conflict = slot_conflict(day, session_time, duration, windows, booked, now)
+        if conflict is not None:
+            conflicts[day] = conflict
+    return conflicts
+
+
+def reserve_series(therapy_plan, dates, session_time, duration=60, skip_conflicts=False, **fields):
+    '''Book one scheduled session per date in one bulk insert
+
+    Raises SeriesConflict if any occurrence is taken, unless skip_conflicts,
+    in which case only the free dates are booked. Returns (sessions, conflicts).
+    '''
+    provider = therapy_plan.health_provider
+    fields.setdefault('status', 'scheduled')
+    fields.setdefault('payment_status', 'unpaid')
+
+    def book():
+        conflicts = check_series(provider, dates, session_time, duration)
+        if conflicts and not skip_conflicts:
+            raise SeriesConflict(conflicts)
+        sessions = Session.objects.bulk_create([
+            Session(therapy_plan=therapy_plan, session_date=day, session_time=session_time,
+                    duration=duration, **fields)
+            for day in dates if day not in conflicts
+        ])
+        return sessions, conflicts
+    return with_schedule_lock(provider.pk, book)
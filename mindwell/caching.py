@@ -0,0 +1,176 @@
+# mindwell/caching.py
+# Gracious Ogyiri Asare - gpoa@bu.edu
+# Rendered provider fragments and anonymous pages, cached per version
+#
+# Versions are bumped by whichever process saved the change, so the default
+# cache must be shared by every server process (see CACHES in settings); with a
+# per-process memory cache the other workers keep serving the old fragments.
+
+import hashlib
+import time
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core import checks
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+# every rendered fragment of a provider embeds this version, bumped by signals.py
+VERSION_KEY = 'mindwell:provider-version:{}'
+CARD_KEY = 'mindwell:provider-card:{}:{}'
+PROFILE_KEY = 'mindwell:provider-profile:{}:{}'
+FRAGMENT_TIMEOUT = 60 * 60 * 24
+
+# any directory page may list any provider, so they share one version
+DIRECTORY_VERSION_KEY = 'mindwell:directory-version'
+PAGE_KEY = 'mindwell:page:{}'
+PAGE_TIMEOUT = 60 * 10
+
+# backends whose entries only the process that wrote them can see
+PROCESS_LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    '''Warn when the default cache cannot carry version bumps between processes'''
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend in PROCESS_LOCAL_BACKENDS:
+        return [checks.Warning(
+            f'The default cache ({backend}) is not shared between server processes.',
+            hint='Fragments and pages cached by other workers will not be invalidated; '
+                 'use a file, database, Redis or Memcached cache.',
+            id='mindwell.W001',
+        )]
+    return []
+
+
+def new_version():
+    '''A starting version that cannot match fragments cached before an eviction'''
+    return int(time.time() * 1000)
+
+
+def provider_versions(provider_ids):
+    '''{provider id: version} in one cache round trip'''
+    keys = {VERSION_KEY.format(pk): pk for pk in provider_ids}
+    found = cache.get_many(keys)
+    missing = {key: new_version() for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, None)
+        found.update(missing)
+    return {pk: found[key] for key, pk in keys.items()}
+
+
+def bump(key):
+    '''Increment a version key, restarting it if it was evicted'''
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, new_version(), None)
+
+
+def bump_provider(*provider_ids, directory=True):
+    '''Invalidate every cached fragment and page of the given providers
+
+    directory=False is for changes that only show on the profile page.
+    '''
+    for pk in provider_ids:
+        bump(VERSION_KEY.format(pk))
+    if provider_ids and directory:
+        bump_directory()
+
+
+def bump_directory():
+    '''Invalidate every cached directory page'''
+    bump(DIRECTORY_VERSION_KEY)
+
+
+def get_version(key):
+    '''Current value of a version key, starting it if it is missing'''
+    version = cache.get(key)
+    if version is None:
+        # add() keeps the version another process may have just started
+        cache.add(key, new_version(), None)
+        version = cache.get(key)
+    return version
+
+
+def directory_version():
+    '''Current version of the directory pages'''
+    return get_version(DIRECTORY_VERSION_KEY)
+
+
+def provider_cards(providers):
+    '''Concatenated directory cards of providers, rendering only the ones not cached'''
+    versions = provider_versions([provider.pk for provider in providers])
+    keys = [CARD_KEY.format(provider.pk, versions[provider.pk]) for provider in providers]
+    cards = cache.get_many(keys)
+    rendered = {}
+    for key, provider in zip(keys, providers):
+        if key not in cards:
+            rendered[key] = render_to_string('mindwell/provider_card.html', {'provider': provider})
+    if rendered:
+        cache.set_many(rendered, FRAGMENT_TIMEOUT)
+        cards.update(rendered)
+    return mark_safe(''.join(cards[key] for key in keys))
+
+
+def provider_profile(provider):
+    '''Profile, availability and plan types section of the detail page
+
+    The availability and plan type queries only run when the fragment is
+    rendered, so a cached profile costs one cache round trip.
+    '''
+    key = PROFILE_KEY.format(provider.pk, provider_versions([provider.pk])[provider.pk])
+    html = cache.get(key)
+    if html is None:
+        html = render_to_string('mindwell/provider_profile.html', {
+            'provider': provider,
+            'availability_by_day': provider.get_availability_by_day(),
+            'plan_types': provider.get_supported_plan_types(),
+        })
+        cache.set(key, html, FRAGMENT_TIMEOUT)
+    return mark_safe(html)
+
+
+def can_share_page(request):
+    '''True if the response to request is the same for every anonymous visitor'''
+    if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+        return False
+    # flash messages are shown once to one visitor; len() does not consume them
+    return not len(get_messages(request))
+
+
+class AnonymousPageCacheMixin:
+    '''Serve whole pages to logged-out visitors from the cache
+
+    Views provide get_page_cache_key(), which must include the version of
+    everything the page shows. Responses that set cookies (CSRF, session) or
+    are not a plain 200 are never stored. Pages and versions both live in the
+    shared default cache, so a bump by any worker retires the pages of all.
+    '''
+
+    def get_page_cache_key(self):
+        raise NotImplementedError
+
+    def dispatch(self, request, *args, **kwargs):
+        if not can_share_page(request):
+            return super().dispatch(request, *args, **kwargs)
+
+        key = PAGE_KEY.format(hashlib.md5(self.get_page_cache_key().encode()).hexdigest())
+        cached = cache.get(key)
+        if cached is not None:
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+
+        response = super().dispatch(request, *args, **kwargs)
+        if hasattr(response, 'render') and callable(response.render):
+            response.render()
+        csrf_used = request.META.get('CSRF_COOKIE_NEEDS_UPDATE') or request.META.get('CSRF_COOKIE_USED')
+        if (request.method == 'GET' and response.status_code == 200 and not response.streaming
+                and not response.cookies and not csrf_used):
+            cache.set(key, (response.content, response['Content-Type']), PAGE_TIMEOUT)
+        return response
@@ -0,0 +1,37 @@
+# mindwell/dashboards.py
+# Gracious Ogyiri Asare - gpoa@bu.edu
+# Dashboard data loaders: every list is loaded once with its related rows
+
+from datetime import date
+from .models import Session, TherapyPlan
+
+
+def load_provider_dashboard(provider, today=None):
+    '''Sessions and plans for the provider dashboard, in a fixed number of queries'''
+    today = today or date.today()
+    upcoming_sessions = list(provider.get_upcoming_sessions())
+    # upcoming sessions are ordered by date, so today's are the leading ones
+    today_sessions = [session for session in upcoming_sessions if session.session_date == today]
+    active_plans = list(provider.get_active_plans())
+    return {
+        'upcoming_sessions': upcoming_sessions,
+        'today_sessions': today_sessions,
+        'active_plans': active_plans,
+        'upcoming_count': len(upcoming_sessions),
+        'today_count': len(today_sessions),
+        'active_count': len(active_plans),
+    }
+
+
+def load_patient_dashboard(patient, history=10):
+    '''Sessions and plans for the patient dashboard, in a fixed number of queries'''
+    return {
+        'active_plans': list(patient.get_active_plans()),
+        'all_plans': TherapyPlan.objects.filter(patient=patient).select_related(
+            'health_provider', 'plan_type').order_by('-created_at'),
+        'upcoming_sessions': list(patient.get_upcoming_sessions()),
+        'past_sessions': list(Session.objects.filter(
+            therapy_plan__patient=patient,
+            status__in=['completed', 'cancelled', 'no-show']
+        ).select_related('therapy_plan__health_provider').order_by('-session_date', '-session_time')[:history]),
+    }
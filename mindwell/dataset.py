@@ -0,0 +1,261 @@
+# mindwell/dataset.py
+# Gracious Ogyiri Asare - gpoa@bu.edu
+# Synthetic data at production scale, written in batches with bulk_create
+
+import random
+from datetime import time, timedelta
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+from django.utils.text import slugify
+from .benchmarks import explicit_timestamps
+from .models import (
+    DAYS_OF_WEEK, Availability, HealthProvider, LanguageTag, Message, Patient,
+    PlanType, Session, SpecializationTag, TherapyPlan, ThreadReadState,
+)
+from . import search, tags, unread
+
+DEFAULT_SIZES = {
+    'providers': 20_000,
+    'patients': 50_000,
+    'plans': 200_000,
+    'sessions': 500_000,
+    'messages': 2_000_000,
+}
+BATCH_SIZE = 5_000
+PASSWORD = 'MindWell123!'
+
+FIRST_NAMES = ['Aisha', 'Kwame', 'Maria', 'Chen', 'Fatima', 'David', 'Priya', 'Samuel', 'Yuki', 'Ama',
+               'Lucas', 'Sofia', 'Omar', 'Grace', 'Mateo', 'Zara', 'Daniel', 'Leila', 'Noah', 'Esi']
+LAST_NAMES = ['Bello', 'Mensah', 'Garcia', 'Wang', 'Khan', 'Cohen', 'Patel', 'Okafor', 'Tanaka', 'Asare',
+              'Silva', 'Rossi', 'Haddad', 'Kim', 'Lopez', 'Ahmed', 'Smith', 'Nguyen', 'Brown', 'Boateng']
+SPECIALIZATIONS = ['Anxiety', 'Depression', 'Trauma', 'PTSD', 'Grief', 'Couples Therapy', 'Family Therapy',
+                   'Addiction', 'ADHD', 'Eating Disorders', 'OCD', 'Stress Management', 'Child Psychology']
+LANGUAGES = ['English', 'Spanish', 'French', 'Mandarin', 'Arabic', 'Twi', 'Hindi', 'Portuguese', 'Japanese']
+PLAN_TYPES = [('Individual Therapy', 120), ('Family Therapy', 180), ('Kids Therapy', 100),
+              ('Weekly Video Therapy', 140), ('Messaging Support', 60)]
+MESSAGES = ['How are you feeling this week?', 'Thank you, the breathing exercise helped.',
+            'Can we move our next session?', 'Please fill in the mood journal before Friday.',
+            'I had a difficult day yesterday.', 'Great progress, keep it up.']
+
+
+def batched(rows, size=BATCH_SIZE):
+    '''Split an iterable of model instances into lists of at most size'''
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def bulk_insert(model, rows, batch_size=BATCH_SIZE):
+    '''bulk_create rows batch by batch and return the new primary keys'''
+    ids = []
+    for batch in batched(rows, batch_size):
+        with transaction.atomic():
+            ids.extend(obj.pk for obj in model.objects.bulk_create(batch))
+    return ids
+
+
+def create_users(prefix, role, count, password_hash):
+    '''count users named prefix-role-N, all sharing one password hash'''
+    return bulk_insert(User, (
+        User(username=f'{prefix}-{role}-{i}', password=password_hash) for i in range(count)
+    ))
+
+
+def create_tags(tag_model, names):
+    '''{name: tag id} for the given names, creating the missing tags'''
+    tag_model.objects.bulk_create(
+        [tag_model(name=name, slug=slugify(name)) for name in names], ignore_conflicts=True,
+    )
+    by_slug = dict(tag_model.objects.filter(slug__in=[slugify(n) for n in names]).values_list('slug', 'id'))
+    return {name: by_slug[slugify(name)] for name in names}
+
+
+def create_providers(rng, prefix, count, password_hash):
+    '''Providers with weekly availability, tags and supported plan types'''
+    user_ids = create_users(prefix, 'provider', count, password_hash)
+    profiles = []
+
+    def providers():
+        for i, user_id in enumerate(user_ids):
+            specializations = rng.sample(SPECIALIZATIONS, rng.randint(1, 3))
+            languages = ['English'] + rng.sample(LANGUAGES[1:], rng.randint(0, 2))
+            profiles.append((specializations, languages))
+            first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            yield HealthProvider(
+                user_id=user_id, first_name=first, last_name=last,
+                email=f'{prefix}.provider{i}@example.com',
+                gender=rng.choice(['male', 'female', 'other']),
+                occupation='Licensed Therapist',
+                specialization=', '.join(specializations),
+                languages=', '.join(languages),
+                experience_years=rng.randint(1, 30),
+                bio=f'{first} {last} helps clients with {specializations[0].lower()}.',
+            )
+
+    provider_ids = bulk_insert(HealthProvider, providers())
+
+    # tags through rows directly, the per-provider sync_provider_tags would be one query per row
+    specialization_ids = create_tags(SpecializationTag, SPECIALIZATIONS)
+    language_ids = create_tags(LanguageTag, LANGUAGES)
+    SpecializationThrough = HealthProvider.specialization_tags.through
+    LanguageThrough = HealthProvider.language_tags.through
+    bulk_insert(SpecializationThrough, (
+        SpecializationThrough(healthprovider_id=pid, specializationtag_id=specialization_ids[name])
+        for pid, (specializations, _) in zip(provider_ids, profiles) for name in specializations
+    ))
+    bulk_insert(LanguageThrough, (
+        LanguageThrough(healthprovider_id=pid, languagetag_id=language_ids[name])
+        for pid, (_, languages) in zip(provider_ids, profiles) for name in languages
+    ))
+
+    def availability():
+        for pid in provider_ids:
+            for day in rng.sample(DAYS_OF_WEEK[:5], rng.randint(2, 5)):
+                start = rng.choice([8, 9, 10, 13])
+                yield Availability(health_provider_id=pid, day_of_week=day,
+                                   start_time=time(start), end_time=time(start + rng.choice([3, 4, 6])))
+
+    bulk_insert(Availability, availability())
+
+    plan_type_ids = []
+    for name, cost in PLAN_TYPES:
+        plan_type, _ = PlanType.objects.get_or_create(name=name, defaults={'base_cost': cost})
+        plan_type_ids.append(plan_type.pk)
+    PlanTypeThrough = PlanType.providers.through
+    bulk_insert(PlanTypeThrough, (
+        PlanTypeThrough(plantype_id=type_id, healthprovider_id=pid)
+        for pid in provider_ids for type_id in rng.sample(plan_type_ids, rng.randint(1, 3))
+    ))
+    return list(zip(provider_ids, user_ids)), plan_type_ids
+
+
+def create_patients(rng, prefix, count, password_hash):
+    '''Patients with their users, as [(patient id, user id)]'''
+    user_ids = create_users(prefix, 'patient', count, password_hash)
+    patient_ids = bulk_insert(Patient, (
+        Patient(
+            user_id=user_id, first_name=rng.choice(FIRST_NAMES), last_name=rng.choice(LAST_NAMES),
+            email=f'{prefix}.patient{i}@example.com', gender=rng.choice(['male', 'female', 'other']),
+            insurance_provider=rng.choice(['Aetna', 'BlueCross', 'Cigna', '']),
+        )
+        for i, user_id in enumerate(user_ids)
+    ))
+    return list(zip(patient_ids, user_ids))
+
+
+def create_plans(rng, count, providers, patients, plan_type_ids):
+    '''Therapy plans as [(plan id, patient user id, provider user id)]'''
+    pairs = [(rng.choice(patients), rng.choice(providers)) for _ in range(count)]
+    today = timezone.localdate()
+    plan_ids = bulk_insert(TherapyPlan, (
+        TherapyPlan(
+            patient_id=patient_id, health_provider_id=provider_id,
+            plan_type_id=rng.choice(plan_type_ids),
+            status=rng.choices(['active', 'paused', 'completed', 'cancelled'], [6, 1, 2, 1])[0],
+            start_date=today - timedelta(days=rng.randint(0, 365)),
+        )
+        for (patient_id, _), (provider_id, _) in pairs
+    ))
+    return [(plan_id, patient[1], provider[1]) for plan_id, (patient, provider) in zip(plan_ids, pairs)]
+
+
+def create_sessions(rng, count, plans):
+    '''Sessions spread from six months ago to two months ahead'''
+    today = timezone.localdate()
+
+    def sessions():
+        for _ in range(count):
+            plan_id = rng.choice(plans)[0]
+            day = today + timedelta(days=rng.randint(-180, 60))
+            upcoming = day >= today
+            yield Session(
+                therapy_plan_id=plan_id, session_date=day, session_time=time(rng.randint(8, 17)),
+                duration=rng.choice([30, 60, 60, 90]),
+                status='scheduled' if upcoming else rng.choices(['completed', 'cancelled', 'no-show'], [8, 1, 1])[0],
+                session_type=rng.choice(['message', 'audio', 'video']),
+                payment_status='unpaid' if upcoming else 'paid',
+            )
+
+    return len(bulk_insert(Session, sessions()))
+
+
+def create_messages(rng, count, plans):
+    '''Messages over the last year, with their original timestamps'''
+    start = timezone.now() - timedelta(days=365)
+    step = timedelta(days=365) / max(count, 1)
+
+    def messages():
+        for i in range(count):
+            plan_id, patient_user_id, provider_user_id = rng.choice(plans)
+            from_patient = rng.random() < 0.5
+            yield Message(
+                therapy_plan_id=plan_id,
+                sender_id=patient_user_id if from_patient else provider_user_id,
+                recipient_id=provider_user_id if from_patient else patient_user_id,
+                message=rng.choice(MESSAGES),
+                created_at=start + step * i,
+            )
+
+    with explicit_timestamps(Message, 'created_at'):
+        return len(bulk_insert(Message, messages()))
+
+
+def create_read_states(rng, unread_share=0.1, caught_up=0.5):
+    '''Read cursors: caught_up of the threads fully read, the rest up to the oldest 1 - unread_share of all messages
+
+    Counts are left at zero for unread.rebuild() to fill in.
+    '''
+    cutoff = Message.objects.order_by('id').values_list('id', flat=True)[
+        int(Message.objects.count() * (1 - unread_share)):].first() or 0
+    rows = Message.objects.order_by().values('recipient_id', 'therapy_plan_id').annotate(
+        newest=Max('id'), read_to=Max('id', filter=Q(id__lt=cutoff)),
+    )
+
+    def states():
+        for row in rows.iterator():
+            yield ThreadReadState(
+                user_id=row['recipient_id'],
+                therapy_plan_id=row['therapy_plan_id'],
+                last_read_id=row['newest'] if rng.random() < caught_up else row['read_to'] or 0,
+            )
+
+    return len(bulk_insert(ThreadReadState, states()))
+
+
+def generate(sizes=None, prefix='synthetic', seed=412, log=None):
+    '''Fill the database with synthetic providers, patients, plans, sessions and messages
+
+    Signals do not fire on bulk_create, so the search index, the tag index and
+    the unread counters are rebuilt once at the end instead of per row; the
+    generated read cursors leave roughly the newest tenth of messages unread.
+    '''
+    sizes = {**DEFAULT_SIZES, **(sizes or {})}
+    log = log or (lambda text: None)
+    rng = random.Random(seed)
+    password_hash = make_password(PASSWORD)
+
+    providers, plan_type_ids = create_providers(rng, prefix, sizes['providers'], password_hash)
+    log(f'{len(providers)} providers')
+    patients = create_patients(rng, prefix, sizes['patients'], password_hash)
+    log(f'{len(patients)} patients')
+    plans = create_plans(rng, sizes['plans'], providers, patients, plan_type_ids)
+    log(f'{len(plans)} therapy plans')
+    log(f'{create_sessions(rng, sizes["sessions"], plans)} sessions')
+    log(f'{create_messages(rng, sizes["messages"], plans)} messages')
+    log(f'{create_read_states(rng)} thread read cursors')
+
+    if search.is_available():
+        with transaction.atomic():
+            search.rebuild_index()
+    tags.invalidate_index()
+    unread.rebuild()
+    log('rebuilt search index, tag index and unread counters')
+    return sizes
@@ -3,7 +3,8 @@
 
 from django import forms
 from .models import HealthProvider, Patient, TherapyPlan, Session, Availability, Message
-from datetime import date
+from datetime import date, datetime
+from . import booking, schedule
 
 class CreateProviderForm(forms.ModelForm):
     '''A form to create a new provider profile'''
@@ -53,6 +54,9 @@ class CreateTherapyPlanForm(forms.ModelForm):
 
 class CreateSessionForm(forms.ModelForm):
     '''A form to book a session based on provider availability'''
+    slot = forms.ChoiceField(required=False, label='Open slot')
+    field_order = ['slot', 'session_date', 'session_time', 'duration', 'session_type']
+    
     class Meta:
         model = Session
         fields = ['session_date', 'session_time', 'duration', 'session_type']
@@ -63,16 +67,43 @@ class CreateSessionForm(forms.ModelForm):
     
     def __init__(self, *args, **kwargs):
         therapy_plan = kwargs.pop('therapy_plan', None)
+        slots = kwargs.pop('slots', None)
         super().__init__(*args, **kwargs)
         
         # Set minimum date to today
         self.fields['session_date'].widget.attrs['min'] = date.today()
         
+        # Offer the open slots, grouped by day; date and time then become optional
+        if slots is None:
+            del self.fields['slot']
+        else:
+            self.fields['slot'].choices = [('', 'Pick an open slot or enter a date and time')] + [
+                (day.strftime('%A, %b %d'), [
+                    (datetime.combine(day, start).strftime('%Y-%m-%dT%H:%M'), start.strftime('%I:%M %p').lstrip('0'))
+                    for start in times
+                ])
+                for day, times in slots.items()
+            ]
+            self.fields['session_date'].required = False
+            self.fields['session_time'].required = False
+        
         # Add help text about availability
         if therapy_plan:
             provider = therapy_plan.health_provider
             self.fields['session_date'].help_text = f"Check Dr. {provider.last_name}'s availability below"
             self.fields['session_time'].help_text = "Choose a time within available hours"
+    
+    def clean(self):
+        '''Use the picked slot as date and time'''
+        cleaned_data = super().clean()
+        slot = cleaned_data.get('slot')
+        if slot:
+            start = datetime.strptime(slot, '%Y-%m-%dT%H:%M')
+            cleaned_data['session_date'] = start.date()
+            cleaned_data['session_time'] = start.time()
+        elif 'slot' in self.fields and not (cleaned_data.get('session_date') and cleaned_data.get('session_time')):
+            raise forms.ValidationError('Pick an open slot, or enter both a date and a time.')
+        return cleaned_data
 
 class UpdateSessionForm(forms.ModelForm):
     '''A form to update session details (for providers)'''
@@ -90,6 +121,83 @@ class AvailabilityForm(forms.ModelForm):
             'end_time': forms.TimeInput(attrs={'type': 'time'}),
         }
 
+class SessionSeriesForm(forms.Form):
+    '''A form to book a weekly or biweekly series of sessions'''
+    first_date = forms.DateField(widget=forms.DateInput(attrs={'type': 'date'}))
+    session_time = forms.TimeField(widget=forms.TimeInput(attrs={'type': 'time'}))
+    duration = forms.IntegerField(initial=60, min_value=30)
+    session_type = forms.ChoiceField(choices=Session._meta.get_field('session_type').choices)
+    interval_weeks = forms.TypedChoiceField(
+        label='Repeat', coerce=int, choices=[(1, 'Every week'), (2, 'Every other week')],
+    )
+    occurrences = forms.IntegerField(required=False, min_value=2, max_value=booking.MAX_OCCURRENCES,
+                                     help_text='Number of sessions')
+    until = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}),
+                            help_text='Or book up to this date')
+    skip_conflicts = forms.BooleanField(required=False, label='Skip dates that are taken')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['first_date'].widget.attrs['min'] = date.today()
+
+    def clean(self):
+        '''Require exactly one of occurrences and until, and an until within MAX_OCCURRENCES'''
+        cleaned_data = super().clean()
+        occurrences, until = cleaned_data.get('occurrences'), cleaned_data.get('until')
+        first_date, interval_weeks = cleaned_data.get('first_date'), cleaned_data.get('interval_weeks')
+        if (occurrences is None) == (until is None):
+            raise forms.ValidationError('Give either a number of sessions or an end date.')
+        if until and first_date and until < first_date:
+            raise forms.ValidationError('The end date must not be before the first session.')
+        if until and first_date and interval_weeks \
+                and (until - first_date).days // (7 * interval_weeks) + 1 > booking.MAX_OCCURRENCES:
+            raise forms.ValidationError(
+                f'A series can have at most {booking.MAX_OCCURRENCES} sessions; choose an earlier end date.'
+            )
+        return cleaned_data
+
+    def dates(self):
+        return booking.series_dates(
+            self.cleaned_data['first_date'], self.cleaned_data['interval_weeks'],
+            self.cleaned_data['occurrences'], self.cleaned_data['until'],
+        )
+
+class BaseWeeklyScheduleFormSet(forms.BaseModelFormSet):
+    '''The whole weekly schedule of a provider, validated as one batch'''
+
+    def windows(self):
+        '''Window dicts of the kept rows, with the id of the row each one edits'''
+        windows = []
+        for form in self.forms:
+            if not form.has_changed() and form.instance.pk is None:
+                continue  # blank extra row
+            if self.can_delete and self._should_delete_form(form):
+                continue
+            window = {name: form.cleaned_data[name] for name in schedule.WINDOW_FIELDS}
+            window['id'] = form.instance.pk
+            windows.append(window)
+        return windows
+
+    def clean(self):
+        super().clean()
+        if any(self.errors):
+            return
+        windows = self.windows()
+        for window in windows:
+            if window['start_time'] >= window['end_time']:
+                raise forms.ValidationError(
+                    f"{window['day_of_week'].title()} {window['start_time']:%H:%M} must end after it starts."
+                )
+        for first, second in schedule.find_overlaps(windows):
+            raise forms.ValidationError(
+                f"{first['day_of_week'].title()} {first['start_time']:%H:%M}-{first['end_time']:%H:%M} "
+                f"overlaps {second['start_time']:%H:%M}-{second['end_time']:%H:%M}."
+            )
+
+WeeklyScheduleFormSet = forms.modelformset_factory(
+    Availability, form=AvailabilityForm, formset=BaseWeeklyScheduleFormSet, extra=3, can_delete=True,
+)
+
 # class PatientNoteForm(forms.ModelForm):
 #     '''A form for providers to add notes about patient progress'''
 #     class Meta:
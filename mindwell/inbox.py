@@ -0,0 +1,44 @@
+# mindwell/inbox.py
+# Gracious Ogyiri Asare - gpoa@bu.edu
+# Message thread queries for the inbox
+
+from django.db.models import DateTimeField, IntegerField, OuterRef, Q, Subquery, TextField
+from django.db.models.functions import Coalesce
+from .models import ArchivedMessage, HealthProvider, Message, Patient, TherapyPlan, ThreadReadState
+
+
+def user_plans(user):
+    '''Therapy plans the user takes part in, as patient or as provider'''
+    # compare the plan's own columns so each side of the OR can use its index
+    return TherapyPlan.objects.filter(
+        Q(patient__in=Patient.objects.filter(user=user).values('pk')) |
+        Q(health_provider__in=HealthProvider.objects.filter(user=user).values('pk'))
+    )
+
+
+def inbox_threads(user):
+    '''The user's therapy plans that have messages, annotated with the latest one and unread_count
+
+    Each plan carries last_message and last_message_at of its newest live
+    message, or of its newest archived one once the whole thread has been
+    archived, so archived threads stay listed. The latest message is looked
+    up per plan rather than per message, so the cost follows the number of
+    threads instead of the size of the history.
+    '''
+    def latest(model, field):
+        rows = model.objects.filter(therapy_plan=OuterRef('pk')).order_by('-created_at', '-id')
+        return Subquery(rows.values(field)[:1])
+
+    # maintained by unread.py, so this is a unique-key lookup per thread
+    unread = ThreadReadState.objects.filter(therapy_plan=OuterRef('pk'), user=user).values('count')
+
+    # COALESCE stops at the live message, so the archive is only read for fully archived threads
+    return user_plans(user).annotate(
+        last_message_at=Coalesce(
+            latest(Message, 'created_at'), latest(ArchivedMessage, 'created_at'), output_field=DateTimeField(),
+        ),
+        last_message=Coalesce(latest(Message, 'message'), latest(ArchivedMessage, 'message'), output_field=TextField()),
+        unread_count=Coalesce(Subquery(unread, output_field=IntegerField()), 0),
+    ).filter(
+        last_message_at__isnull=False,
+    ).select_related('patient', 'health_provider', 'plan_type')
@@ -0,0 +1,38 @@
+# mindwell/locking.py
+# Gracious Ogyiri Asare - gpoa@bu.edu
+# Retry of write transactions that lose the race for SQLite's write lock
+
+import functools
+import random
+import time
+from django.db import OperationalError, transaction
+
+LOCK_ATTEMPTS = 8
+BASE_DELAY = 0.01
+
+
+def is_lock_error(error):
+    '''True for SQLite "database is locked" / "table is locked" errors'''
+    return 'locked' in str(error)
+
+
+def retry_on_locked(func=None, *, attempts=LOCK_ATTEMPTS, base_delay=BASE_DELAY):
+    '''Rerun func, with jittered exponential backoff, when SQLite reports a lock error
+
+    func must open its own transaction so a retry starts from scratch. Inside
+    an outer atomic block the error is raised at once, since only the
+    outermost transaction can be rerun.
+    '''
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            for attempt in range(attempts):
+                try:
+                    return func(*args, **kwargs)
+                except OperationalError as error:
+                    if (not is_lock_error(error) or attempt == attempts - 1
+                            or transaction.get_connection().in_atomic_block):
+                        raise
+                    time.sleep(random.uniform(0, base_delay * 2 ** attempt))
+        return wrapper
+    return decorate(func) if func is not None else decorate
@@ -0,0 +1,18 @@
+# mindwell/management/commands/archive_messages.py
+# Gracious Ogyiri Asare - gpoa@bu.edu
+
+from django.core.management.base import BaseCommand
+from mindwell import archive
+
+
+class Command(BaseCommand):
+    help = 'Move old messages, and those of completed or cancelled plans, to the archive table in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Archive messages older than this (default MINDWELL_MESSAGE_ARCHIVE_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=archive.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        total = archive.archive_messages(options['batch_size'], options['days'], log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(f'Archived {total} messages.'))
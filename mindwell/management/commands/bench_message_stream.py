@@ -0,0 +1,122 @@
+# mindwell/management/commands/bench_message_stream.py
+# Gracious Ogyiri Asare - gpoa@bu.edu
+
+import asyncio
+import json
+import statistics
+import time
+import tracemalloc
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.urls import reverse
+from mindwell.benchmarks import scratch_database
+from mindwell.models import HealthProvider, Patient, PlanType, TherapyPlan
+from mindwell import realtime
+
+
+class StreamConnection:
+    '''One SSE client driven directly through the ASGI application'''
+
+    def __init__(self, app, path, cookie):
+        self.app = app
+        self.scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+            'query_string': b'', 'root_path': '',
+            'headers': [(b'host', b'testserver'), (b'cookie', cookie.encode())],
+            'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+        }
+        self.connected = asyncio.Event()
+        self.disconnect = asyncio.Event()
+        self.body_sent = False
+        self.arrivals = {}
+
+    async def receive(self):
+        if not self.body_sent:
+            self.body_sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await self.disconnect.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(self, message):
+        if message['type'] != 'http.response.body':
+            return
+        self.connected.set()
+        for line in message.get('body', b'').decode().splitlines():
+            if line.startswith('id: '):
+                self.arrivals[int(line[4:])] = time.perf_counter()
+
+    async def run(self):
+        await self.app(self.scope, self.receive, self.send)
+
+
+class Command(BaseCommand):
+    help = 'Hold many message streams open on one ASGI worker and time the fan-out of new messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=1000)
+        parser.add_argument('--messages', type=int, default=20)
+
+    def seed(self):
+        '''A therapy plan and the session cookie of its patient'''
+        provider_user = User.objects.create(username='stream-provider')
+        patient_user = User.objects.create(username='stream-patient')
+        plan = TherapyPlan.objects.create(
+            patient=Patient.objects.create(user=patient_user),
+            health_provider=HealthProvider.objects.create(user=provider_user),
+            plan_type=PlanType.objects.create(name='Bench'),
+            status='active',
+        )
+        client = Client()
+        client.force_login(patient_user)
+        return plan, f'sessionid={client.cookies["sessionid"].value}'
+
+    async def bench(self, plan, cookie, connections, messages):
+        from project.asgi import application
+
+        path = reverse('message_stream', args=[plan.pk])
+        topic = realtime.plan_topic(plan.pk)
+        hub = realtime.get_hub()
+
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        clients = [StreamConnection(application, path, cookie) for _ in range(connections)]
+        tasks = [asyncio.create_task(client.run()) for client in clients]
+        await asyncio.gather(*(client.connected.wait() for client in clients))
+        connect_s = time.perf_counter() - start
+        while hub.listener_count(topic) < connections:
+            await asyncio.sleep(0.01)
+        memory = tracemalloc.get_traced_memory()[0] - baseline
+        tracemalloc.stop()
+
+        fanout = []
+        for event_id in range(1, messages + 1):
+            sent = time.perf_counter()
+            # from the provider, so every stream also advances the patient's read cursor
+            hub.publish(topic, {'id': event_id, 'therapy_plan': plan.pk, 'sender_id': plan.health_provider.user_id,
+                                'message': 'ping'})
+            while not all(event_id in client.arrivals for client in clients):
+                await asyncio.sleep(0.001)
+            fanout.append(max(client.arrivals[event_id] for client in clients) - sent)
+
+        for client in clients:
+            client.disconnect.set()
+        await asyncio.wait(tasks, timeout=10)
+        fanout_ms = sorted(seconds * 1000 for seconds in fanout)
+        return {
+            'connections': connections,
+            'messages': messages,
+            'connect_s': round(connect_s, 2),
+            'memory_kb_per_connection': round(memory / connections / 1024, 1),
+            'fanout_p50_ms': round(statistics.median(fanout_ms), 2),
+            'fanout_p95_ms': round(fanout_ms[min(len(fanout_ms) - 1, int(len(fanout_ms) * 0.95))], 2),
+            'fanout_max_ms': round(fanout_ms[-1], 2),
+        }
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            plan, cookie = self.seed()
+            results = asyncio.run(self.bench(plan, cookie, options['connections'], options['messages']))
+        self.stdout.write(json.dumps(results, indent=2))
@@ -0,0 +1,100 @@
+# mindwell/management/commands/bench_message_threads.py
+# Gracious Ogyiri Asare - gpoa@bu.edu
+
+import json
+import random
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils import timezone
+from mindwell.benchmarks import explicit_timestamps, measure, scratch_database
+from mindwell.inbox import inbox_threads
+from mindwell.models import HealthProvider, Message, Patient, PlanType, TherapyPlan, ThreadReadState
+from mindwell import dataset, unread
+
+
+def python_threads(user):
+    '''The previous inbox: walk every message, keeping the first one per plan and counting unread ones
+
+    Returns every thread, newest first, as (plan id, latest message, unread count).
+    '''
+    read_up_to = dict(ThreadReadState.objects.filter(user=user).values_list('therapy_plan_id', 'last_read_id'))
+    threads_by_plan = {}
+    unread_by_plan = {}
+    queryset = Message.objects.filter(Q(sender=user) | Q(recipient=user)).select_related(
+        'therapy_plan__patient', 'therapy_plan__health_provider', 'therapy_plan__plan_type',
+    ).order_by('-created_at', '-id')
+    for m in queryset:
+        if m.therapy_plan_id not in threads_by_plan:
+            threads_by_plan[m.therapy_plan_id] = m
+        if m.recipient_id == user.pk and m.pk > read_up_to.get(m.therapy_plan_id, 0):
+            unread_by_plan[m.therapy_plan_id] = unread_by_plan.get(m.therapy_plan_id, 0) + 1
+    return [(pk, m.message, unread_by_plan.get(pk, 0)) for pk, m in threads_by_plan.items()]
+
+
+def sql_threads(user):
+    '''The current inbox: one aggregated query over the threads, same shape as python_threads'''
+    return [
+        (plan.pk, plan.last_message, plan.unread_count)
+        for plan in inbox_threads(user).order_by('-last_message_at', '-id')
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Compare Python-side and SQL-side inbox thread building on a scratch database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=100_000)
+        parser.add_argument('--plans', type=int, default=300)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def seed(self, plan_count, message_count):
+        '''One provider with plan_count patients and message_count messages between them'''
+        provider_user = User.objects.create(username='bench-provider')
+        provider = HealthProvider.objects.create(user=provider_user, last_name='Bench')
+        plan_type = PlanType.objects.create(name='Bench')
+        users = User.objects.bulk_create(User(username=f'bench-patient-{i}') for i in range(plan_count))
+        patients = Patient.objects.bulk_create(Patient(user=u) for u in users)
+        plans = TherapyPlan.objects.bulk_create(
+            TherapyPlan(patient=p, health_provider=provider, plan_type=plan_type, status='active') for p in patients
+        )
+
+        start = timezone.now() - timedelta(days=365)
+        rng = random.Random(412)
+        batch = []
+        for i in range(message_count):
+            index = rng.randrange(plan_count)
+            from_patient = rng.random() < 0.5
+            batch.append(Message(
+                therapy_plan=plans[index],
+                sender=users[index] if from_patient else provider_user,
+                recipient=provider_user if from_patient else users[index],
+                message='How are you feeling this week?',
+                created_at=start + timedelta(minutes=i),
+            ))
+            if len(batch) == 10_000:
+                with explicit_timestamps(Message, 'created_at'):
+                    Message.objects.bulk_create(batch)
+                batch = []
+        with explicit_timestamps(Message, 'created_at'):
+            Message.objects.bulk_create(batch)
+        dataset.create_read_states(rng)
+        unread.rebuild()  # bulk_create skips the signals that maintain the counters
+        return provider_user
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            user = self.seed(options['plans'], options['messages'])
+            # only equal work is worth timing
+            threads = sql_threads(user)
+            if python_threads(user) != threads:
+                raise CommandError('python_threads and sql_threads disagree')
+            results = {
+                'messages': options['messages'],
+                'plans': options['plans'],
+                'threads': len(threads),
+                'python_threads': measure(lambda: python_threads(user), options['repeat']),
+                'sql_threads': measure(lambda: sql_threads(user), options['repeat']),
+            }
+        self.stdout.write(json.dumps(results, indent=2))
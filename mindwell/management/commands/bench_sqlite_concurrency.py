@@ -0,0 +1,131 @@
+# mindwell/management/commands/bench_sqlite_concurrency.py
+# Gracious Ogyiri Asare - gpoa@bu.edu
+
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, transaction
+from mindwell.benchmarks import scratch_cache
+from mindwell.locking import is_lock_error, retry_on_locked
+from mindwell.models import HealthProvider, Message, Patient, PlanType, TherapyPlan
+from mindwell import unread
+
+# (database OPTIONS, CONN_MAX_AGE, retry lock errors) of each mode
+MODES = {
+    'stock': ({}, 0, False),
+    'hardened': (settings.SQLITE_OPTIONS, 600, True),
+}
+
+
+def use_database(path, mode):
+    '''Point the default connection at path with the settings of mode'''
+    options, max_age, _ = MODES[mode]
+    connection.close()
+    connection.settings_dict.update({'NAME': path, 'OPTIONS': dict(options), 'CONN_MAX_AGE': max_age})
+
+
+def init_worker(path, mode):
+    '''Process pool initializer: one worker process per server process being simulated'''
+    django.setup()
+    use_database(path, mode)
+
+
+def send(plan_id, sender_id, recipient_id):
+    '''A message send: the message and its unread counters in one transaction'''
+    with transaction.atomic():
+        Message.objects.create(therapy_plan_id=plan_id, sender_id=sender_id, recipient_id=recipient_id, message='ping')
+
+
+def write_loop(mode, plan_id, sender_id, recipient_id, writes, start_at):
+    '''Worker: alternate message sends and mark-reads, return (ok, lock errors, seconds)'''
+    retry = MODES[mode][2]
+    send_one = retry_on_locked(send) if retry else send
+    # the stock run goes without the retry mark_read now carries
+    mark_read = unread.mark_read if retry else unread.mark_read.__wrapped__
+    recipient = User(pk=recipient_id)
+    plan = TherapyPlan(pk=plan_id)
+
+    time.sleep(max(0, start_at - time.time()))
+    ok = errors = 0
+    started = time.perf_counter()
+    for i in range(writes):
+        try:
+            if i % 2:
+                mark_read(recipient, plan)
+            else:
+                send_one(plan_id, sender_id, recipient_id)
+            ok += 1
+        except OperationalError as error:
+            if not is_lock_error(error):
+                raise
+            errors += 1
+    connection.close()
+    return ok, errors, time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = 'Hammer a scratch SQLite file from several processes and compare stock and hardened settings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--writes', type=int, default=200, help='Write transactions per worker')
+        parser.add_argument('--modes', default=','.join(MODES), help='Comma separated, from: ' + ', '.join(MODES))
+
+    def seed(self, workers):
+        '''One therapy plan per worker, so every worker writes its own thread'''
+        provider_user = User.objects.create(username='bench-provider')
+        provider = HealthProvider.objects.create(user=provider_user)
+        plan_type = PlanType.objects.create(name='Bench')
+        threads = []
+        for i in range(workers):
+            patient_user = User.objects.create(username=f'bench-patient-{i}')
+            plan = TherapyPlan.objects.create(patient=Patient.objects.create(user=patient_user),
+                                              health_provider=provider, plan_type=plan_type, status='active')
+            threads.append((plan.pk, patient_user.pk, provider_user.pk))
+        return threads
+
+    def bench(self, mode, workers, writes):
+        saved = dict(connection.settings_dict)
+        # the seeded providers bump cache versions, which belong in a scratch cache too
+        with tempfile.TemporaryDirectory() as directory, scratch_cache():
+            path = os.path.join(directory, 'bench.sqlite3')
+            try:
+                use_database(path, mode)
+                call_command('migrate', verbosity=0)
+                threads = self.seed(workers)
+                connection.close()
+
+                start_at = time.time() + 1
+                with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(path, mode)) as pool:
+                    results = list(pool.map(
+                        write_loop, [mode] * workers, *zip(*threads), [writes] * workers, [start_at] * workers,
+                    ))
+            finally:
+                connection.close()
+                connection.settings_dict.clear()
+                connection.settings_dict.update(saved)
+
+        ok = sum(result[0] for result in results)
+        errors = sum(result[1] for result in results)
+        seconds = max(result[2] for result in results)
+        return {
+            'workers': workers,
+            'attempted': ok + errors,
+            'committed': ok,
+            'writes_per_s': round(ok / seconds, 1),
+            'lock_errors': errors,
+            'lock_error_rate': round(errors / (ok + errors), 4),
+        }
+
+    def handle(self, *args, **options):
+        report = {}
+        for mode in options['modes'].split(','):
+            report[mode] = self.bench(mode, options['workers'], options['writes'])
+        self.stdout.write(json.dumps(report, indent=2))
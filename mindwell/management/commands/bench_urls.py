@@ -0,0 +1,172 @@
+# mindwell/management/commands/bench_urls.py
+# Gracious Ogyiri Asare - gpoa@bu.edu
+
+import json
+from contextlib import nullcontext
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import urlencode
+from mindwell import dataset
+from mindwell.benchmarks import measure, scratch_database
+from mindwell.models import Availability, Session
+from mindwell.pagination import KeysetPaginator
+from mindwell.urls import urlpatterns
+from mindwell.views import ThreadParticipantMixin
+
+# URL names that need a logged in provider or patient
+ROLES = {
+    'provider_dashboard': 'provider',
+    'provider_update': 'provider',
+    'manage_availability': 'provider',
+    'delete_availability': 'provider',
+    'session_update': 'provider',
+    'view_messages': 'provider',
+    'patient_dashboard': 'patient',
+    'patient_update': 'patient',
+    'therapyplan_create': 'patient',
+    'session_create': 'patient',
+    'session_series_create': 'patient',
+    'send_message': 'patient',
+    'message_older': 'patient',
+    'message_newer': 'patient',
+    'api_plan_list': 'patient',
+    'api_session_list': 'patient',
+}
+
+# which sample object fills a plain <int:pk>
+PK_SOURCES = {
+    'provider_detail': 'provider',
+    'provider_slots': 'provider',
+    'api_provider_detail': 'provider',
+    'api_provider_slots': 'provider',
+    'provider_dashboard': 'provider',
+    'patient_dashboard': 'patient',
+    'delete_availability': 'availability',
+    'session_update': 'session',
+}
+
+# URL names left out, with the reason shown in the report
+SKIPPED = {
+    'logout': 'only accepts POST and would end the benchmark session',
+    'message_stream': 'an endless event stream under ASGI, timed by bench_message_stream',
+}
+
+
+def older_params(samples):
+    '''The cursor a thread page hands to "load earlier messages"'''
+    paginator = KeysetPaginator(samples['plan'].messages.all(), ThreadParticipantMixin.ordering,
+                                ThreadParticipantMixin.page_size)
+    cursor = paginator.page().next_cursor
+    return {'before': cursor} if cursor else {}
+
+
+def newer_params(samples):
+    '''A poll that finds the latest message of the thread'''
+    ids = list(samples['plan'].messages.order_by('-id').values_list('id', flat=True)[:2])
+    return {'after': ids[1] if len(ids) == 2 else 0}
+
+
+# query parameters the views need to answer 200
+QUERY_PARAMS = {
+    'message_older': older_params,
+    'message_newer': newer_params,
+}
+
+
+def sample_objects():
+    '''An upcoming session of an active plan, and the people and availability around it'''
+    session = Session.objects.filter(
+        therapy_plan__status='active', session_date__gte=timezone.localdate(),
+    ).select_related('therapy_plan__patient__user', 'therapy_plan__health_provider__user').order_by('id').first()
+    if session is None:
+        raise CommandError('No upcoming session of an active therapy plan to benchmark with.')
+    plan = session.therapy_plan
+    return {
+        'session': session,
+        'plan': plan,
+        'provider': plan.health_provider,
+        'patient': plan.patient,
+        'availability': Availability.objects.filter(health_provider=plan.health_provider).first(),
+    }
+
+
+def url_kwargs(name, pattern, samples):
+    '''Fill the converters of a URL pattern from the sample objects'''
+    kwargs = {}
+    for key in pattern.pattern.converters:
+        source = PK_SOURCES.get(name) if key == 'pk' else key.removesuffix('_pk')
+        if samples.get(source) is None:
+            return None
+        kwargs[key] = samples[source].pk
+    return kwargs
+
+
+def bench_urls(repeat):
+    '''Time a GET of every named mindwell URL, {name: timings}'''
+    samples = sample_objects()
+    clients = {'anonymous': Client(raise_request_exception=False)}
+    for role in ('provider', 'patient'):
+        clients[role] = Client(raise_request_exception=False)
+        clients[role].force_login(samples[role].user)
+
+    results = {}
+    for pattern in urlpatterns:
+        name = pattern.name
+        if not name:
+            continue
+        if name in SKIPPED:
+            results[name] = {'skipped': SKIPPED[name]}
+            continue
+        kwargs = url_kwargs(name, pattern, samples)
+        if kwargs is None:
+            results[name] = {'skipped': 'no sample object for its arguments'}
+            continue
+        path = reverse(name, kwargs=kwargs)
+        params = QUERY_PARAMS[name](samples) if name in QUERY_PARAMS else {}
+        if params:
+            path = f'{path}?{urlencode(params)}'
+        client = clients[ROLES.get(name, 'anonymous')]
+        client.get(path)  # warm caches and lazy imports outside the measurement
+        statuses = set()
+        timing = measure(lambda: statuses.add(client.get(path).status_code), repeat)
+        results[name] = {'path': path, 'status': sorted(statuses), **timing}
+    return results
+
+
+class Command(BaseCommand):
+    help = 'Time every mindwell URL with the test client and report p50/p95 latency and query counts as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--existing', action='store_true',
+                            help='Benchmark the configured database instead of a generated scratch one')
+        parser.add_argument('--scale', type=float, default=0.05,
+                            help='Fraction of the generate_dataset default sizes to seed the scratch database with')
+        parser.add_argument('--output', help='Also write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        sizes = None
+        with nullcontext() if options['existing'] else scratch_database():
+            if not options['existing']:
+                sizes = {key: max(1, int(value * options['scale'])) for key, value in dataset.DEFAULT_SIZES.items()}
+                dataset.generate(sizes)
+            report = {
+                'database': 'existing' if options['existing'] else 'scratch',
+                'sizes': sizes,
+                'repeat': options['repeat'],
+                'urls': bench_urls(options['repeat']),
+            }
+        # an error page is no measurement of the view
+        report['non_200'] = {
+            name: result['status'] for name, result in report['urls'].items()
+            if 'status' in result and result['status'] != [200]
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        self.stdout.write(output)
+        if report['non_200']:
+            raise CommandError(f"Non-200 responses: {', '.join(sorted(report['non_200']))}")
@@ -0,0 +1,80 @@
+# mindwell/management/commands/check_query_plans.py
+# Gracious Ogyiri Asare - gpoa@bu.edu
+
+import re
+from contextlib import nullcontext
+from datetime import date, time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from mindwell.benchmarks import scratch_database
+from mindwell.inbox import inbox_threads, user_plans
+from mindwell.models import Availability, HealthProvider, Message, Patient, Session, TherapyPlan
+
+# "SCAN table" without an index is a full table scan; "SCAN table USING INDEX" walks an index in order
+TABLE_SCAN = re.compile(r'\bSCAN (\w+)\b(?! USING)')
+
+
+def hot_queries():
+    '''(name, queryset) of the lookups behind the dashboards, booking and messages
+
+    Unsaved instances with a primary key are enough for EXPLAIN, so this runs
+    against an empty database as well as a full one.
+    '''
+    user = User(pk=1)
+    provider = HealthProvider(pk=1, user=user)
+    patient = Patient(pk=1, user=user)
+    plan = TherapyPlan(pk=1, health_provider=provider, patient=patient)
+    availability = Availability(health_provider=provider, start_time=time(9), end_time=time(17))
+    today = date.today()
+    return [
+        ('provider upcoming sessions', provider.get_upcoming_sessions()),
+        ('provider active plans', provider.get_active_plans()),
+        ('patient upcoming sessions', patient.get_upcoming_sessions()),
+        ('patient active plans', patient.get_active_plans()),
+        ('patient past sessions', Session.objects.filter(
+            therapy_plan__patient=patient, status__in=['completed', 'cancelled', 'no-show'],
+        ).order_by('-session_date', '-session_time')),
+        ('patient all plans', TherapyPlan.objects.filter(patient=patient).order_by('-created_at')),
+        ('booked intervals', Session.objects.filter(
+            therapy_plan__health_provider=provider, session_date__gte=today,
+            session_date__lte=today, status='scheduled',
+        )),
+        ('slot booked check', Session.objects.filter(
+            therapy_plan__health_provider=provider, session_date=today,
+            session_time__gte=availability.start_time, session_time__lt=availability.end_time,
+            status='scheduled',
+        )),
+        ('weekly availability', Availability.objects.filter(health_provider=provider, is_available=True)),
+        ('user plans', user_plans(user)),
+        ('inbox threads', inbox_threads(user).order_by('-last_message_at', '-id')),
+        ('thread messages', plan.messages.order_by('created_at')),
+        ('unread messages', Message.objects.filter(recipient=user, therapy_plan=plan, id__gt=0)),
+        ('provider directory page', HealthProvider.objects.order_by('last_name', 'first_name', 'id')[:20]),
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Run EXPLAIN QUERY PLAN on the hot queries and fail if any of them scans a whole table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scratch', action='store_true',
+                            help='Check a freshly migrated scratch database instead of the configured one')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('check_query_plans reads SQLite EXPLAIN QUERY PLAN output.')
+
+        with scratch_database() if options['scratch'] else nullcontext():
+            scans = []
+            for name, queryset in hot_queries():
+                plan = queryset.explain()
+                tables = TABLE_SCAN.findall(plan)
+                if tables:
+                    scans.append(f'{name}: {", ".join(tables)}')
+                if options['verbosity'] > 1 or tables:
+                    self.stdout.write(f'-- {name}\n{plan}\n')
+
+        if scans:
+            raise CommandError('Table scans in hot queries:\n  ' + '\n  '.join(scans))
+        self.stdout.write(self.style.SUCCESS('No table scans in hot queries.'))
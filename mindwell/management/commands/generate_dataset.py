@@ -0,0 +1,28 @@
+# mindwell/management/commands/generate_dataset.py
+# Gracious Ogyiri Asare - gpoa@bu.edu
+
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from mindwell import dataset
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with synthetic providers, patients, plans, sessions and messages'
+
+    def add_arguments(self, parser):
+        for key, value in dataset.DEFAULT_SIZES.items():
+            parser.add_argument(f'--{key}', type=int, default=value)
+        parser.add_argument('--prefix', default='synthetic', help='Username prefix of the generated accounts')
+        parser.add_argument('--seed', type=int, default=412)
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=f'{prefix}-').exists():
+            raise CommandError(f'Accounts named {prefix}-* already exist, pick another --prefix.')
+
+        start = time.perf_counter()
+        sizes = {key: options[key] for key in dataset.DEFAULT_SIZES}
+        dataset.generate(sizes, prefix, options['seed'], log=lambda text: self.stdout.write(f'  {text}'))
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(f'Generated dataset in {elapsed:.1f}s.'))
@@ -0,0 +1,43 @@
+# mindwell/management/commands/generate_thumbnails.py
+# Gracious Ogyiri Asare - gpoa@bu.edu
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+import django
+from django.core.management.base import BaseCommand
+from PIL import UnidentifiedImageError
+from mindwell.models import HealthProvider
+from mindwell import thumbnails
+
+
+def thumbnail_one(name, force):
+    '''Worker: thumbnail one stored image, returning (name, written, error)'''
+    try:
+        return name, thumbnails.generate_thumbnails(name, force=force), None
+    except (OSError, UnidentifiedImageError) as error:
+        return name, 0, str(error)
+
+
+class Command(BaseCommand):
+    help = 'Create the WebP thumbnails of existing provider profile images in a process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+        parser.add_argument('--force', action='store_true', help='Regenerate thumbnails that already exist')
+
+    def handle(self, *args, **options):
+        names = sorted(set(
+            HealthProvider.objects.exclude(profile_img='').exclude(profile_img__isnull=True)
+            .values_list('profile_img', flat=True)
+        ))
+        created = failed = 0
+        # resizing is CPU bound, so use processes; django.setup covers spawn-based platforms
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as pool:
+            for name, written, error in pool.map(thumbnail_one, names, [options['force']] * len(names)):
+                if error:
+                    failed += 1
+                    self.stderr.write(f'{name}: {error}')
+                created += written
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {created} thumbnails for {len(names)} images ({failed} failed).'
+        ))
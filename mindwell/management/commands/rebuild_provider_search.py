@@ -0,0 +1,17 @@
+# mindwell/management/commands/rebuild_provider_search.py
+# Gracious Ogyiri Asare - gpoa@bu.edu
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from mindwell import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index over HealthProvider'
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            raise CommandError('Full-text search needs the SQLite backend with FTS5.')
+        with transaction.atomic():
+            count = search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} providers.'))
@@ -0,0 +1,17 @@
+# mindwell/management/commands/rebuild_unread_counts.py
+# Gracious Ogyiri Asare - gpoa@bu.edu
+
+from django.core.management.base import BaseCommand
+from mindwell import unread
+
+
+class Command(BaseCommand):
+    help = 'Recount the unread messages after each per-thread read cursor, and the per-user totals, from the Message table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='users',
+                            help='Only rebuild the counters of this user id (repeatable)')
+
+    def handle(self, *args, **options):
+        threads, users = unread.rebuild(user_ids=options['users'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {threads} thread counters for {users} users.'))
@@ -0,0 +1,169 @@
+# mindwell/middleware.py
+# Gracious Ogyiri Asare - gpoa@bu.edu
+# Middleware for MindWell app
+
+import heapq
+import json
+import logging
+import random
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils.functional import SimpleLazyObject, cached_property
+from .models import HealthProvider, Patient
+
+query_logger = logging.getLogger('mindwell.queries')
+
+
+class MindwellRole:
+    '''Provider/patient profiles of one user, each looked up at most once'''
+
+    def __init__(self, user):
+        self.user = user
+
+    @cached_property
+    def provider(self):
+        '''Return the HealthProvider of this user, or None'''
+        if not self.user.is_authenticated:
+            return None
+        return HealthProvider.objects.filter(user=self.user).first()
+
+    @cached_property
+    def patient(self):
+        '''Return the Patient of this user, or None'''
+        if not self.user.is_authenticated:
+            return None
+        return Patient.objects.filter(user=self.user).first()
+
+    @property
+    def is_provider(self):
+        '''Check if provider'''
+        return self.provider is not None
+
+    @property
+    def is_patient(self):
+        '''Check if patient'''
+        return self.patient is not None
+
+
+def get_role(request):
+    '''Return the role of the request user, creating it if the middleware did not'''
+    role = getattr(request, 'mindwell_role', None)
+    if role is None:
+        role = MindwellRole(request.user)
+        request.mindwell_role = role
+    return role
+
+
+class MindwellRoleMiddleware:
+    '''Attach a lazy, memoized request.mindwell_role to every request'''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.mindwell_role = SimpleLazyObject(lambda: MindwellRole(request.user))
+        return self.get_response(request)
+
+
+def fingerprint(sql):
+    '''Normalize a statement so repeats of the same query share one key'''
+    sql = re.sub(r'\s+', ' ', sql).strip()
+    return re.sub(r'IN \((%s, )*%s\)', 'IN (...)', sql)
+
+
+class QueryRecorder:
+    '''connection.execute_wrapper that counts and times every statement'''
+
+    def __init__(self, keep_slowest=5):
+        self.count = 0
+        self.total_ms = 0.0
+        self.keep_slowest = keep_slowest
+        self.slowest = []
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.count += 1
+            self.total_ms += elapsed
+            self.fingerprints[fingerprint(sql)] += 1
+            entry = (elapsed, sql)
+            if len(self.slowest) < self.keep_slowest:
+                heapq.heappush(self.slowest, entry)
+            elif elapsed > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, entry)
+
+    def repeated(self, threshold):
+        '''Statements run at least threshold times, the usual sign of an N+1'''
+        return [(sql, count) for sql, count in self.fingerprints.most_common() if count >= threshold]
+
+
+class QueryInstrumentationMiddleware:
+    '''Sampled per-view query count, SQL time, slowest and repeated statements
+
+    Enabled by MINDWELL_QUERY_SAMPLE_RATE (0 turns it off). Requests going over
+    their MINDWELL_QUERY_BUDGETS entry, looked up by URL name, are logged.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'MINDWELL_QUERY_SAMPLE_RATE', 0)
+        if self.sample_rate <= 0:
+            raise MiddlewareNotUsed()
+        self.budgets = getattr(settings, 'MINDWELL_QUERY_BUDGETS', {})
+        self.repeat_threshold = getattr(settings, 'MINDWELL_QUERY_REPEAT_THRESHOLD', 5)
+
+    def get_budget(self, url_name):
+        '''Return the {'queries': n, 'ms': t} budget of a URL name'''
+        return self.budgets.get(url_name, self.budgets.get('default', {}))
+
+    def __call__(self, request):
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for conn in connections.all():
+                stack.enter_context(conn.execute_wrapper(recorder))
+            response = self.get_response(request)
+        total_ms = (time.perf_counter() - start) * 1000
+
+        response['Server-Timing'] = (
+            f'db;dur={recorder.total_ms:.1f};desc="{recorder.count} queries", app;dur={total_ms:.1f}'
+        )
+        self.report(request, recorder, total_ms)
+        return response
+
+    def report(self, request, recorder, total_ms):
+        '''Log the request, as a warning when it went over budget'''
+        match = getattr(request, 'resolver_match', None)
+        url_name = match.url_name if match else None
+        budget = self.get_budget(url_name)
+        over = (
+            recorder.count > budget.get('queries', float('inf')) or
+            recorder.total_ms > budget.get('ms', float('inf'))
+        )
+        repeated = recorder.repeated(self.repeat_threshold)
+        summary = {
+            'view': match.view_name if match else request.path,
+            'queries': recorder.count,
+            'db_ms': round(recorder.total_ms, 2),
+            'total_ms': round(total_ms, 2),
+            'slowest': [(round(ms, 2), sql) for ms, sql in sorted(recorder.slowest, reverse=True)],
+            'repeated': repeated,
+        }
+        if over:
+            query_logger.warning('Query budget exceeded: %s', json.dumps(summary))
+        elif repeated:
+            query_logger.warning('Repeated statements (possible N+1): %s', json.dumps(summary))
+        else:
+            query_logger.debug('Queries: %s', json.dumps(summary))
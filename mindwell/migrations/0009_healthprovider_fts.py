@@ -0,0 +1,32 @@
+from django.db import migrations
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS mindwell_healthprovider_fts USING fts5("
+        "first_name, last_name, specialization, bio, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+    schema_editor.execute(
+        "INSERT INTO mindwell_healthprovider_fts (rowid, first_name, last_name, specialization, bio) "
+        "SELECT id, first_name, last_name, specialization, bio FROM mindwell_healthprovider"
+    )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS mindwell_healthprovider_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mindwell', '0008_remove_message_subject_delete_patientnote'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
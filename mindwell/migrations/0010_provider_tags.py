@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mindwell', '0009_healthprovider_fts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LanguageTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('slug', models.SlugField(max_length=100, unique=True)),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SpecializationTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('slug', models.SlugField(max_length=100, unique=True)),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='healthprovider',
+            name='language_tags',
+            field=models.ManyToManyField(blank=True, related_name='providers', to='mindwell.languagetag'),
+        ),
+        migrations.AddField(
+            model_name='healthprovider',
+            name='specialization_tags',
+            field=models.ManyToManyField(blank=True, related_name='providers', to='mindwell.specializationtag'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+import re
+
+from django.db import migrations
+from django.utils.text import slugify
+
+
+def split_tags(text):
+    names = [' '.join(part.split()) for part in re.split(r'[,;/|]', text or '')]
+    return [name for name in names if slugify(name)]
+
+
+def populate_tags(apps, schema_editor):
+    HealthProvider = apps.get_model('mindwell', 'HealthProvider')
+    LanguageTag = apps.get_model('mindwell', 'LanguageTag')
+    SpecializationTag = apps.get_model('mindwell', 'SpecializationTag')
+
+    for field, tag_model, relation in (
+        ('languages', LanguageTag, 'language_tags'),
+        ('specialization', SpecializationTag, 'specialization_tags'),
+    ):
+        tags = {}
+        links = []
+        through = getattr(HealthProvider, relation).through
+        for provider_id, text in HealthProvider.objects.values_list('id', field):
+            for name in split_tags(text):
+                slug = slugify(name)
+                if slug not in tags:
+                    tags[slug] = tag_model.objects.create(name=name, slug=slug)
+                links.append((provider_id, tags[slug].id))
+        through.objects.bulk_create(
+            [through(healthprovider_id=p, **{f'{tag_model._meta.model_name}_id': t}) for p, t in set(links)],
+            batch_size=500,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mindwell', '0010_provider_tags'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_tags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:51
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mindwell', '0011_split_provider_tags'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='healthprovider',
+            index=models.Index(fields=['last_name', 'first_name', 'id'], name='provider_directory_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:54
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mindwell', '0012_provider_directory_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['therapy_plan', 'created_at', 'id'], name='message_thread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['recipient', 'therapy_plan', 'is_read'], name='message_unread_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations
+from django.db.models import Count
+
+
+def backfill(apps, schema_editor):
+    Message = apps.get_model('mindwell', 'Message')
+    ThreadUnreadCount = apps.get_model('mindwell', 'ThreadUnreadCount')
+    UnreadCount = apps.get_model('mindwell', 'UnreadCount')
+
+    rows = Message.objects.filter(is_read=False).order_by().values(
+        'recipient_id', 'therapy_plan_id').annotate(count=Count('id'))
+    totals = {}
+    threads = []
+    for row in rows:
+        threads.append(ThreadUnreadCount(
+            user_id=row['recipient_id'], therapy_plan_id=row['therapy_plan_id'], count=row['count']))
+        totals[row['recipient_id']] = totals.get(row['recipient_id'], 0) + row['count']
+    ThreadUnreadCount.objects.bulk_create(threads, batch_size=1000)
+    UnreadCount.objects.bulk_create(
+        [UnreadCount(user_id=user_id, count=count) for user_id, count in totals.items()], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mindwell', '0014_unread_counts'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
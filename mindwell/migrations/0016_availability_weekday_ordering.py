@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mindwell', '0015_backfill_unread_counts'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='availability',
+            options={'ordering': [models.Case(models.When(day_of_week='monday', then=models.Value(0)), models.When(day_of_week='tuesday', then=models.Value(1)), models.When(day_of_week='wednesday', then=models.Value(2)), models.When(day_of_week='thursday', then=models.Value(3)), models.When(day_of_week='friday', then=models.Value(4)), models.When(day_of_week='saturday', then=models.Value(5)), models.When(day_of_week='sunday', then=models.Value(6)), output_field=models.IntegerField()), 'start_time'], 'verbose_name_plural': 'Availabilities'},
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mindwell', '0016_availability_weekday_ordering'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='session',
+            index=models.Index(fields=['therapy_plan', 'status', 'session_date', 'session_time'], name='session_plan_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='therapyplan',
+            index=models.Index(fields=['health_provider', 'status'], name='plan_provider_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='therapyplan',
+            index=models.Index(fields=['patient', 'status'], name='plan_patient_status_idx'),
+        ),
+    ]
@@ -0,0 +1,80 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def to_cursors(apps, schema_editor):
+    '''Read each thread up to its newest read message, then recount what is left'''
+    Message = apps.get_model('mindwell', 'Message')
+    ThreadReadState = apps.get_model('mindwell', 'ThreadReadState')
+    UnreadCount = apps.get_model('mindwell', 'UnreadCount')
+
+    rows = Message.objects.order_by().values('recipient_id', 'therapy_plan_id').annotate(
+        read_to=Max('id', filter=Q(is_read=True)))
+    ThreadReadState.objects.all().delete()
+    ThreadReadState.objects.bulk_create([
+        ThreadReadState(user_id=row['recipient_id'], therapy_plan_id=row['therapy_plan_id'],
+                        last_read_id=row['read_to'] or 0)
+        for row in rows
+    ], batch_size=1000)
+
+    received_after = Message.objects.filter(
+        recipient=OuterRef('user'), therapy_plan=OuterRef('therapy_plan'), id__gt=OuterRef('last_read_id'),
+    ).order_by().values('recipient').annotate(total=Count('id')).values('total')
+    ThreadReadState.objects.update(count=Coalesce(Subquery(received_after), 0))
+
+    UnreadCount.objects.all().delete()
+    totals = ThreadReadState.objects.filter(count__gt=0).order_by().values('user_id').annotate(total=Sum('count'))
+    UnreadCount.objects.bulk_create(
+        [UnreadCount(user_id=row['user_id'], count=row['total']) for row in totals], batch_size=1000)
+
+
+def to_flags(apps, schema_editor):
+    Message = apps.get_model('mindwell', 'Message')
+    ThreadReadState = apps.get_model('mindwell', 'ThreadReadState')
+    for state in ThreadReadState.objects.filter(last_read_id__gt=0).iterator():
+        Message.objects.filter(
+            recipient_id=state.user_id, therapy_plan_id=state.therapy_plan_id, id__lte=state.last_read_id,
+        ).update(is_read=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mindwell', '0019_archived_message'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RenameModel('ThreadUnreadCount', 'ThreadReadState'),
+        migrations.RemoveConstraint(model_name='threadreadstate', name='unique_thread_unread_count'),
+        migrations.AlterField(
+            model_name='threadreadstate',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='thread_read_states', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='threadreadstate',
+            name='therapy_plan',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_states', to='mindwell.therapyplan'),
+        ),
+        migrations.AddField(
+            model_name='threadreadstate',
+            name='last_read_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddConstraint(
+            model_name='threadreadstate',
+            constraint=models.UniqueConstraint(fields=('user', 'therapy_plan'), name='unique_thread_read_state'),
+        ),
+        migrations.RunPython(to_cursors, to_flags),
+        migrations.RemoveIndex(model_name='message', name='message_unread_idx'),
+        migrations.RemoveField(model_name='message', name='is_read'),
+        migrations.RemoveField(model_name='archivedmessage', name='is_read'),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['recipient', 'therapy_plan', 'id'], name='message_received_idx'),
+        ),
+    ]
@@ -6,6 +6,42 @@ from django.urls import reverse
 from django.contrib.auth.models import User
 from datetime import date, time, timedelta
 
+DAYS_OF_WEEK = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+# sorts day_of_week names Monday first instead of alphabetically
+WEEKDAY_ORDER = models.Case(
+    *[models.When(day_of_week=day, then=models.Value(i)) for i, day in enumerate(DAYS_OF_WEEK)],
+    output_field=models.IntegerField(),
+)
+
+class LanguageTag(models.Model):
+    '''Normalized language spoken by providers'''
+    
+    # data fields
+    name = models.CharField(max_length=100)
+    slug = models.SlugField(max_length=100, unique=True)
+    
+    class Meta:
+        ordering = ['name']
+    
+    def __str__(self):
+        '''String representation of the model object'''
+        return self.name
+
+class SpecializationTag(models.Model):
+    '''Normalized area of specialization of providers'''
+    
+    # data fields
+    name = models.CharField(max_length=100)
+    slug = models.SlugField(max_length=100, unique=True)
+    
+    class Meta:
+        ordering = ['name']
+    
+    def __str__(self):
+        '''String representation of the model object'''
+        return self.name
+
 class HealthProvider(models.Model):
     '''Model representing the health providers registered'''
     
@@ -28,6 +64,16 @@ class HealthProvider(models.Model):
     bio = models.TextField(blank=True)
     verified = models.BooleanField(default=True)
     join_date = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    # tags derived from the specialization and languages text, see tags.py
+    language_tags = models.ManyToManyField(LanguageTag, related_name='providers', blank=True)
+    specialization_tags = models.ManyToManyField(SpecializationTag, related_name='providers', blank=True)
+    
+    class Meta:
+        indexes = [
+            # keyset pagination order of the provider directory
+            models.Index(fields=['last_name', 'first_name', 'id'], name='provider_directory_idx'),
+        ]
     
     def __str__(self):
         '''String representation of the model object'''
@@ -39,7 +85,9 @@ class HealthProvider(models.Model):
     
     def get_active_plans(self):
         '''Return active therapy plans for this provider'''
-        return TherapyPlan.objects.filter(health_provider=self, status='active')
+        return TherapyPlan.objects.filter(
+            health_provider=self, status='active'
+        ).select_related('patient', 'plan_type')
     
     def get_upcoming_sessions(self):
         '''Return upcoming sessions for this provider'''
@@ -47,21 +95,20 @@ class HealthProvider(models.Model):
             therapy_plan__health_provider=self,
             session_date__gte=date.today(),
             status='scheduled'
+        ).select_related(
+            'therapy_plan__patient', 'therapy_plan__plan_type'
         ).order_by('session_date', 'session_time')
     
     def get_availability_by_day(self): #to group the availability slots by days
-        '''Return availability grouped by day of week'''
-        days_order = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
-        availability = {}
-        for day in days_order:
-            slots = Availability.objects.filter(
-                health_provider=self,
-                day_of_week=day,
-                is_available=True
-            ).order_by('start_time')
-            if slots.exists():
-                availability[day] = slots
-        return availability
+        '''Return availability grouped by day of week, as {day: [slots]} from one query'''
+        slots_by_day = {}
+        slots = Availability.objects.filter(
+            health_provider=self,
+            is_available=True
+        ).order_by('start_time')
+        for slot in slots:
+            slots_by_day.setdefault(slot.day_of_week, []).append(slot)
+        return {day: slots_by_day[day] for day in DAYS_OF_WEEK if day in slots_by_day}
     
     def get_supported_plan_types(self):
         '''Return plan types this provider supports'''
@@ -99,7 +146,9 @@ class Patient(models.Model):
     
     def get_active_plans(self):
         '''Return active therapy plans for this patient'''
-        return TherapyPlan.objects.filter(patient=self, status='active')
+        return TherapyPlan.objects.filter(
+            patient=self, status='active'
+        ).select_related('health_provider', 'plan_type')
     
     def get_upcoming_sessions(self):
         '''Return upcoming sessions for this patient'''
@@ -107,6 +156,8 @@ class Patient(models.Model):
             therapy_plan__patient=self,
             session_date__gte=date.today(),
             status='scheduled'
+        ).select_related(
+            'therapy_plan__health_provider'
         ).order_by('session_date', 'session_time')
 
 class Availability(models.Model):
@@ -126,10 +177,11 @@ class Availability(models.Model):
     start_time = models.TimeField()
     end_time = models.TimeField()
     is_available = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         verbose_name_plural = 'Availabilities'
-        ordering = ['day_of_week', 'start_time']
+        ordering = [WEEKDAY_ORDER, 'start_time']
     
     def __str__(self):
         '''String representation of the model object'''
@@ -177,6 +229,14 @@ class TherapyPlan(models.Model):
     notes = models.TextField(blank=True, null=True)
     cost = models.DecimalField(max_digits=8, decimal_places=2, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            # active plans of a provider / a patient (dashboards)
+            models.Index(fields=['health_provider', 'status'], name='plan_provider_status_idx'),
+            models.Index(fields=['patient', 'status'], name='plan_patient_status_idx'),
+        ]
     
     def __str__(self):
         '''String representation of the model object'''
@@ -208,6 +268,14 @@ class Session(models.Model):
     ])
     follow_up_required = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            # sessions of each plan by status and date/time: upcoming, past and booked slots
+            models.Index(fields=['therapy_plan', 'status', 'session_date', 'session_time'],
+                         name='session_plan_status_date_idx'),
+        ]
     
     def __str__(self):
         '''String representation of the model object'''
@@ -220,11 +288,65 @@ class Message(models.Model):
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
     recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='received_messages')
     message = models.TextField()
-    is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            # latest message of a thread (inbox.py)
+            models.Index(fields=['therapy_plan', 'created_at', 'id'], name='message_thread_idx'),
+            # messages received in a thread after its read cursor (unread.py)
+            models.Index(fields=['recipient', 'therapy_plan', 'id'], name='message_received_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.sender.username} to {self.recipient.username} about {self.message}"
+
+class ArchivedMessage(models.Model):
+    '''Message moved out of the live table by archive.py, keeping its id'''
+    
+    id = models.BigIntegerField(primary_key=True)
+    therapy_plan = models.ForeignKey(TherapyPlan, on_delete=models.CASCADE, related_name='archived_messages')
+    sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    message = models.TextField()
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['therapy_plan', 'created_at', 'id'], name='archived_thread_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.sender_id} to {self.recipient_id} about {self.message} (archived)"
+
+class UnreadCount(models.Model):
+    '''Denormalized total of unread messages received by a user, see unread.py'''
+    
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='unread_count')
+    count = models.PositiveIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.user_id}: {self.count} unread"
+
+class ThreadReadState(models.Model):
+    '''Read cursor of a user in one therapy plan thread, see unread.py
+
+    Messages the user received with an id above last_read_id are unread;
+    count is their denormalized number.
+    '''
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='thread_read_states')
+    therapy_plan = models.ForeignKey(TherapyPlan, on_delete=models.CASCADE, related_name='read_states')
+    last_read_id = models.BigIntegerField(default=0)
+    count = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'therapy_plan'], name='unique_thread_read_state'),
+        ]
     
     def __str__(self):
-        return f"{self.sender.username} to {self.recipient.username} about {self.message}"
\ No newline at end of file
+        return f"{self.user_id} in plan {self.therapy_plan_id}: read up to {self.last_read_id}, {self.count} unread"
@@ -0,0 +1,155 @@
+# mindwell/pagination.py
+# Gracious Ogyiri Asare - gpoa@bu.edu
+# Keyset (cursor) pagination: pages are found with a WHERE on the sort keys, never OFFSET
+
+import base64
+import binascii
+import datetime
+import json
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    '''Raised when a cursor token cannot be decoded'''
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    '''DjangoJSONEncoder keeping the microseconds of datetimes and times
+
+    The seek compares the decoded keys exactly, so a value cut to milliseconds
+    would skip or repeat rows created within the same millisecond.
+    '''
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPage:
+    '''One page of results plus the cursors of its neighbours'''
+
+    def __init__(self, object_list, next_cursor=None, prev_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    '''Paginate a queryset on a unique ordering such as ('last_name', 'first_name', 'id')'''
+
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.per_page = per_page
+        self.keys = [name.lstrip('-') for name in self.ordering]
+        self.descending = [name.startswith('-') for name in self.ordering]
+
+    def encode_cursor(self, obj):
+        '''Return an opaque token holding the sort keys of obj'''
+        values = [getattr(obj, key) for key in self.keys]
+        raw = json.dumps(values, cls=CursorEncoder, separators=(',', ':'))
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, token):
+        '''Return the sort key values stored in a token'''
+        try:
+            raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+            values = json.loads(raw)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise InvalidCursor(token)
+        if not isinstance(values, list) or len(values) != len(self.keys):
+            raise InvalidCursor(token)
+
+        decoded = []
+        for key, value in zip(self.keys, values):
+            try:
+                field = self.queryset.model._meta.get_field(key)
+            except FieldDoesNotExist:
+                decoded.append(value)  # annotation such as a search rank
+                continue
+            try:
+                decoded.append(field.to_python(value))
+            except ValidationError:
+                raise InvalidCursor(token)
+        return decoded
+
+    def _seek(self, values, forward):
+        '''Rows strictly after (or before) values in the page ordering'''
+        condition = Q()
+        equal = Q()
+        for key, value, descending in zip(self.keys, values, self.descending):
+            lookup = 'lt' if descending == forward else 'gt'
+            condition |= equal & Q(**{f'{key}__{lookup}': value})
+            equal &= Q(**{key: value})
+        # bound the leading key on its own so the planner can range-scan its index
+        lead = 'lte' if self.descending[0] == forward else 'gte'
+        return Q(**{f'{self.keys[0]}__{lead}': values[0]}) & condition
+
+    def page(self, after=None, before=None):
+        '''Return the page following the after cursor, or preceding the before cursor'''
+        if before:
+            reverse = [name[1:] if name.startswith('-') else f'-{name}' for name in self.ordering]
+            rows = list(
+                self.queryset.filter(self._seek(self.decode_cursor(before), forward=False))
+                .order_by(*reverse)[:self.per_page + 1]
+            )
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            has_next = True
+        else:
+            queryset = self.queryset
+            if after:
+                queryset = queryset.filter(self._seek(self.decode_cursor(after), forward=True))
+            rows = list(queryset.order_by(*self.ordering)[:self.per_page + 1])
+            has_next = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            has_previous = bool(after)
+
+        if not rows:
+            return KeysetPage(rows)
+        return KeysetPage(
+            rows,
+            next_cursor=self.encode_cursor(rows[-1]) if has_next else None,
+            prev_cursor=self.encode_cursor(rows[0]) if has_previous else None,
+        )
+
+
+def paginate_request(request, queryset, ordering, per_page):
+    '''Return the keyset page selected by the after/before query parameters'''
+    paginator = KeysetPaginator(queryset, ordering, per_page)
+    try:
+        return paginator.page(after=request.GET.get('after'), before=request.GET.get('before'))
+    except InvalidCursor:
+        return paginator.page()
+
+
+def cursor_query(params, page):
+    '''Return (prev_query, next_query) strings that keep the other parameters'''
+    queries = []
+    for name, token in (('before', page.prev_cursor), ('after', page.next_cursor)):
+        if token is None:
+            queries.append(None)
+            continue
+        query = params.copy()
+        query.pop('after', None)
+        query.pop('before', None)
+        query[name] = token
+        queries.append(query.urlencode())
+    return tuple(queries)
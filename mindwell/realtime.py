@@ -0,0 +1,129 @@
+# mindwell/realtime.py
+# Gracious Ogyiri Asare - gpoa@bu.edu
+# Fan-out of new messages to the participants streaming a therapy plan thread
+
+import asyncio
+import threading
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+# events a slow client may fall behind by; past that its stream is ended, and
+# EventSource reconnects with Last-Event-ID and catches up from the database
+QUEUE_SIZE = 100
+
+
+def plan_topic(plan_id):
+    '''Hub topic of one therapy plan thread'''
+    return f'plan:{plan_id}'
+
+
+class Subscription:
+    '''Events of one topic for one listener, read from its own event loop'''
+
+    def __init__(self, hub, topic):
+        self.hub = hub
+        self.topic = topic
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+        # set once an event did not fit; the listener must resync from the database
+        self.overflowed = False
+
+    def deliver(self, event):
+        '''Queue an event, or flag the listener as overflowed if it is not keeping up'''
+        if self.queue.full():
+            self.overflowed = True
+            return
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout=None):
+        '''Next event, or None after timeout seconds'''
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class InProcessHub:
+    '''Topic fan-out within one server process
+
+    publish() may be called from any thread (sync views run in a thread pool
+    under ASGI); each event is handed to the listener's loop thread-safely.
+    Only listeners connected to the same process are reached, so several
+    worker processes need a hub backed by a shared broker instead.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.topics = {}
+
+    def subscribe(self, topic):
+        '''Start listening to a topic, from inside a running event loop'''
+        subscription = Subscription(self, topic)
+        with self.lock:
+            self.topics.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            listeners = self.topics.get(subscription.topic, set())
+            listeners.discard(subscription)
+            if not listeners:
+                self.topics.pop(subscription.topic, None)
+
+    def publish(self, topic, event):
+        '''Send event to every listener of topic, return how many there were'''
+        with self.lock:
+            listeners = list(self.topics.get(topic, ()))
+        for subscription in listeners:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:
+                # the listener's loop is closed; it is unsubscribing
+                pass
+        return len(listeners)
+
+    def listener_count(self, topic=None):
+        with self.lock:
+            if topic is not None:
+                return len(self.topics.get(topic, ()))
+            return sum(len(listeners) for listeners in self.topics.values())
+
+
+_hub = None
+_hub_lock = threading.Lock()
+
+
+def get_hub():
+    '''The process-wide hub, of the class named by MINDWELL_REALTIME_HUB'''
+    global _hub
+    if _hub is None:
+        with _hub_lock:
+            if _hub is None:
+                _hub = import_string(getattr(settings, 'MINDWELL_REALTIME_HUB', 'mindwell.realtime.InProcessHub'))()
+    return _hub
+
+
+def message_event(message):
+    '''JSON-ready payload of a message pushed to the thread'''
+    return {
+        'id': message.pk,
+        'therapy_plan': message.therapy_plan_id,
+        'sender_id': message.sender_id,
+        'sender': message.sender.username,
+        'message': message.message,
+        'created_at': message.created_at.isoformat(),
+    }
+
+
+def publish_message(message):
+    '''Push a saved message to everyone streaming its thread'''
+    return get_hub().publish(plan_topic(message.therapy_plan_id), message_event(message))
@@ -0,0 +1,104 @@
+# mindwell/schedule.py
+# Gracious Ogyiri Asare - gpoa@bu.edu
+# Whole-week availability edits applied as one bulk diff
+
+from django.db import transaction
+from django.utils import timezone
+from .booking import lock_provider_schedule
+from .locking import retry_on_locked
+from .models import Availability
+from . import caching
+
+WINDOW_FIELDS = ('day_of_week', 'start_time', 'end_time', 'is_available')
+
+
+def window_key(window):
+    '''(day, start, end) of a window dict or Availability row'''
+    get = window.get if isinstance(window, dict) else lambda name: getattr(window, name)
+    return get('day_of_week'), get('start_time'), get('end_time')
+
+
+def find_overlaps(windows):
+    '''Pairs of windows of the same day whose times intersect; touching windows are fine'''
+    by_day = {}
+    for window in windows:
+        by_day.setdefault(window['day_of_week'], []).append(window)
+    overlaps = []
+    for day_windows in by_day.values():
+        day_windows.sort(key=lambda window: window['start_time'])
+        for previous, window in zip(day_windows, day_windows[1:]):
+            if window['start_time'] < previous['end_time']:
+                overlaps.append((previous, window))
+    return overlaps
+
+
+def diff_schedule(existing, windows):
+    '''(to_create, to_update, to_delete) turning existing rows into windows
+
+    A window keeps the row named by its id; one without an id reuses an
+    unclaimed row with the same day and times, so resubmitting an unchanged
+    week writes nothing.
+    '''
+    rows = {row.pk: row for row in existing}
+    claimed = set()
+    matched = []
+    pending = []
+    for window in windows:
+        pk = window.get('id')
+        if pk in rows and pk not in claimed:
+            claimed.add(pk)
+            matched.append((rows[pk], window))
+        else:
+            pending.append(window)
+
+    unclaimed = {}
+    for row in existing:
+        if row.pk not in claimed:
+            unclaimed.setdefault(window_key(row), []).append(row)
+    to_create = []
+    for window in pending:
+        same = unclaimed.get(window_key(window))
+        if same:
+            matched.append((same.pop(), window))
+        else:
+            to_create.append(Availability(**{name: window[name] for name in WINDOW_FIELDS}))
+
+    to_update = []
+    for row, window in matched:
+        claimed.add(row.pk)
+        if any(getattr(row, name) != window[name] for name in WINDOW_FIELDS):
+            for name in WINDOW_FIELDS:
+                setattr(row, name, window[name])
+            to_update.append(row)
+    to_delete = [row for row in existing if row.pk not in claimed]
+    return to_create, to_update, to_delete
+
+
+@retry_on_locked
+def save_weekly_schedule(provider, windows):
+    '''Make windows the provider's whole weekly availability, return (created, updated, deleted)
+
+    windows are dicts of WINDOW_FIELDS plus an optional id of an existing row.
+    Rows left out are deleted. bulk_create and bulk_update skip the model
+    signals, so the cached profile is invalidated here once the transaction
+    commits.
+    '''
+    with transaction.atomic():
+        lock_provider_schedule(provider.pk)
+        existing = list(Availability.objects.filter(health_provider=provider))
+        to_create, to_update, to_delete = diff_schedule(existing, windows)
+
+        for row in to_create:
+            row.health_provider = provider
+        Availability.objects.bulk_create(to_create)
+        if to_update:
+            now = timezone.now()
+            for row in to_update:
+                row.updated_at = now
+            Availability.objects.bulk_update(to_update, [*WINDOW_FIELDS, 'updated_at'])
+        if to_delete:
+            Availability.objects.filter(pk__in=[row.pk for row in to_delete]).delete()
+
+        if to_create or to_update or to_delete:
+            transaction.on_commit(lambda: caching.bump_provider(provider.pk, directory=False))
+    return len(to_create), len(to_update), len(to_delete)
@@ -0,0 +1,95 @@
+# mindwell/search.py
+# Gracious Ogyiri Asare - gpoa@bu.edu
+# Full-text provider search backed by an SQLite FTS5 shadow index
+
+import re
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'mindwell_healthprovider_fts'
+PROVIDER_TABLE = 'mindwell_healthprovider'
+INDEXED_FIELDS = ('first_name', 'last_name', 'specialization', 'bio')
+
+# bm25 column weights: a hit on a name outranks a hit in the bio
+RANK_WEIGHTS = (10.0, 10.0, 5.0, 1.0)
+
+CREATE_SQL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    f"{', '.join(INDEXED_FIELDS)}, "
+    "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+)
+DROP_SQL = f"DROP TABLE IF EXISTS {FTS_TABLE}"
+POPULATE_SQL = (
+    f"INSERT INTO {FTS_TABLE} (rowid, {', '.join(INDEXED_FIELDS)}) "
+    f"SELECT id, {', '.join(INDEXED_FIELDS)} FROM {PROVIDER_TABLE}"
+)
+
+
+def is_available(conn=None):
+    '''FTS5 is only used on SQLite; other backends fall back to icontains'''
+    return (conn or connection).vendor == 'sqlite'
+
+
+def build_match_query(text):
+    '''Turn free text into an FTS5 query where every word is a prefix term'''
+    terms = re.findall(r'\w+', text)
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def index_provider(provider):
+    '''Insert or replace the index row of one provider'''
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [provider.pk])
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, {', '.join(INDEXED_FIELDS)}) VALUES (%s, %s, %s, %s, %s)",
+            [provider.pk] + [getattr(provider, field) or '' for field in INDEXED_FIELDS],
+        )
+
+
+def remove_provider(provider_id):
+    '''Drop one provider from the index'''
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [provider_id])
+
+
+def rebuild_index():
+    '''Recreate the whole index from the HealthProvider table, return the row count'''
+    if not is_available():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(CREATE_SQL)
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        cursor.execute(POPULATE_SQL)
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+        cursor.execute(f"SELECT count(*) FROM {FTS_TABLE}")
+        return cursor.fetchone()[0]
+
+
+def search_providers(queryset, text):
+    '''Filter a HealthProvider queryset by full-text search, best matches first'''
+    if not is_available():
+        return queryset.filter(
+            Q(first_name__icontains=text) |
+            Q(last_name__icontains=text) |
+            Q(specialization__icontains=text) |
+            Q(bio__icontains=text)
+        )
+
+    match = build_match_query(text)
+    if not match:
+        return queryset
+    weights = ', '.join(str(weight) for weight in RANK_WEIGHTS)
+    return queryset.filter(
+        id__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", (match,))
+    ).annotate(
+        search_rank=RawSQL(
+            f"SELECT bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} "
+            f'WHERE {FTS_TABLE} MATCH %s AND rowid = "{PROVIDER_TABLE}"."id"',
+            (match,),
+        )
+    )
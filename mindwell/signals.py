@@ -0,0 +1,109 @@
+# mindwell/signals.py
+# Gracious Ogyiri Asare - gpoa@bu.edu
+# Signal handlers keeping derived data in sync with the models
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+from .models import Availability, HealthProvider, LanguageTag, Message, PlanType, SpecializationTag
+from . import caching, realtime, search, tags, thumbnails, unread
+
+
+@receiver(post_save, sender=HealthProvider)
+def index_provider_on_save(sender, instance, raw=False, **kwargs):
+    '''Refresh the full-text index row of a saved provider'''
+    if raw:
+        return
+    search.index_provider(instance)
+    tags.sync_provider_tags(instance)
+
+
+@receiver(post_save, sender=HealthProvider)
+def thumbnail_provider_on_save(sender, instance, raw=False, **kwargs):
+    '''Create the thumbnails of a new or replaced profile image'''
+    if not raw:
+        thumbnails.generate_provider_thumbnails(instance)
+
+
+@receiver(post_delete, sender=HealthProvider)
+def remove_provider_on_delete(sender, instance, **kwargs):
+    '''Remove a deleted provider from the full-text index'''
+    search.remove_provider(instance.pk)
+    tags.invalidate_index()
+
+
+@receiver(m2m_changed, sender=HealthProvider.language_tags.through)
+@receiver(m2m_changed, sender=HealthProvider.specialization_tags.through)
+def invalidate_tag_index_on_m2m(sender, action, **kwargs):
+    '''Provider tags changed, so the inverted tag index is stale'''
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        tags.invalidate_index()
+        caching.bump_directory()
+
+
+@receiver(post_save, sender=LanguageTag)
+@receiver(post_save, sender=SpecializationTag)
+@receiver(post_delete, sender=LanguageTag)
+@receiver(post_delete, sender=SpecializationTag)
+def invalidate_tag_index_on_tag_change(sender, **kwargs):
+    '''A tag was renamed or removed'''
+    tags.invalidate_index()
+    caching.bump_directory()
+
+
+@receiver(post_save, sender=HealthProvider)
+@receiver(post_delete, sender=HealthProvider)
+def invalidate_provider_fragments(sender, instance, **kwargs):
+    '''The provider's card and profile show its own fields'''
+    caching.bump_provider(instance.pk)
+
+
+@receiver(post_save, sender=Availability)
+@receiver(post_delete, sender=Availability)
+def invalidate_fragments_on_availability(sender, instance, **kwargs):
+    '''The profile lists the weekly availability'''
+    caching.bump_provider(instance.health_provider_id, directory=False)
+
+
+@receiver(m2m_changed, sender=PlanType.providers.through)
+def invalidate_fragments_on_plan_types(sender, instance, action, reverse, pk_set, **kwargs):
+    '''The profile lists the supported plan types'''
+    if reverse:
+        # provider.supported_plan_types changed
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            caching.bump_provider(instance.pk, directory=False)
+    elif action == 'pre_clear':
+        # plan_type.providers.clear() does not pass the removed ids to post_clear
+        instance._cleared_provider_ids = list(instance.providers.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        caching.bump_provider(*getattr(instance, '_cleared_provider_ids', []), directory=False)
+    elif action in ('post_add', 'post_remove'):
+        caching.bump_provider(*pk_set, directory=False)
+
+
+@receiver(post_save, sender=PlanType)
+@receiver(pre_delete, sender=PlanType)
+def invalidate_fragments_on_plan_type_edit(sender, instance, raw=False, **kwargs):
+    '''A changed or removed plan type shows on the profile of every provider offering it'''
+    if not raw and instance.pk:
+        caching.bump_provider(*instance.providers.values_list('pk', flat=True), directory=False)
+
+
+@receiver(post_save, sender=Message)
+def count_unread_on_create(sender, instance, created, raw=False, **kwargs):
+    '''A new message is unread for its recipient'''
+    if created and not raw:
+        unread.record_message(instance)
+
+
+@receiver(post_save, sender=Message)
+def push_message_on_create(sender, instance, created, raw=False, **kwargs):
+    '''Stream a new message to the open threads once it is committed'''
+    if created and not raw:
+        transaction.on_commit(lambda: realtime.publish_message(instance))
+
+
+@receiver(post_delete, sender=Message)
+def uncount_unread_on_delete(sender, instance, **kwargs):
+    '''A deleted unread message no longer counts'''
+    unread.forget_message(instance)
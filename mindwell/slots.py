@@ -0,0 +1,147 @@
+# mindwell/slots.py
+# Gracious Ogyiri Asare - gpoa@bu.edu
+# Bookable-slot engine: weekly availability minus booked sessions, for a whole date range
+
+from datetime import date, datetime, time, timedelta
+from django.utils import timezone
+from .models import Availability, Session, DAYS_OF_WEEK as WEEKDAYS
+
+SLOT_STEP_MINUTES = 30
+SLOT_WINDOW_DAYS = 28
+# longest range one slots request may ask for
+MAX_QUERY_DAYS = 90
+
+
+class SlotQueryError(ValueError):
+    '''A slots request whose start, days or duration is malformed or out of range'''
+
+
+def to_minutes(value):
+    '''Minutes since midnight of a time'''
+    return value.hour * 60 + value.minute
+
+
+def to_time(minutes):
+    '''Time of day for minutes since midnight'''
+    return time(minutes // 60, minutes % 60)
+
+
+def merge_intervals(intervals):
+    '''Sort (start, end) intervals and merge the ones that touch or overlap'''
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(interval) for interval in merged]
+
+
+def subtract_intervals(windows, busy):
+    '''Remove busy intervals from windows; both lists sorted and merged, walked in one sweep'''
+    free = []
+    i = 0
+    for start, end in windows:
+        while i < len(busy) and busy[i][1] <= start:
+            i += 1
+        cursor = start
+        j = i
+        while j < len(busy) and busy[j][0] < end:
+            if busy[j][0] > cursor:
+                free.append((cursor, busy[j][0]))
+            cursor = max(cursor, busy[j][1])
+            j += 1
+        if cursor < end:
+            free.append((cursor, end))
+    return free
+
+
+def slot_starts(free, duration, step=SLOT_STEP_MINUTES, earliest=0):
+    '''Start minutes, every step minutes, of each duration-long slot fitting in free'''
+    starts = []
+    for start, end in free:
+        first = max(start, earliest)
+        # keep slots aligned to the window start so they line up on the hour
+        offset = (first - start) % step
+        if offset:
+            first += step - offset
+        starts.extend(range(first, end - duration + 1, step))
+    return starts
+
+
+def weekly_windows(provider):
+    '''{weekday index: merged (start, end) minutes} of the provider, in one query'''
+    windows = {}
+    rows = Availability.objects.filter(
+        health_provider=provider, is_available=True,
+    ).values_list('day_of_week', 'start_time', 'end_time')
+    for day, start, end in rows:
+        windows.setdefault(WEEKDAYS.index(day), []).append((to_minutes(start), to_minutes(end)))
+    return {day: merge_intervals(intervals) for day, intervals in windows.items()}
+
+
+def booked_intervals(provider, start_date, end_date):
+    '''{date: merged (start, end) minutes} of scheduled sessions in the range, in one query'''
+    booked = {}
+    rows = Session.objects.filter(
+        therapy_plan__health_provider=provider,
+        session_date__gte=start_date,
+        session_date__lte=end_date,
+        status='scheduled',
+    ).values_list('session_date', 'session_time', 'duration')
+    for day, start, duration in rows:
+        begin = to_minutes(start)
+        booked.setdefault(day, []).append((begin, begin + duration))
+    return {day: merge_intervals(intervals) for day, intervals in booked.items()}
+
+
+def open_slots(provider, start_date, end_date, duration=60, step=SLOT_STEP_MINUTES, now=None):
+    '''{date: [time, ...]} of bookable session starts between start_date and end_date inclusive'''
+    now = timezone.localtime(now) if now else timezone.localtime()
+    windows = weekly_windows(provider)
+    booked = booked_intervals(provider, start_date, end_date)
+
+    slots = {}
+    day = start_date
+    while day <= end_date:
+        if day >= now.date() and day.weekday() in windows:
+            free = subtract_intervals(windows[day.weekday()], booked.get(day, []))
+            earliest = to_minutes(now.time()) + 1 if day == now.date() else 0
+            starts = slot_starts(free, duration, step, earliest)
+            if starts:
+                slots[day] = [to_time(minutes) for minutes in starts]
+        day += timedelta(days=1)
+    return slots
+
+
+def upcoming_slots(provider, duration=60, days=SLOT_WINDOW_DAYS, now=None):
+    '''open_slots for the next days days, starting today'''
+    today = timezone.localdate(now) if now else timezone.localdate()
+    return open_slots(provider, today, today + timedelta(days=days - 1), duration, now=now)
+
+
+def slot_value(day, start):
+    '''Form/API value of one slot, e.g. 2025-12-15T09:30'''
+    return datetime.combine(day, start).strftime('%Y-%m-%dT%H:%M')
+
+
+def slots_for_query(provider, params, now=None):
+    '''JSON-ready open slots of a provider for the start/days/duration query parameters
+
+    Raises SlotQueryError for bad parameters. Shared by the slots page and the API.
+    '''
+    try:
+        start = date.fromisoformat(params['start']) if params.get('start') else timezone.localdate()
+        days = min(int(params.get('days', SLOT_WINDOW_DAYS)), MAX_QUERY_DAYS)
+        duration = int(params.get('duration', 60))
+    except ValueError:
+        raise SlotQueryError('start must be YYYY-MM-DD, days and duration integers')
+    if days < 1 or duration < SLOT_STEP_MINUTES:
+        raise SlotQueryError(f'days must be positive and duration at least {SLOT_STEP_MINUTES}')
+
+    found = open_slots(provider, start, start + timedelta(days=days - 1), duration, now=now)
+    return {
+        'provider': provider.pk,
+        'duration': duration,
+        'slots': {day.isoformat(): [t.strftime('%H:%M') for t in times] for day, times in found.items()},
+    }
@@ -0,0 +1,159 @@
+# mindwell/staticfiles.py
+# Gracious Ogyiri Asare - gpoa@bu.edu
+# Content-hashed, precompressed static files served by the app itself
+
+import gzip
+import mimetypes
+import os
+import re
+from urllib.parse import unquote, urlsplit
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date
+
+try:
+    import brotli
+except ImportError:  # optional, gzip alone is still served
+    brotli = None
+
+# text formats worth compressing; images and fonts are already compressed
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.mjs', '.json', '.map', '.svg', '.txt', '.html', '.xml', '.ico'}
+MIN_COMPRESS_SIZE = 256
+
+# names rewritten by ManifestStaticFilesStorage carry a 12 hex digit content hash
+HASHED_NAME = re.compile(r'\.[0-9a-f]{12}\.\w+$')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, max-age=60, must-revalidate'
+
+# (Content-Encoding, file suffix), in order of preference
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def accepted_encodings(header):
+    '''{coding: q} from an Accept-Encoding header; q=0 means refused'''
+    accepted = {}
+    for part in header.split(','):
+        coding, *params = [piece.strip() for piece in part.split(';')]
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding.lower()] = q
+    return accepted
+
+
+def compress(path):
+    '''Write .gz (and .br when brotli is installed) siblings of a file, return their paths'''
+    with open(path, 'rb') as file:
+        data = file.read()
+    if len(data) < MIN_COMPRESS_SIZE:
+        return []
+    variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data, quality=11)
+
+    written = []
+    for suffix, compressed in variants.items():
+        # keep the sibling only if it actually saves bytes
+        if len(compressed) < len(data):
+            with open(path + suffix, 'wb') as file:
+                file.write(compressed)
+            written.append(path + suffix)
+    return written
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    '''ManifestStaticFilesStorage that also precompresses the hashed files
+
+    A file missing from the manifest (collectstatic not run yet) is served
+    under its plain name instead of failing the page.
+    '''
+
+    def stored_name(self, name):
+        clean_name = self.clean_name(unquote(urlsplit(name).path.strip()))
+        if self.hash_key(clean_name) not in self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for hashed_name in set(self.hashed_files.values()):
+            if os.path.splitext(hashed_name)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+                compress(self.path(hashed_name))
+
+
+class StaticFilesMiddleware:
+    '''Serve STATIC_ROOT with far-future caching and precompressed variants
+
+    Content-hashed names never change, so they are cached for a year as
+    immutable; anything else is revalidated after a minute. The .br or .gz
+    sibling written by collectstatic is picked from Accept-Encoding.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if not settings.STATIC_ROOT or not settings.STATIC_URL.startswith('/'):
+            raise MiddlewareNotUsed()
+        self.prefix = settings.STATIC_URL
+        self.root = settings.STATIC_ROOT
+
+    def __call__(self, request):
+        if request.method in ('GET', 'HEAD') and request.path.startswith(self.prefix):
+            response = self.serve(request, request.path[len(self.prefix):])
+            if response is not None:
+                return response
+        return self.get_response(request)
+
+    def find(self, name):
+        '''Absolute path of a static file, or None'''
+        try:
+            path = safe_join(self.root, name)
+        except ValueError:
+            return None
+        return path if os.path.isfile(path) else None
+
+    def negotiate(self, request, path):
+        '''(path, encoding) of the best variant the client accepts'''
+        accepted = accepted_encodings(request.headers.get('Accept-Encoding', ''))
+        # highest q first, ties keep the ENCODINGS preference order
+        for encoding, suffix in sorted(ENCODINGS, key=lambda item: -accepted.get(item[0], 0)):
+            if accepted.get(encoding, 0) > 0 and os.path.isfile(path + suffix):
+                return path + suffix, encoding
+        return path, None
+
+    def serve(self, request, name):
+        '''FileResponse of name, 304 when the client copy is current, None if unknown'''
+        path = self.find(name)
+        if path is None:
+            return None
+        served, encoding = self.negotiate(request, path)
+        stat = os.stat(served)
+        etag = f'"{int(stat.st_mtime):x}-{stat.st_size:x}{"-" + encoding if encoding else ""}"'
+        immutable = bool(HASHED_NAME.search(name))
+
+        if request.headers.get('If-None-Match') == etag:
+            response = HttpResponseNotModified()
+        else:
+            response = FileResponse(open(served, 'rb'))
+            # FileResponse derives these from the .gz/.br name
+            del response['Content-Disposition']
+            response['Content-Type'] = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+            response['Content-Length'] = stat.st_size
+            if encoding:
+                response['Content-Encoding'] = encoding
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(stat.st_mtime)
+        response['Cache-Control'] = IMMUTABLE if immutable else REVALIDATE
+        response['Vary'] = 'Accept-Encoding'
+        return response
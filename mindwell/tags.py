@@ -0,0 +1,108 @@
+# mindwell/tags.py
+# Gracious Ogyiri Asare - gpoa@bu.edu
+# Language/specialization tags and the in-process inverted index over them
+
+import json
+import re
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from django.utils.text import slugify
+from .caching import bump, get_version
+from .models import HealthProvider, LanguageTag, SpecializationTag
+
+# version in the shared cache (see CACHES) so every worker notices when its index is stale
+INDEX_VERSION_KEY = 'mindwell:tag-index-version'
+
+FACETS = {
+    'language': (LanguageTag, 'language_tags', 'languages'),
+    'specialization': (SpecializationTag, 'specialization_tags', 'specialization'),
+}
+
+
+def split_tags(text):
+    '''Split a free-text list such as "English, French" into tag names'''
+    names = [' '.join(part.split()) for part in re.split(r'[,;/|]', text or '')]
+    return [name for name in names if slugify(name)]
+
+
+def parse_filter(value):
+    '''Turn a query parameter such as "english,french" into tag slugs'''
+    return sorted({slugify(name) for name in split_tags(value)})
+
+
+def sync_provider_tags(provider):
+    '''Re-derive the tags of a provider from its text fields'''
+    for tag_model, relation, field in FACETS.values():
+        names = {slugify(name): name for name in split_tags(getattr(provider, field))}
+        existing = {tag.slug: tag for tag in tag_model.objects.filter(slug__in=names)}
+        missing = [tag_model(name=name, slug=slug) for slug, name in names.items() if slug not in existing]
+        if missing:
+            tag_model.objects.bulk_create(missing, ignore_conflicts=True)
+            existing = {tag.slug: tag for tag in tag_model.objects.filter(slug__in=names)}
+        getattr(provider, relation).set(existing.values())
+
+
+class TagIndex:
+    '''Inverted index from tag slug to the set of provider ids carrying it'''
+
+    def __init__(self):
+        self.postings = {}
+        self.names = {}
+        for facet, (tag_model, relation, field) in FACETS.items():
+            through = getattr(HealthProvider, relation).through
+            tag_field = f'{tag_model._meta.model_name}'
+            postings = {}
+            names = {}
+            rows = through.objects.values_list('healthprovider_id', f'{tag_field}__slug', f'{tag_field}__name')
+            for provider_id, slug, name in rows:
+                postings.setdefault(slug, set()).add(provider_id)
+                names[slug] = name
+            self.postings[facet] = postings
+            self.names[facet] = names
+
+    def lookup(self, **filters):
+        '''Intersect the posting lists of every requested tag, None when unfiltered'''
+        result = None
+        for facet, slugs in filters.items():
+            for slug in slugs:
+                ids = self.postings[facet].get(slug, set())
+                result = ids if result is None else result & ids
+        return result
+
+    def facet_counts(self, facet, provider_ids=None):
+        '''Return [(slug, name, count)] for a facet, restricted to provider_ids'''
+        counts = []
+        for slug, ids in self.postings[facet].items():
+            count = len(ids) if provider_ids is None else len(ids & provider_ids)
+            if count:
+                counts.append((slug, self.names[facet][slug], count))
+        return sorted(counts, key=lambda item: (-item[2], item[1]))
+
+
+_index = None
+_index_version = None
+
+
+def get_index():
+    '''Return the process-wide TagIndex, rebuilding it if another change bumped the version'''
+    global _index, _index_version
+    version = get_version(INDEX_VERSION_KEY)
+    if _index is None or _index_version != version:
+        _index = TagIndex()
+        _index_version = version
+    return _index
+
+
+def invalidate_index():
+    '''Mark the TagIndex of every process as stale'''
+    global _index
+    _index = None
+    bump(INDEX_VERSION_KEY)
+
+
+def filter_by_ids(queryset, ids):
+    '''Restrict a queryset to a Python set of primary keys'''
+    if connection.vendor == 'sqlite':
+        # a single JSON parameter instead of one bound variable per id
+        return queryset.filter(pk__in=RawSQL('SELECT value FROM json_each(%s)', (json.dumps(sorted(ids)),)))
+    return queryset.filter(pk__in=ids)
@@ -0,0 +1,34 @@
+# mindwell/templatetags/mindwell_images.py
+# Gracious Ogyiri Asare - gpoa@bu.edu
+# Template helpers for responsive, lazily loaded profile images
+
+from django import template
+from django.utils.html import format_html
+from mindwell.thumbnails import has_thumbnails, thumbnail_urls
+
+register = template.Library()
+
+
+@register.simple_tag
+def profile_image(provider, width, css_class='', lazy=True):
+    '''<img> of a provider's thumbnails with a srcset, rendered width px wide
+
+    The browser picks the smallest WebP variant that is sharp at its pixel
+    density; lazy=False is for images above the fold. Images whose thumbnails
+    are missing (not backfilled yet, or unreadable) are shown as uploaded.
+    '''
+    image = provider.profile_img
+    loading = 'lazy' if lazy else 'eager'
+    if not has_thumbnails(image.name, image.storage):
+        return format_html(
+            '<img src="{}" width="{}" height="{}" alt="{} {}" class="{}" loading="{}" decoding="async">',
+            image.url, width, width, provider.first_name, provider.last_name, css_class, loading,
+        )
+    urls = thumbnail_urls(image)
+    srcset = ', '.join(f'{url} {size}w' for size, url in urls.items())
+    smallest = next(iter(urls.values()))
+    return format_html(
+        '<img src="{}" srcset="{}" sizes="{}px" width="{}" height="{}" alt="{} {}" class="{}" loading="{}" decoding="async">',
+        smallest, srcset, width, width, width,
+        provider.first_name, provider.last_name, css_class, loading,
+    )
@@ -1,3 +1,1046 @@
-from django.test import TestCase
+import gzip
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+from datetime import date, time, timedelta
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.db.models import Exists, OuterRef
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.templatetags.static import static
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.functional import empty
+from PIL import Image
+
+from .models import ArchivedMessage, Availability, HealthProvider, Message, Patient, PlanType, Session, TherapyPlan, ThreadReadState, UnreadCount
+from . import archive, booking, caching, dataset, realtime, schedule, slots, tags, thumbnails, unread
+from .benchmarks import scratch_cache
+from .booking import BookingConflict, reserve_session
+from .locking import retry_on_locked
+from .pagination import KeysetPaginator
+from .views import MessageStreamView, ViewMessagesView
 
 # Create your tests here.
+
+def run_in_other_process(code):
+    '''Run code with manage.py shell in a separate process, as another server worker would'''
+    # the same per-run test cache as this process
+    env = {**os.environ, 'MINDWELL_CACHE_DIR': str(settings.CACHES['default']['LOCATION'])}
+    subprocess.run([sys.executable, 'manage.py', 'shell', '-c', code], cwd=settings.BASE_DIR, env=env, check=True)
+
+
+class MindwellTestData:
+    '''Shared fixture: one provider, one patient and an active plan between them'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.provider_user = User.objects.create_user('provider', password='MindWell123!')
+        cls.patient_user = User.objects.create_user('patient', password='MindWell123!')
+        cls.provider = HealthProvider.objects.create(
+            user=cls.provider_user, first_name='Aisha', last_name='Bello',
+            specialization='Anxiety, Depression', languages='English, French',
+            bio='Helping adults manage anxiety and mood.',
+        )
+        cls.patient = Patient.objects.create(user=cls.patient_user, first_name='Fatima', last_name='Khan')
+        cls.plan_type = PlanType.objects.create(name='Weekly Video Therapy', base_cost=120)
+        cls.plan_type.providers.add(cls.provider)
+        cls.plan = TherapyPlan.objects.create(
+            patient=cls.patient, health_provider=cls.provider,
+            plan_type=cls.plan_type, status='active', start_date=date.today(),
+        )
+
+
+class RoleResolutionTests(MindwellTestData, TestCase):
+    '''The logged in user's provider/patient row is loaded once per request'''
+
+    def count_role_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        role_lookup = re.compile(r'FROM "mindwell_(healthprovider|patient)" WHERE "mindwell_\1"."user_id" =')
+        return sum(1 for q in ctx.captured_queries if role_lookup.search(q['sql']))
+
+    def test_provider_pages_resolve_role_once(self):
+        self.client.force_login(self.provider_user)
+        self.assertEqual(self.count_role_queries(reverse('provider_dashboard', args=[self.provider.pk])), 1)
+        self.assertLessEqual(self.count_role_queries(reverse('view_messages')), 2)
+
+    def test_patient_pages_resolve_role_once(self):
+        self.client.force_login(self.patient_user)
+        self.assertEqual(self.count_role_queries(reverse('patient_dashboard', args=[self.patient.pk])), 1)
+        self.assertEqual(self.count_role_queries(reverse('therapyplan_create', args=[self.provider.pk])), 1)
+
+    def test_dashboard_redirects_to_own_profile(self):
+        self.client.force_login(self.patient_user)
+        response = self.client.get(reverse('patient_dashboard', args=[self.patient.pk + 100]))
+        self.assertRedirects(response, reverse('patient_dashboard', args=[self.patient.pk]))
+
+
+class ProviderSearchTests(MindwellTestData, TestCase):
+    '''Full-text provider search stays in sync with HealthProvider'''
+
+    def search(self, text):
+        response = self.client.get(reverse('provider_list'), {'search': text})
+        return [provider.pk for provider in response.context['providers']]
+
+    def test_prefix_match_and_ranking(self):
+        other = HealthProvider.objects.create(first_name='Noah', last_name='Bennett', bio='Works with anxious teens.')
+        self.assertEqual(self.search('anx'), [self.provider.pk, other.pk])
+        self.assertEqual(self.search('bell'), [self.provider.pk])
+
+    def test_index_follows_save_and_delete(self):
+        self.provider.specialization = 'Grief'
+        self.provider.save()
+        self.assertEqual(self.search('grief'), [self.provider.pk])
+        self.assertEqual(self.search('depression'), [])
+        pk = self.provider.pk
+        HealthProvider.objects.filter(pk=pk).delete()
+        self.assertEqual(self.search('grief'), [])
+
+
+class ProviderTagFilterTests(MindwellTestData, TestCase):
+    '''Language and specialization filters match whole tags'''
+
+    def get(self, **params):
+        return self.client.get(reverse('provider_list'), params)
+
+    def test_tags_are_derived_from_text(self):
+        self.assertEqual(
+            sorted(self.provider.language_tags.values_list('slug', flat=True)), ['english', 'french'])
+
+    def test_exact_and_intersected_filters(self):
+        other = HealthProvider.objects.create(first_name='Noah', last_name='Bennett', languages='Non-English', specialization='Anxiety')
+        providers = lambda response: [p.pk for p in response.context['providers']]
+        self.assertEqual(providers(self.get(language='English')), [self.provider.pk])
+        self.assertEqual(providers(self.get(language='non-english')), [other.pk])
+        self.assertEqual(providers(self.get(specialization='anxiety')), [self.provider.pk, other.pk])
+        self.assertEqual(providers(self.get(specialization='anxiety', language='english,french')), [self.provider.pk])
+        self.assertEqual(providers(self.get(language='english,klingon')), [])
+
+    def test_facet_counts(self):
+        HealthProvider.objects.create(first_name='Noah', last_name='Bennett', languages='English', specialization='Grief')
+        response = self.get(language='english')
+        facets = {facet['label']: {o['name']: o['count'] for o in facet['options']} for facet in response.context['facets']}
+        self.assertEqual(facets['Languages'], {'English': 2, 'French': 1})
+        self.assertEqual(facets['Specializations'], {'Anxiety': 1, 'Depression': 1, 'Grief': 1})
+
+
+    def test_index_follows_changes_in_other_processes(self):
+        index = tags.get_index()
+        self.assertIs(tags.get_index(), index)
+        run_in_other_process('from mindwell import tags; tags.invalidate_index()')
+        self.assertIsNot(tags.get_index(), index)
+
+class KeysetPaginationTests(MindwellTestData, TestCase):
+    '''The directory pages forwards and backwards on (last_name, first_name, id)'''
+
+    def test_walk_directory_both_ways(self):
+        for i in range(45):
+            HealthProvider.objects.create(first_name=f'First{i % 4}', last_name=f'Last{i % 7}')
+        expected = list(HealthProvider.objects.order_by('last_name', 'first_name', 'id').values_list('pk', flat=True))
+
+        seen, pages, params = [], [], {}
+        while True:
+            response = self.client.get(reverse('provider_list'), params)
+            pages.append([p.pk for p in response.context['providers']])
+            seen += pages[-1]
+            if not response.context['next_query']:
+                break
+            params = {'after': response.context['page'].next_cursor}
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(pages), 3)
+
+        response = self.client.get(reverse('provider_list'), {'before': response.context['page'].prev_cursor})
+        self.assertEqual([p.pk for p in response.context['providers']], pages[1])
+
+    def test_datetime_keys_keep_microseconds(self):
+        base = timezone.now().replace(microsecond=0)
+        for i in range(6):
+            message = Message.objects.create(therapy_plan=self.plan, sender=self.patient_user,
+                                             recipient=self.provider_user, message=f'm{i}')
+            # all within one millisecond
+            Message.objects.filter(pk=message.pk).update(created_at=base + timedelta(microseconds=100 * i))
+        expected = list(Message.objects.order_by('-created_at', '-id').values_list('pk', flat=True))
+        paginator = KeysetPaginator(Message.objects.all(), ('-created_at', '-id'), 2)
+
+        seen, pages, page = [], [], paginator.page()
+        while True:
+            pages.append([m.pk for m in page])
+            seen += pages[-1]
+            if not page.has_next:
+                break
+            page = paginator.page(after=page.next_cursor)
+        self.assertEqual(seen, expected)
+        self.assertEqual([m.pk for m in paginator.page(before=page.prev_cursor)], pages[1])
+
+    def test_facet_links_start_from_the_first_page(self):
+        for i in range(25):
+            HealthProvider.objects.create(first_name='Ama', last_name=f'Zulu{i:02}', languages='English')
+        first = self.client.get(reverse('provider_list'))
+        second = self.client.get(reverse('provider_list'), {'after': first.context['page'].next_cursor})
+        links = [option['query'] for facet in second.context['facets'] for option in facet['options']]
+        self.assertIn('language=english', links)
+        self.assertFalse([link for link in links if 'after=' in link])
+        filtered = self.client.get(reverse('provider_list') + '?language=english')
+        self.assertEqual(filtered.context['providers'][0].pk, self.provider.pk)
+
+    def test_bad_cursor_falls_back_to_first_page(self):
+        response = self.client.get(reverse('provider_list'), {'after': 'not-a-cursor'})
+        self.assertEqual([p.pk for p in response.context['providers']], [self.provider.pk])
+
+
+class InboxThreadTests(MindwellTestData, TestCase):
+    '''The inbox shows one row per therapy plan with its latest message and unread count'''
+
+    def test_latest_message_per_plan_with_unread_count(self):
+        second_plan = TherapyPlan.objects.create(
+            patient=self.patient, health_provider=self.provider, plan_type=self.plan_type, status='active')
+        for text in ('hello', 'are you there?'):
+            Message.objects.create(therapy_plan=self.plan, sender=self.patient_user, recipient=self.provider_user, message=text)
+        Message.objects.create(therapy_plan=second_plan, sender=self.provider_user, recipient=self.patient_user, message='welcome')
+
+        self.client.force_login(self.provider_user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('view_messages'))
+        threads = response.context['threads']
+        self.assertEqual([(t.last_message, t.unread_count) for t in threads], [('welcome', 0), ('are you there?', 2)])
+        self.assertEqual(sum('"mindwell_message"' in q['sql'] and q['sql'].startswith('SELECT') for q in ctx.captured_queries), 1)
+
+
+    def test_threads_page_on_latest_message_time(self):
+        second_plan = TherapyPlan.objects.create(
+            patient=self.patient, health_provider=self.provider, plan_type=self.plan_type, status='active')
+        for plan in (self.plan, second_plan):
+            Message.objects.create(therapy_plan=plan, sender=self.patient_user, recipient=self.provider_user, message='hi')
+        self.client.force_login(self.provider_user)
+        with mock.patch.object(ViewMessagesView, 'page_size', 1):
+            first = self.client.get(reverse('view_messages'))
+            second = self.client.get(reverse('view_messages'), {'after': first.context['page'].next_cursor})
+            back = self.client.get(reverse('view_messages'), {'before': second.context['page'].prev_cursor})
+        self.assertEqual([plan.pk for plan in first.context['threads']], [second_plan.pk])
+        self.assertEqual([plan.pk for plan in second.context['threads']], [self.plan.pk])
+        self.assertEqual([plan.pk for plan in back.context['threads']], [second_plan.pk])
+
+class UnreadCounterTests(MindwellTestData, TestCase):
+    '''Unread counters follow message creation, reading and rebuilds'''
+
+    def send(self, sender, recipient, text='hi'):
+        return Message.objects.create(therapy_plan=self.plan, sender=sender, recipient=recipient, message=text)
+
+    def test_counters_follow_create_and_read(self):
+        kept = self.send(self.patient_user, self.provider_user)
+        message = self.send(self.patient_user, self.provider_user)
+        self.assertEqual(unread.unread_total(self.provider_user), 2)
+        message.delete()
+        self.assertEqual(unread.unread_total(self.provider_user), 1)
+
+        self.client.force_login(self.provider_user)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('view_messages'))
+        self.assertFalse([q for q in ctx.captured_queries if not q['sql'].startswith(('SELECT', 'SAVEPOINT', 'RELEASE'))])
+        self.assertEqual(unread.unread_total(self.provider_user), 1)
+
+        self.client.get(reverse('send_message', args=[self.plan.pk]))
+        self.assertEqual(unread.unread_total(self.provider_user), 0)
+        self.assertEqual(ThreadReadState.objects.get(user=self.provider_user).last_read_id, kept.pk)
+
+    def test_read_cursor_leaves_later_messages_unread(self):
+        first = self.send(self.patient_user, self.provider_user)
+        self.send(self.patient_user, self.provider_user)
+        unread.mark_read(self.provider_user, self.plan, up_to=first.pk)
+        self.assertEqual(unread.unread_total(self.provider_user), 1)
+        with self.assertNumQueries(1):  # already read that far: no write
+            unread.mark_read(self.provider_user, self.plan, up_to=first.pk)
+        first.delete()
+        self.assertEqual(unread.unread_total(self.provider_user), 1)
+
+    def test_dashboard_badge_does_not_count_messages(self):
+        self.send(self.provider_user, self.patient_user)
+        self.client.force_login(self.patient_user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('patient_dashboard', args=[self.patient.pk]))
+        self.assertEqual(response.context['unread_messages'], 1)
+        self.assertFalse(any('FROM "mindwell_message"' in q['sql'] for q in ctx.captured_queries))
+
+    def test_rebuild_reconciles_drift(self):
+        self.send(self.patient_user, self.provider_user)
+        UnreadCount.objects.filter(user=self.provider_user).update(count=40)
+        unread.rebuild(user_ids=[self.provider_user.pk])
+        self.assertEqual(unread.unread_total(self.provider_user), 1)
+
+
+class SlotEngineTests(MindwellTestData, TestCase):
+    '''Open slots are weekly availability minus booked sessions'''
+
+    def test_subtract_intervals(self):
+        windows = [(480, 720), (780, 1020)]
+        busy = [(450, 500), (600, 660), (1000, 1100)]
+        self.assertEqual(slots.subtract_intervals(windows, busy), [(500, 600), (660, 720), (780, 1000)])
+
+    def test_open_slots_respect_duration_and_bookings(self):
+        monday = date.today() + timedelta(days=7 - date.today().weekday())
+        Availability.objects.create(health_provider=self.provider, day_of_week='monday', start_time=time(9), end_time=time(12))
+        Session.objects.create(
+            therapy_plan=self.plan, session_date=monday, session_time=time(9, 30), duration=60,
+            status='scheduled', session_type='video', payment_status='unpaid')
+
+        with self.assertNumQueries(2):
+            found = slots.open_slots(self.provider, monday, monday + timedelta(days=27), duration=60)
+        self.assertEqual(found[monday], [time(10, 30), time(11)])
+        self.assertEqual(found[monday + timedelta(days=7)], [time(9), time(9, 30), time(10), time(10, 30), time(11)])
+        self.assertEqual(len(found), 4)
+
+    def test_slots_api(self):
+        response = self.client.get(reverse('provider_slots', args=[self.provider.pk]), {'days': 3})
+        self.assertEqual(response.json(), {'provider': self.provider.pk, 'duration': 60, 'slots': {}})
+        self.assertEqual(self.client.get(reverse('provider_slots', args=[self.provider.pk]), {'start': 'soon'}).status_code, 400)
+
+    def test_book_through_slot_picker(self):
+        monday = date.today() + timedelta(days=7 - date.today().weekday())
+        Availability.objects.create(health_provider=self.provider, day_of_week='monday', start_time=time(9), end_time=time(12))
+        self.client.force_login(self.patient_user)
+        url = reverse('session_create', args=[self.plan.pk])
+        self.assertContains(self.client.get(url), f'value="{monday.isoformat()}T09:00"')
+        response = self.client.post(url, {'slot': f'{monday.isoformat()}T09:00', 'duration': 60, 'session_type': 'video'})
+        self.assertRedirects(response, reverse('patient_dashboard', args=[self.patient.pk]))
+        self.assertTrue(Session.objects.filter(session_date=monday, session_time=time(9)).exists())
+
+
+class ReservationTests(MindwellTestData, TestCase):
+    '''Bookings are checked against availability and existing sessions'''
+
+    def setUp(self):
+        self.monday = date.today() + timedelta(days=7 - date.today().weekday())
+        Availability.objects.create(health_provider=self.provider, day_of_week='monday', start_time=time(9), end_time=time(12))
+
+    def test_rejects_overlap_using_duration(self):
+        reserve_session(self.plan, self.monday, time(9), 90, session_type='video')
+        with self.assertRaises(BookingConflict):
+            reserve_session(self.plan, self.monday, time(10), 60, session_type='video')
+        reserve_session(self.plan, self.monday, time(10, 30), 60, session_type='video')
+
+    def test_rejects_outside_availability_and_past(self):
+        with self.assertRaises(BookingConflict):
+            reserve_session(self.plan, self.monday, time(11, 30), 60, session_type='video')
+        with self.assertRaises(BookingConflict):
+            reserve_session(self.plan, self.monday - timedelta(days=14), time(9), 60, session_type='video')
+
+
+class SessionSeriesTests(MindwellTestData, TestCase):
+    '''Recurring series are checked in one pass and inserted together'''
+
+    def setUp(self):
+        self.monday = date.today() + timedelta(days=7 - date.today().weekday())
+        Availability.objects.create(health_provider=self.provider, day_of_week='monday', start_time=time(9), end_time=time(12))
+
+    def test_series_dates(self):
+        self.assertEqual(len(booking.series_dates(self.monday, 2, occurrences=4)), 4)
+        until = booking.series_dates(self.monday, 1, until=self.monday + timedelta(weeks=3, days=1))
+        self.assertEqual(until[-1], self.monday + timedelta(weeks=3))
+
+    def test_conflicts_are_reported_per_occurrence(self):
+        reserve_session(self.plan, self.monday + timedelta(weeks=1), time(9, 30), 60, session_type='video')
+        dates = booking.series_dates(self.monday, occurrences=10)
+        with self.assertNumQueries(2):
+            conflicts = booking.check_series(self.provider, dates, time(9), 60)
+        self.assertEqual(list(conflicts), [self.monday + timedelta(weeks=1)])
+
+        with self.assertRaises(booking.SeriesConflict):
+            booking.reserve_series(self.plan, dates, time(9), 60, session_type='video')
+        self.assertEqual(Session.objects.count(), 1)
+        sessions, conflicts = booking.reserve_series(self.plan, dates, time(9), 60, skip_conflicts=True,
+                                                     session_type='video')
+        self.assertEqual((len(sessions), len(conflicts)), (9, 1))
+
+    def test_series_view(self):
+        self.client.force_login(self.patient_user)
+        response = self.client.post(reverse('session_series_create', args=[self.plan.pk]), {
+            'first_date': self.monday, 'session_time': '10:00', 'duration': 60,
+            'session_type': 'video', 'interval_weeks': 2, 'occurrences': 3,
+        })
+        self.assertRedirects(response, reverse('patient_dashboard', args=[self.patient.pk]))
+        self.assertEqual(list(Session.objects.values_list('session_date', flat=True).order_by('session_date')),
+                         [self.monday + timedelta(weeks=w) for w in (0, 2, 4)])
+
+    def test_series_view_rejects_until_past_max_occurrences(self):
+        self.client.force_login(self.patient_user)
+        response = self.client.post(reverse('session_series_create', args=[self.plan.pk]), {
+            'first_date': self.monday, 'session_time': '10:00', 'duration': 60, 'session_type': 'video',
+            'interval_weeks': 1, 'until': self.monday + timedelta(weeks=booking.MAX_OCCURRENCES),
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(f'at most {booking.MAX_OCCURRENCES} sessions', response.content.decode())
+        self.assertFalse(Session.objects.exists())
+
+        response = self.client.post(reverse('session_series_create', args=[self.plan.pk]), {
+            'first_date': self.monday, 'session_time': '10:00', 'duration': 60, 'session_type': 'video',
+            'interval_weeks': 2, 'until': self.monday + timedelta(weeks=4),
+        })
+        self.assertEqual(Session.objects.count(), 3)
+
+
+class ConcurrentReservationTests(MindwellTestData, TransactionTestCase):
+    '''Many threads booking the same provider never double book'''
+
+    def setUp(self):
+        self.setUpTestData()
+        self.monday = date.today() + timedelta(days=7 - date.today().weekday())
+        Availability.objects.create(health_provider=self.provider, day_of_week='monday', start_time=time(9), end_time=time(17))
+
+    def test_stress_no_double_booking(self):
+        starts = [time(9 + i // 2, 30 * (i % 2)) for i in range(15)]  # every half hour, 60 minute sessions
+        booked, conflicts, errors = [], [], []
+
+        def book(seed):
+            try:
+                rng = random.Random(seed)
+                for _ in range(20):
+                    try:
+                        booked.append(reserve_session(self.plan, self.monday, rng.choice(starts), 60, session_type='video'))
+                    except BookingConflict:
+                        conflicts.append(seed)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=book, args=(seed,)) for seed in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(booked) + len(conflicts), 16 * 20)
+        sessions = sorted(Session.objects.filter(session_date=self.monday).values_list('session_time', 'duration'))
+        self.assertEqual(len(sessions), len(booked))
+        for (first, length), (second, _) in zip(sessions, sessions[1:]):
+            self.assertLessEqual(slots.to_minutes(first) + length, slots.to_minutes(second))
+
+
+class AvailabilityByDayTests(MindwellTestData, TestCase):
+    '''Weekly availability is grouped Monday first from a single query'''
+
+    def test_grouped_in_weekday_order_with_one_query(self):
+        for day, hour in (('sunday', 9), ('friday', 13), ('monday', 15), ('monday', 9), ('wednesday', 10)):
+            Availability.objects.create(health_provider=self.provider, day_of_week=day, start_time=time(hour), end_time=time(hour + 2))
+        Availability.objects.create(health_provider=self.provider, day_of_week='tuesday', start_time=time(9), end_time=time(10), is_available=False)
+
+        with self.assertNumQueries(1):
+            by_day = self.provider.get_availability_by_day()
+        self.assertEqual(list(by_day), ['monday', 'wednesday', 'friday', 'sunday'])
+        self.assertEqual([slot.start_time for slot in by_day['monday']], [time(9), time(15)])
+        self.assertEqual(
+            list(dict.fromkeys(Availability.objects.values_list('day_of_week', flat=True))),
+            ['monday', 'tuesday', 'wednesday', 'friday', 'sunday'],
+        )
+
+    def test_profile_query_count_does_not_grow_with_schedule(self):
+        url = reverse('provider_detail', args=[self.provider.pk])
+        with CaptureQueriesContext(connection) as empty:
+            self.client.get(url)
+        for day in ('monday', 'tuesday', 'wednesday', 'thursday', 'friday'):
+            for hour in (9, 13):
+                Availability.objects.create(health_provider=self.provider, day_of_week=day, start_time=time(hour), end_time=time(hour + 3))
+        with CaptureQueriesContext(connection) as full:
+            self.client.get(url)
+        self.assertEqual(len(full.captured_queries), len(empty.captured_queries))
+
+    def test_profile_form_reads_availability_once(self):
+        Availability.objects.create(health_provider=self.provider, day_of_week='monday', start_time=time(9), end_time=time(12))
+        self.client.force_login(self.provider_user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('provider_update'))
+        self.assertEqual(list(response.context['availability_by_day']), ['monday'])
+        self.assertEqual(sum('mindwell_availability' in query['sql'] for query in queries.captured_queries), 1)
+
+
+class DashboardQueryTests(MindwellTestData, TestCase):
+    '''Dashboards cost the same number of queries for 1 patient or 30'''
+
+    def add_patients(self, count):
+        start = Patient.objects.count()
+        for i in range(start, start + count):
+            user = User.objects.create_user(f'patient-{i}')
+            patient = Patient.objects.create(user=user, first_name=f'P{i}')
+            plan = TherapyPlan.objects.create(patient=patient, health_provider=self.provider, plan_type=self.plan_type, status='active')
+            for days in (0, 3):
+                Session.objects.create(
+                    therapy_plan=plan, session_date=date.today() + timedelta(days=days), session_time=time(9),
+                    status='scheduled', session_type='video', payment_status='unpaid')
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_provider_dashboard_query_count_is_fixed(self):
+        self.client.force_login(self.provider_user)
+        url = reverse('provider_dashboard', args=[self.provider.pk])
+        self.add_patients(1)
+        few = self.count_queries(url)
+        self.add_patients(30)
+        self.assertEqual(self.count_queries(url), few)
+
+    def test_patient_dashboard_query_count_is_fixed(self):
+        self.client.force_login(self.patient_user)
+        url = reverse('patient_dashboard', args=[self.patient.pk])
+        few = self.count_queries(url)
+        for i in range(10):
+            other = HealthProvider.objects.create(first_name=f'D{i}', last_name=f'L{i}')
+            plan = TherapyPlan.objects.create(patient=self.patient, health_provider=other, plan_type=self.plan_type, status='active')
+            Session.objects.create(
+                therapy_plan=plan, session_date=date.today() + timedelta(days=i), session_time=time(9),
+                status='scheduled', session_type='video', payment_status='unpaid')
+        self.assertEqual(self.count_queries(url), few)
+
+
+class QueryInstrumentationTests(MindwellTestData, TestCase):
+    '''Sampled requests get a Server-Timing header and over-budget ones are logged'''
+
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(MINDWELL_QUERY_SAMPLE_RATE=1, MINDWELL_QUERY_BUDGETS={'provider_list': {'queries': 0}})
+    def test_server_timing_and_budget_warning(self):
+        with self.assertLogs('mindwell.queries', 'WARNING') as logs:
+            response = self.client.get(reverse('provider_list'))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", app;dur=[\d.]+$')
+        self.assertIn('"view": "provider_list"', logs.output[0])
+
+    def test_disabled_by_default(self):
+        self.assertFalse(self.client.get(reverse('provider_list')).has_header('Server-Timing'))
+
+
+class DatasetGeneratorTests(TestCase):
+    '''The synthetic dataset is consistent with the derived search, tag and unread data'''
+
+    def test_generate_small_dataset(self):
+        sizes = {'providers': 4, 'patients': 6, 'plans': 10, 'sessions': 20, 'messages': 50}
+        dataset.generate(sizes, prefix='t')
+        self.assertEqual(HealthProvider.objects.count(), 4)
+        self.assertEqual(Message.objects.count(), 50)
+        self.assertTrue(HealthProvider.objects.filter(specialization_tags__isnull=False).exists())
+        unread_messages = Message.objects.filter(Exists(ThreadReadState.objects.filter(
+            user=OuterRef('recipient'), therapy_plan=OuterRef('therapy_plan'), last_read_id__lt=OuterRef('id'),
+        )))
+        self.assertEqual(sum(UnreadCount.objects.values_list('count', flat=True)), unread_messages.count())
+        self.assertTrue(0 < unread_messages.count() < Message.objects.count())
+        self.assertTrue(self.client.login(username='t-patient-0', password=dataset.PASSWORD))
+
+
+class QueryPlanTests(TestCase):
+    '''The hot dashboard, booking and inbox queries are all served by indexes'''
+
+    def test_no_table_scans(self):
+        out = StringIO()
+        call_command('check_query_plans', stdout=out)
+        self.assertIn('No table scans', out.getvalue())
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ThumbnailTests(MindwellTestData, TestCase):
+    '''Profile images get small WebP variants that the directory serves with srcset'''
+
+    def upload(self, size=(800, 600), name='aisha.jpg', color='teal'):
+        buffer = BytesIO()
+        Image.new('RGB', size, color).save(buffer, 'PNG' if name.endswith('.png') else 'JPEG')
+        self.provider.profile_img = SimpleUploadedFile(name, buffer.getvalue())
+        self.provider.save()
+
+    def test_thumbnails_created_on_save(self):
+        self.upload()
+        for size in thumbnails.THUMBNAIL_SIZES:
+            with default_storage.open(thumbnails.thumbnail_name(self.provider.profile_img.name, size)) as file:
+                self.assertEqual(Image.open(file).size, (size, size))
+
+    def test_directory_uses_srcset_and_lazy_loading(self):
+        self.upload()
+        html = self.client.get(reverse('provider_list')).content.decode()
+        self.assertIn('-96.webp 96w', html)
+        self.assertIn('loading="lazy"', html)
+        self.assertNotIn(self.provider.profile_img.url + '"', html)
+
+    def test_same_stem_uploads_get_their_own_thumbnails(self):
+        self.upload(name='aisha.jpg', color='teal')
+        self.upload(name='aisha.png', color='red')
+        with default_storage.open(thumbnails.thumbnail_name(self.provider.profile_img.name, 96)) as file:
+            red, green, blue = Image.open(file).convert('RGB').getpixel((48, 48))
+        self.assertGreater(red, 200)
+        self.assertLess(green, 50)
+
+    def test_missing_thumbnails_fall_back_to_the_upload(self):
+        self.upload()
+        for size in thumbnails.THUMBNAIL_SIZES:
+            default_storage.delete(thumbnails.thumbnail_name(self.provider.profile_img.name, size))
+        cache.clear()
+        html = self.client.get(reverse('provider_list')).content.decode()
+        self.assertIn(f'src="{self.provider.profile_img.url}"', html)
+        self.assertNotIn('srcset', html)
+
+    def test_backfill_command(self):
+        self.upload(size=(64, 64))
+        name = self.provider.profile_img.name
+        out = StringIO()
+        call_command('generate_thumbnails', workers=1, force=True, stdout=out)
+        self.assertIn('Wrote 2 thumbnails for 1 images', out.getvalue())
+        with default_storage.open(thumbnails.thumbnail_name(name, 256)) as file:
+            self.assertEqual(Image.open(file).size, (64, 64))
+
+
+class StaticPipelineTests(TestCase):
+    '''collectstatic output is hashed, precompressed and served with immutable caching'''
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        settings_override = override_settings(STATIC_ROOT=self.root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        staticfiles_storage._wrapped = empty
+        self.addCleanup(setattr, staticfiles_storage, '_wrapped', empty)
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    def test_hashed_css_is_immutable_and_gzipped(self):
+        url = static('styles.css')
+        self.assertRegex(url, r'styles\.[0-9a-f]{12}\.css$')
+        response = self.client.get(url, headers={'accept-encoding': 'gzip'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        body = gzip.decompress(b''.join(response.streaming_content))
+        with open(os.path.join(self.root, 'styles.css'), 'rb') as file:
+            self.assertEqual(body, file.read())
+
+        again = self.client.get(url, headers={'accept-encoding': 'gzip', 'if-none-match': response['ETag']})
+        self.assertEqual(again.status_code, 304)
+
+    def test_refused_codings_are_not_served(self):
+        url = static('styles.css')
+        response = self.client.get(url, headers={'accept-encoding': 'gzip;q=0'})
+        self.assertNotIn('Content-Encoding', response)
+        response = self.client.get(url, headers={'accept-encoding': 'br;q=0, gzip;q=0.5'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+    def test_plain_names_revalidate_and_identity(self):
+        response = self.client.get('/static/styles.css')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertIn('must-revalidate', response['Cache-Control'])
+
+
+class FragmentCacheTests(MindwellTestData, TestCase):
+    '''Provider cards and profiles are rendered once per provider version'''
+
+    def setUp(self):
+        cache.clear()
+
+    def test_warm_directory_skips_rendering(self):
+        self.client.get(reverse('provider_list'))
+        with mock.patch('mindwell.caching.render_to_string') as render:
+            response = self.client.get(reverse('provider_list'))
+        render.assert_not_called()
+        self.assertContains(response, 'Dr. Aisha Bello')
+
+    def test_provider_edit_refreshes_card(self):
+        self.client.get(reverse('provider_list'))
+        self.provider.occupation = 'Clinical Psychologist'
+        self.provider.save()
+        self.assertContains(self.client.get(reverse('provider_list')), 'Clinical Psychologist')
+
+    def test_edit_in_other_process_refreshes_card(self):
+        self.client.get(reverse('provider_list'))
+        HealthProvider.objects.filter(pk=self.provider.pk).update(occupation='Clinical Psychologist')
+        run_in_other_process(f'from mindwell import caching; caching.bump_provider({self.provider.pk})')
+        self.assertContains(self.client.get(reverse('provider_list')), 'Clinical Psychologist')
+
+    def test_suite_does_not_share_the_live_cache(self):
+        self.assertNotEqual(str(settings.CACHES['default']['LOCATION']), str(settings.BASE_DIR / 'cache'))
+
+    def test_benchmarks_use_a_scratch_cache(self):
+        cache.set('live-entry', 1)
+        with scratch_cache():
+            self.assertIsNone(cache.get('live-entry'))
+            cache.set('scratch-entry', 1)
+        self.assertEqual(cache.get('live-entry'), 1)
+        self.assertIsNone(cache.get('scratch-entry'))
+
+    def test_process_local_cache_is_flagged(self):
+        self.assertEqual(caching.check_shared_cache(None), [])
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertEqual([warning.id for warning in caching.check_shared_cache(None)], ['mindwell.W001'])
+
+    def test_profile_follows_availability_and_plan_types(self):
+        url = reverse('provider_detail', args=[self.provider.pk])
+        self.assertContains(self.client.get(url), 'Weekly Video Therapy')
+        with self.assertNumQueries(0):
+            caching.provider_profile(self.provider)
+
+        Availability.objects.create(health_provider=self.provider, day_of_week='friday',
+                                    start_time=time(9), end_time=time(12))
+        self.assertContains(self.client.get(url), 'Friday')
+        self.plan_type.providers.clear()
+        self.assertContains(self.client.get(url), 'No specific therapy plans listed.')
+
+
+class AnonymousPageCacheTests(MindwellTestData, TestCase):
+    '''Logged-out directory and profile pages are served whole from the cache'''
+
+    def setUp(self):
+        cache.clear()
+
+    def test_equivalent_directory_urls_share_one_entry(self):
+        self.client.get(reverse('provider_list'), {'search': ' anxiety ', 'language': 'French, English'})
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('provider_list'), {'language': 'english,french', 'search': 'anxiety'})
+        self.assertContains(response, 'Dr. Aisha Bello')
+
+    def test_profile_edit_invalidates_pages(self):
+        url = reverse('provider_detail', args=[self.provider.pk])
+        self.client.get(url)
+        self.client.get(reverse('provider_list'))
+        self.provider.last_name = 'Bello-Mensah'
+        self.provider.save()
+        self.assertContains(self.client.get(url), 'Bello-Mensah')
+        self.assertContains(self.client.get(reverse('provider_list')), 'Bello-Mensah')
+
+    def test_change_in_other_process_retires_cached_page(self):
+        self.client.get(reverse('provider_list'))
+        # bulk_create skips the signals that would bump the directory here
+        HealthProvider.objects.bulk_create([HealthProvider(first_name='Noah', last_name='Bennett')])
+        self.assertNotContains(self.client.get(reverse('provider_list')), 'Bennett')
+        run_in_other_process('from mindwell import caching; caching.bump_directory()')
+        self.assertContains(self.client.get(reverse('provider_list')), 'Bennett')
+
+    def test_logged_in_and_flash_message_pages_are_not_shared(self):
+        self.client.get(reverse('provider_list'))
+        self.client.force_login(self.patient_user)
+        self.assertContains(self.client.get(reverse('provider_list')), 'Logout')
+        self.client.logout()
+
+        request = RequestFactory().get(reverse('provider_list'))
+        request.user = AnonymousUser()
+        request._messages = CookieStorage(request)
+        messages.info(request, 'Welcome back')
+        self.assertFalse(caching.can_share_page(request))
+
+
+class MessageStreamTests(MindwellTestData, TestCase):
+    '''New messages are pushed to the participants streaming a thread'''
+
+    def stream_url(self, after=None):
+        url = reverse('message_stream', args=[self.plan.pk])
+        return f'{url}?after={after}' if after is not None else url
+
+    async def test_stream_catches_up_then_pushes(self):
+        old = await Message.objects.acreate(therapy_plan=self.plan, sender=self.provider_user,
+                                            recipient=self.patient_user, message='Before you connected')
+        await self.async_client.aforce_login(self.patient_user)
+        response = await self.async_client.get(self.stream_url(after=old.pk - 1))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b'retry: 3000\n\n')
+        self.assertIn(b'Before you connected', await anext(stream))
+
+        new = await Message.objects.acreate(therapy_plan=self.plan, sender=self.provider_user,
+                                            recipient=self.patient_user, message='Live reply')
+        await sync_to_async(realtime.publish_message)(new)
+        event = (await anext(stream)).decode()
+        self.assertTrue(event.startswith(f'id: {new.pk}\nevent: message\n'))
+        self.assertIn('Live reply', event)
+        # both messages were shown by the stream, which marks them read once it goes quiet
+        with mock.patch.multiple(MessageStreamView, heartbeat=0.01, read_delay=0.01):
+            self.assertEqual(await anext(stream), b': ping\n\n')
+        self.assertEqual(await sync_to_async(unread.unread_total)(self.patient_user), 0)
+
+    async def test_overflowing_listener_is_disconnected(self):
+        await self.async_client.aforce_login(self.patient_user)
+        response = await self.async_client.get(self.stream_url())
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b'retry: 3000\n\n')
+        hub = realtime.get_hub()
+        for event_id in range(1, realtime.QUEUE_SIZE + 2):
+            hub.publish(realtime.plan_topic(self.plan.pk), {'id': event_id, 'sender_id': self.provider_user.pk})
+        # ended so that EventSource reconnects and replays from the database
+        with self.assertRaises(StopAsyncIteration):
+            await anext(stream)
+        self.assertEqual(hub.listener_count(realtime.plan_topic(self.plan.pk)), 0)
+
+    async def test_hub_publishes_across_threads(self):
+        hub = realtime.InProcessHub()
+        with hub.subscribe('plan:1') as subscription:
+            await sync_to_async(hub.publish, thread_sensitive=False)('plan:1', {'id': 1})
+            self.assertEqual(await subscription.get(timeout=1), {'id': 1})
+            self.assertIsNone(await subscription.get(timeout=0.01))
+        self.assertEqual(hub.listener_count(), 0)
+
+    def test_only_participants_may_stream(self):
+        outsider = User.objects.create_user('outsider')
+        self.client.force_login(outsider)
+        self.assertEqual(self.client.get(self.stream_url()).status_code, 403)
+
+    def test_saved_message_is_published_on_commit(self):
+        with mock.patch('mindwell.realtime.publish_message') as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                message = Message.objects.create(therapy_plan=self.plan, sender=self.patient_user,
+                                                 recipient=self.provider_user, message='Hello')
+        publish.assert_called_once_with(message)
+
+
+class JsonApiTests(MindwellTestData, TestCase):
+    '''Read-only v1 API: field selection, cursors and conditional GET'''
+
+    def test_fields_and_cursor_pagination(self):
+        HealthProvider.objects.create(first_name='Zed', last_name='Zulu')
+        response = self.client.get(reverse('api_provider_list'), {'fields': 'id,last_name', 'limit': 1})
+        self.assertEqual(response.json()['results'], [{'id': self.provider.pk, 'last_name': 'Bello'}])
+        response = self.client.get(response.json()['next'])
+        self.assertEqual([row['last_name'] for row in response.json()['results']], ['Zulu'])
+        self.assertIsNone(response.json()['next'])
+        self.assertEqual(self.client.get(reverse('api_provider_list'), {'fields': 'email'}).status_code, 400)
+
+    def test_datetime_cursor_walks_plans_both_ways(self):
+        for _ in range(4):
+            TherapyPlan.objects.create(patient=self.patient, health_provider=self.provider,
+                                       plan_type=self.plan_type, status='active')
+        base = timezone.now().replace(microsecond=0)
+        for i, pk in enumerate(TherapyPlan.objects.order_by('pk').values_list('pk', flat=True)):
+            TherapyPlan.objects.filter(pk=pk).update(created_at=base + timedelta(microseconds=100 * i))
+        expected = list(TherapyPlan.objects.order_by('-created_at', '-id').values_list('pk', flat=True))
+        self.client.force_login(self.patient_user)
+
+        seen, pages, url = [], [], reverse('api_plan_list') + '?fields=id&limit=2'
+        while url:
+            body = self.client.get(url).json()
+            pages.append([row['id'] for row in body['results']])
+            seen += pages[-1]
+            previous, url = body['previous'], body['next']
+        self.assertEqual(seen, expected)
+        self.assertEqual([row['id'] for row in self.client.get(previous).json()['results']], pages[1])
+
+    def test_slots_match_the_slots_page(self):
+        Availability.objects.create(health_provider=self.provider, day_of_week='monday',
+                                    start_time=time(9), end_time=time(12))
+        for params in ({'days': 14}, {'start': 'soon'}, {'duration': 10}):
+            page = self.client.get(reverse('provider_slots', args=[self.provider.pk]), params)
+            api = self.client.get(reverse('api_provider_slots', args=[self.provider.pk]), params)
+            self.assertEqual((api.status_code, api.json()), (page.status_code, page.json()))
+
+    def test_unchanged_resource_is_not_modified(self):
+        self.client.force_login(self.patient_user)
+        Session.objects.create(therapy_plan=self.plan, session_date=date.today(), session_time=time(9))
+        url = reverse('api_session_list')
+        first = self.client.get(url)
+        self.assertEqual(len(first.json()['results']), 1)
+        # a delete need not move the latest updated_at, so lists only validate by ETag
+        self.assertNotIn('Last-Modified', first)
+
+        with self.assertNumQueries(3):  # session, user, aggregate
+            cached = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+        Session.objects.get().delete()
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.json()['results'], [])
+
+    def test_plans_are_scoped_to_the_user(self):
+        self.assertEqual(self.client.get(reverse('api_plan_list')).status_code, 401)
+        self.client.force_login(User.objects.create_user('outsider'))
+        self.assertEqual(self.client.get(reverse('api_plan_list')).json()['results'], [])
+        self.client.force_login(self.provider_user)
+        results = self.client.get(reverse('api_plan_list'), {'fields': 'id,status'}).json()['results']
+        self.assertEqual(results, [{'id': self.plan.pk, 'status': 'active'}])
+
+
+class WeeklyScheduleTests(MindwellTestData, TestCase):
+    '''Whole-week availability editor'''
+
+    def setUp(self):
+        self.monday = Availability.objects.create(health_provider=self.provider, day_of_week='monday',
+                                                  start_time=time(9), end_time=time(12))
+        self.friday = Availability.objects.create(health_provider=self.provider, day_of_week='friday',
+                                                  start_time=time(9), end_time=time(12))
+        self.client.force_login(self.provider_user)
+
+    def post_week(self, rows):
+        data = {'form-TOTAL_FORMS': len(rows), 'form-INITIAL_FORMS': 2, 'form-MAX_NUM_FORMS': 1000}
+        for i, row in enumerate(rows):
+            data.update({f'form-{i}-{name}': value for name, value in row.items()})
+        return self.client.post(reverse('manage_availability'), data)
+
+    def test_week_is_diffed_in_one_submission(self):
+        self.assertEqual(self.client.get(reverse('manage_availability')).status_code, 200)
+        response = self.post_week([
+            {'id': self.monday.pk, 'day_of_week': 'monday', 'start_time': '09:00', 'end_time': '13:00', 'is_available': 'on'},
+            {'id': self.friday.pk, 'day_of_week': 'friday', 'start_time': '09:00', 'end_time': '12:00', 'DELETE': 'on'},
+            {'day_of_week': 'tuesday', 'start_time': '14:00', 'end_time': '17:00', 'is_available': 'on'},
+        ])
+        self.assertRedirects(response, reverse('provider_dashboard', args=[self.provider.pk]))
+        rows = Availability.objects.filter(health_provider=self.provider).values_list('day_of_week', 'end_time')
+        self.assertEqual(list(rows), [('monday', time(13)), ('tuesday', time(17))])
+
+    def test_overlapping_windows_are_rejected(self):
+        response = self.post_week([
+            {'id': self.monday.pk, 'day_of_week': 'monday', 'start_time': '09:00', 'end_time': '12:00', 'is_available': 'on'},
+            {'id': self.friday.pk, 'day_of_week': 'monday', 'start_time': '11:00', 'end_time': '14:00', 'is_available': 'on'},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'overlaps')
+        self.assertTrue(Availability.objects.filter(pk=self.friday.pk, day_of_week='friday').exists())
+
+    def test_unchanged_week_writes_nothing(self):
+        windows = [{'id': None, 'day_of_week': row.day_of_week, 'start_time': row.start_time,
+                    'end_time': row.end_time, 'is_available': True} for row in (self.monday, self.friday)]
+        self.assertEqual(schedule.save_weekly_schedule(self.provider, windows), (0, 0, 0))
+
+
+class MessageArchiveTests(MindwellTestData, TestCase):
+    '''Old and closed-plan messages move to the archive table'''
+
+    def test_archive_moves_old_messages_in_batches(self):
+        for text in ('old one', 'old two', 'old unread', 'recent'):
+            Message.objects.create(therapy_plan=self.plan, sender=self.provider_user,
+                                   recipient=self.patient_user, message=text)
+            if text == 'old two':
+                unread.mark_read(self.patient_user, self.plan)
+        Message.objects.exclude(message='recent').update(created_at=timezone.now() - timedelta(days=400))
+        self.assertEqual(unread.unread_total(self.patient_user), 2)
+
+        self.assertEqual(archive.archive_messages(batch_size=2, days=365), 3)
+        self.assertEqual(list(Message.objects.values_list('message', flat=True)), ['recent'])
+        self.assertEqual(ArchivedMessage.objects.count(), 3)
+        self.assertEqual(unread.unread_total(self.patient_user), 1)
+
+        self.client.force_login(self.patient_user)
+        url = reverse('send_message', args=[self.plan.pk])
+        self.assertNotContains(self.client.get(url), 'old one')
+        self.assertContains(self.client.get(url, {'archived': 1}), 'old one')
+
+    def test_closed_plans_are_archived(self):
+        Message.objects.create(therapy_plan=self.plan, sender=self.provider_user,
+                               recipient=self.patient_user, message='Goodbye')
+        self.assertEqual(archive.archive_messages(), 0)
+        TherapyPlan.objects.filter(pk=self.plan.pk).update(status='completed')
+        self.assertEqual(archive.archive_messages(), 1)
+
+        # the fully archived thread stays in the inbox
+        self.client.force_login(self.patient_user)
+        threads = self.client.get(reverse('view_messages')).context['threads']
+        self.assertEqual([(plan.pk, plan.last_message) for plan in threads], [(self.plan.pk, 'Goodbye')])
+
+    def test_batch_counters_are_updated_in_bulk(self):
+        second_plan = TherapyPlan.objects.create(patient=self.patient, health_provider=self.provider,
+                                                 plan_type=self.plan_type, status='active')
+        for i in range(20):
+            Message.objects.create(therapy_plan=second_plan if i % 2 else self.plan, sender=self.provider_user,
+                                   recipient=self.patient_user, message=f'old {i}')
+        Message.objects.update(created_at=timezone.now() - timedelta(days=400))
+        # select, insert, both counter tables read and written, delete, and two savepoint pairs
+        with self.assertNumQueries(11):
+            self.assertEqual(archive.archive_batch(days=365), 20)
+        self.assertEqual(unread.unread_total(self.patient_user), 0)
+        self.assertFalse(ThreadReadState.objects.filter(count__gt=0).exists())
+
+
+class ThreadFragmentTests(MindwellTestData, TestCase):
+    '''Threads load their latest page, then older and newer fragments'''
+
+    def setUp(self):
+        self.sent = [
+            Message.objects.create(therapy_plan=self.plan, sender=self.provider_user if i % 2 else self.patient_user,
+                                   recipient=self.patient_user if i % 2 else self.provider_user, message=f'note {i:02}')
+            for i in range(35)
+        ]
+        self.client.force_login(self.patient_user)
+
+    def test_latest_page_then_older_by_cursor(self):
+        url = reverse('send_message', args=[self.plan.pk])
+        response = self.client.get(url)
+        self.assertContains(response, 'note 34')
+        self.assertNotContains(response, 'note 04')
+        with self.assertNumQueries(6):  # plan, session, user, two role lookups, one page with senders
+            older = self.client.get(reverse('message_older', args=[self.plan.pk]),
+                                    {'before': response.context['older_cursor']})
+        self.assertContains(older, 'note 00')
+        self.assertNotContains(older, 'note 05')
+        self.assertEqual(older['X-Older-Cursor'], '')
+
+    def test_same_millisecond_messages_are_not_skipped(self):
+        base = timezone.now().replace(microsecond=0)
+        for i, message in enumerate(self.sent):
+            Message.objects.filter(pk=message.pk).update(created_at=base + timedelta(microseconds=10 * i))
+        response = self.client.get(reverse('send_message', args=[self.plan.pk]))
+        shown = [m.pk for m in response.context['message_list']]
+        cursor = response.context['older_cursor']
+        while cursor:
+            older = self.client.get(reverse('message_older', args=[self.plan.pk]), {'before': cursor})
+            shown = [int(pk) for pk in re.findall(r'data-message-id="(\d+)"', older.content.decode())] + shown
+            cursor = older['X-Older-Cursor']
+        self.assertEqual(shown, [m.pk for m in self.sent])
+
+        newer = self.client.get(reverse('message_newer', args=[self.plan.pk]), {'after': self.sent[-3].pk})
+        self.assertEqual(re.findall(r'data-message-id="(\d+)"', newer.content.decode()),
+                         [str(m.pk) for m in self.sent[-2:]])
+
+    def test_newer_fragment_and_ajax_send(self):
+        newer = self.client.get(reverse('message_newer', args=[self.plan.pk]), {'after': self.sent[-2].pk})
+        self.assertContains(newer, 'note 34')
+        self.assertNotContains(newer, 'note 33')
+
+        response = self.client.post(reverse('send_message', args=[self.plan.pk]), {'message': 'Quick reply'},
+                                    HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 201)
+        self.assertContains(response, 'Quick reply', status_code=201)
+        self.assertNotContains(response, 'note 34', status_code=201)
+
+    def test_outsiders_get_no_fragments(self):
+        self.client.force_login(User.objects.create_user('outsider'))
+        self.assertEqual(self.client.get(reverse('message_newer', args=[self.plan.pk]), {'after': 0}).status_code, 403)
+
+
+@skipUnless(settings.MINDWELL_SQLITE_HARDENED, 'hardened SQLite mode is off')
+class SqliteModeTests(TestCase):
+    '''Pragmas on connect, and retry of transactions that lost the write lock'''
+
+    def test_pragmas_are_applied(self):
+        with connection.cursor() as cursor:
+            self.assertEqual(cursor.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            self.assertEqual(cursor.execute('PRAGMA synchronous').fetchone()[0], 1)  # NORMAL
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+
+    def test_retry_on_locked(self):
+        calls = []
+
+        @retry_on_locked(base_delay=0)
+        def write():
+            calls.append(1)
+            if len(calls) < 3:
+                raise OperationalError('database is locked')
+            return 'done'
+
+        # TestCase wraps each test in a transaction, which a retry cannot rerun
+        with self.assertRaises(OperationalError):
+            write()
+        self.assertEqual(len(calls), 1)
+        with mock.patch.object(connection, 'in_atomic_block', False):
+            self.assertEqual(write(), 'done')
+        self.assertEqual(len(calls), 3)
@@ -0,0 +1,73 @@
+# mindwell/thumbnails.py
+# Gracious Ogyiri Asare - gpoa@bu.edu
+# Fixed-size WebP thumbnails of provider profile images
+
+import logging
+import posixpath
+from io import BytesIO
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# square edge lengths in pixels; 96 covers the directory card, 256 the detail page and 2x screens
+THUMBNAIL_SIZES = (96, 256)
+THUMBNAIL_DIR = 'thumbs'
+WEBP_QUALITY = 80
+
+
+def thumbnail_name(name, size):
+    '''Storage name of one thumbnail, e.g. 12.jpeg -> thumbs/12.jpeg-96.webp
+
+    The source extension is kept so 12.jpeg and 12.png get thumbnails of their own.
+    '''
+    return posixpath.join(THUMBNAIL_DIR, f'{name}-{size}.webp')
+
+
+def thumbnail_urls(field_file):
+    '''{size: url} of the thumbnails of an image field file'''
+    storage = field_file.storage
+    return {size: storage.url(thumbnail_name(field_file.name, size)) for size in THUMBNAIL_SIZES}
+
+
+def has_thumbnails(name, storage=default_storage):
+    '''True if every thumbnail of name is already stored'''
+    return all(storage.exists(thumbnail_name(name, size)) for size in THUMBNAIL_SIZES)
+
+
+def generate_thumbnails(name, storage=default_storage, force=False):
+    '''Write the WebP thumbnails of one stored image, return how many were written
+
+    Each variant is center-cropped to a square and only downscaled, so small
+    uploads are not blown up.
+    '''
+    if not force and has_thumbnails(name, storage):
+        return 0
+    with storage.open(name, 'rb') as source:
+        image = ImageOps.exif_transpose(Image.open(source))
+        image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+
+    written = 0
+    for size in THUMBNAIL_SIZES:
+        edge = min(size, image.width, image.height)
+        thumb = ImageOps.fit(image, (edge, edge), Image.Resampling.LANCZOS)
+        buffer = BytesIO()
+        thumb.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=6)
+        target = thumbnail_name(name, size)
+        if storage.exists(target):
+            storage.delete(target)
+        storage.save(target, ContentFile(buffer.getvalue()))
+        written += 1
+    return written
+
+
+def generate_provider_thumbnails(provider):
+    '''Thumbnail the profile image of a saved provider, logging unreadable uploads'''
+    if not provider.profile_img:
+        return 0
+    try:
+        return generate_thumbnails(provider.profile_img.name, provider.profile_img.storage)
+    except (OSError, UnidentifiedImageError):
+        logger.warning('Could not thumbnail %s of provider %s', provider.profile_img.name, provider.pk)
+        return 0
@@ -0,0 +1,144 @@
+# mindwell/unread.py
+# Gracious Ogyiri Asare - gpoa@bu.edu
+# Per-thread read cursors and the unread message counters derived from them, kept up to date on write
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+from .locking import retry_on_locked
+from .models import Message, ThreadReadState, UnreadCount
+
+
+def _add(model, delta, **lookup):
+    '''Add delta to the counter row matching lookup, creating it on first use'''
+    if model.objects.filter(**lookup).update(count=Greatest(F('count') + delta, Value(0))):
+        return
+    if delta <= 0:
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(count=delta, **lookup)
+    except IntegrityError:
+        # another request created the row first
+        model.objects.filter(**lookup).update(count=F('count') + delta)
+
+
+def record_message(message):
+    '''Count a new message as unread for its recipient'''
+    with transaction.atomic():
+        _add(ThreadReadState, 1, user_id=message.recipient_id, therapy_plan_id=message.therapy_plan_id)
+        _add(UnreadCount, 1, user_id=message.recipient_id)
+
+
+def forget_message(message):
+    '''Uncount a deleted message if its recipient had not read it yet'''
+    with transaction.atomic():
+        if ThreadReadState.objects.filter(
+            user_id=message.recipient_id, therapy_plan_id=message.therapy_plan_id,
+            last_read_id__lt=message.pk, count__gt=0,
+        ).update(count=F('count') - 1):
+            _add(UnreadCount, -1, user_id=message.recipient_id)
+
+
+def forget_messages(rows):
+    '''Uncount the unread ones of many deleted messages at once
+
+    rows are dicts with id, recipient_id and therapy_plan_id, for batch
+    deletes that bypass post_delete; the counters of a whole batch take
+    four queries instead of two per message.
+    '''
+    by_thread = {}
+    for row in rows:
+        by_thread.setdefault((row['recipient_id'], row['therapy_plan_id']), []).append(row['id'])
+    if not by_thread:
+        return
+    with transaction.atomic():
+        states = ThreadReadState.objects.select_for_update().filter(
+            therapy_plan_id__in={plan_id for _, plan_id in by_thread}, count__gt=0,
+        )
+        changed = []
+        removed = {}
+        for state in states:
+            ids = by_thread.get((state.user_id, state.therapy_plan_id), ())
+            unread = min(state.count, sum(1 for pk in ids if pk > state.last_read_id))
+            if unread:
+                state.count -= unread
+                changed.append(state)
+                removed[state.user_id] = removed.get(state.user_id, 0) + unread
+        if not changed:
+            return
+        ThreadReadState.objects.bulk_update(changed, ['count'])
+        totals = list(UnreadCount.objects.select_for_update().filter(user_id__in=removed))
+        for total in totals:
+            total.count = max(0, total.count - removed[total.user_id])
+        UnreadCount.objects.bulk_update(totals, ['count'])
+
+
+def unread_total(user):
+    '''Return the number of unread messages of a user with a primary key lookup'''
+    return UnreadCount.objects.filter(user=user).values_list('count', flat=True).first() or 0
+
+
+def latest_message_id(therapy_plan):
+    '''Id of the newest message of a thread, or None'''
+    return Message.objects.filter(therapy_plan=therapy_plan).order_by('-created_at', '-id').values_list('id', flat=True).first()
+
+
+@retry_on_locked
+def mark_read(user, therapy_plan, up_to=None):
+    '''Move the user's read cursor of a thread to message id up_to (default the newest)
+
+    Only the thread's own state row is written, and nothing at all when the
+    thread was already read that far, so viewing a read thread stays a read.
+    '''
+    if up_to is None:
+        up_to = latest_message_id(therapy_plan)
+        if up_to is None:
+            return
+    states = ThreadReadState.objects.filter(user=user, therapy_plan=therapy_plan)
+    # no state row means nothing was ever received in this thread
+    if not states.filter(last_read_id__lt=up_to).exists():
+        return
+    with transaction.atomic():
+        state = states.select_for_update().first()
+        if state.last_read_id >= up_to:
+            return
+        # messages that arrived after the page was rendered stay unread
+        remaining = Message.objects.filter(recipient=user, therapy_plan=therapy_plan, id__gt=up_to).count()
+        ThreadReadState.objects.filter(pk=state.pk).update(last_read_id=up_to, count=remaining)
+        if remaining != state.count:
+            _add(UnreadCount, remaining - state.count, user_id=state.user_id)
+
+
+def rebuild(user_ids=None, batch_size=1000):
+    '''Recompute counters from the read cursors and the Message table, for some users or for everyone'''
+    messages = Message.objects.all()
+    states = ThreadReadState.objects.all()
+    totals = UnreadCount.objects.all()
+    if user_ids is not None:
+        messages = messages.filter(recipient_id__in=user_ids)
+        states = states.filter(user_id__in=user_ids)
+        totals = totals.filter(user_id__in=user_ids)
+
+    with transaction.atomic():
+        # every thread a user received messages in gets a cursor, unread from the start
+        existing = set(states.values_list('user_id', 'therapy_plan_id'))
+        missing = [
+            ThreadReadState(user_id=user_id, therapy_plan_id=plan_id)
+            for user_id, plan_id in messages.order_by().values_list('recipient_id', 'therapy_plan_id').distinct()
+            if (user_id, plan_id) not in existing
+        ]
+        ThreadReadState.objects.bulk_create(missing, batch_size=batch_size)
+
+        received_after = Message.objects.filter(
+            recipient=OuterRef('user'), therapy_plan=OuterRef('therapy_plan'), id__gt=OuterRef('last_read_id'),
+        ).order_by().values('recipient').annotate(total=Count('id')).values('total')
+        threads = states.update(count=Coalesce(Subquery(received_after), 0))
+
+        totals.delete()
+        user_totals = states.filter(count__gt=0).order_by().values('user_id').annotate(total=Sum('count'))
+        UnreadCount.objects.bulk_create(
+            [UnreadCount(user_id=row['user_id'], count=row['total']) for row in user_totals],
+            batch_size=batch_size,
+        )
+    return threads, len(user_totals)
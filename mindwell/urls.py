@@ -4,6 +4,7 @@
 from django.urls import path
 from django.contrib.auth import views as auth_views
 from .views import *
+from . import api
 
 urlpatterns = [
     path('', HomePageView.as_view(), name='home'),    
@@ -11,6 +12,7 @@ urlpatterns = [
     path('logout/', auth_views.LogoutView.as_view(next_page='home'), name='logout'),
     path('providers/', ProviderListView.as_view(), name='provider_list'),
     path('providers/<int:pk>/', ProviderDetailView.as_view(), name='provider_detail'),
+    path('providers/<int:pk>/slots/', ProviderSlotsView.as_view(), name='provider_slots'),
     path('provider/register/', CreateProviderView.as_view(), name='provider_register'),
     path('provider/<int:pk>/dashboard/', ProviderDashboardView.as_view(), name='provider_dashboard'),
     path('provider/update/', UpdateProviderView.as_view(), name='provider_update'),
@@ -21,9 +23,18 @@ urlpatterns = [
     path('patient/register/', CreatePatientView.as_view(), name='patient_register'),
     path('therapyplan/create/<int:provider_pk>/', CreateTherapyPlanView.as_view(), name='therapyplan_create'),
     path('session/create/<int:plan_pk>/', CreateSessionView.as_view(), name='session_create'),
+    path('session/series/<int:plan_pk>/', CreateSessionSeriesView.as_view(), name='session_series_create'),
     path('session/<int:pk>/update/', UpdateSessionView.as_view(), name='session_update'),
     # path('therapyplan/<int:plan_pk>/add-note/', AddPatientNoteView.as_view(), name='add_patient_note'), -stretch
     path('therapyplan/<int:plan_pk>/send-message/', SendMessageView.as_view(), name='send_message'),
+    path('therapyplan/<int:plan_pk>/messages/older/', OlderMessagesView.as_view(), name='message_older'),
+    path('therapyplan/<int:plan_pk>/messages/newer/', NewerMessagesView.as_view(), name='message_newer'),
+    path('therapyplan/<int:plan_pk>/messages/stream/', MessageStreamView.as_view(), name='message_stream'),
     path('messages/', ViewMessagesView.as_view(), name='view_messages'),
+    path('api/v1/providers/', api.ProviderListApiView.as_view(), name='api_provider_list'),
+    path('api/v1/providers/<int:pk>/', api.ProviderDetailApiView.as_view(), name='api_provider_detail'),
+    path('api/v1/providers/<int:pk>/slots/', api.ProviderSlotsApiView.as_view(), name='api_provider_slots'),
+    path('api/v1/plans/', api.PlanListApiView.as_view(), name='api_plan_list'),
+    path('api/v1/sessions/', api.SessionListApiView.as_view(), name='api_session_list'),
 
 ]
\ No newline at end of file
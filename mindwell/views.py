@@ -3,16 +3,35 @@
 # Views for MindWell app
 
 from django.shortcuts import render, redirect, get_object_or_404
-from django.views.generic import CreateView, ListView, DetailView, UpdateView, DeleteView, TemplateView
+from django.views.generic import CreateView, ListView, DetailView, UpdateView, DeleteView, TemplateView, FormView
 from django.urls import reverse
-from django.db.models import Q
+from django.db import transaction
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import login
-from django.http import HttpResponseForbidden, HttpResponseRedirect
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseRedirect, JsonResponse, QueryDict, StreamingHttpResponse
+from django.utils.functional import cached_property
+from django.views import View
+import json
 from django.contrib import messages
 from .models import *
 from .forms import *
+from .middleware import get_role
+from . import search as provider_search
+from . import tags
+from .pagination import InvalidCursor, KeysetPaginator, paginate_request, cursor_query
+from .inbox import inbox_threads, user_plans
+from . import unread
+from . import slots
+from .booking import BookingConflict, reserve_series, reserve_session
+from .locking import retry_on_locked
+from .dashboards import load_patient_dashboard, load_provider_dashboard
+from . import caching
+from . import realtime
+from . import schedule
+from . import archive
 
 # Create your views here.
 
@@ -23,20 +42,30 @@ class MethodLoginRequiredMixin(LoginRequiredMixin):
         '''Return login URL'''
         return reverse('login')
     
+    @property
+    def role(self):
+        '''Request-scoped provider/patient lookup'''
+        return get_role(self.request)
+    
     def get_provider(self):
         '''Get provider profile '''
-        return HealthProvider.objects.get(user=self.request.user)
+        if self.role.provider is None:
+            raise HealthProvider.DoesNotExist('User has no provider profile.')
+        return self.role.provider
     
     def is_provider(self):
         '''Check if provider'''
-        return HealthProvider.objects.filter(user=self.request.user).exists()
+        return self.role.is_provider
+    
     def get_patient(self):
         '''Get patient profile '''
-        return Patient.objects.get(user=self.request.user)
+        if self.role.patient is None:
+            raise Patient.DoesNotExist('User has no patient profile.')
+        return self.role.patient
     
     def is_patient(self):
         '''Check if is a patient'''
-        return Patient.objects.filter(user=self.request.user).exists()
+        return self.role.is_patient
 
 class HomePageView(TemplateView):
     '''Display home page'''
@@ -45,85 +74,141 @@ class HomePageView(TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         if self.request.user.is_authenticated:
-            context['is_provider'] = HealthProvider.objects.filter(user=self.request.user).exists()
-            context['is_patient'] = Patient.objects.filter(user=self.request.user).exists()
+            role = get_role(self.request)
+            context['is_provider'] = role.is_provider
+            context['is_patient'] = role.is_patient
             
             if context['is_patient']:
-                context['patient'] = Patient.objects.get(user=self.request.user)
+                context['patient'] = role.patient
             if context['is_provider']:
-                context['provider'] = HealthProvider.objects.get(user=self.request.user)
+                context['provider'] = role.provider
         return context
 
-class ProviderListView(ListView):
+class ProviderListView(caching.AnonymousPageCacheMixin, ListView):
     '''Display all providers'''
     model = HealthProvider
     template_name = 'mindwell/provider_list.html'
     context_object_name = 'providers'
+    facet_limit = 15
+    page_size = 20
+    ordering = ('last_name', 'first_name', 'id')
+    
+    @cached_property
+    def filters(self):
+        '''The normalized search and facet parameters, which links changing the result set start from'''
+        filters = QueryDict(mutable=True)
+        search = ' '.join(self.request.GET.get('search', '').split())
+        if search:
+            filters['search'] = search
+        for facet in ('specialization', 'language'):
+            slugs = tags.parse_filter(self.request.GET.get(facet, ''))
+            if slugs:
+                filters[facet] = ','.join(slugs)
+        return filters
+    
+    @cached_property
+    def params(self):
+        '''The query parameters the page depends on, normalized so equivalent URLs share a cache entry'''
+        params = self.filters.copy()
+        for cursor in ('after', 'before'):
+            if self.request.GET.get(cursor):
+                params[cursor] = self.request.GET[cursor]
+        return params
+    
+    def get_page_cache_key(self):
+        return f'provider_list:{caching.directory_version()}:{self.params.urlencode()}'
     
     def get_queryset(self):
         '''Return only verified providers, with optional filtering'''
         queryset = HealthProvider.objects.filter()
         
         # search parameters
-        specialization = self.request.GET.get('specialization', '')
-        language = self.request.GET.get('language', '')
-        search = self.request.GET.get('search', '')
+        specialization = self.params.get('specialization', '')
+        language = self.params.get('language', '')
+        search = self.params.get('search', '')
         
-        if specialization:
-            queryset = queryset.filter(specialization__icontains=specialization)
-        
-        if language:
-            queryset = queryset.filter(languages__icontains=language)
+        # exact tag filters, intersected in memory by the inverted index
+        self.tag_matches = tags.get_index().lookup(
+            specialization=tags.parse_filter(specialization),
+            language=tags.parse_filter(language),
+        )
+        if self.tag_matches is not None:
+            queryset = tags.filter_by_ids(queryset, self.tag_matches)
             
         if search:
-            queryset = queryset.filter(
-                Q(first_name__icontains=search) |
-                Q(last_name__icontains=search) |
-                Q(specialization__icontains=search) |
-                Q(bio__icontains=search)
-            )
+            queryset = provider_search.search_providers(queryset, search)
+            if 'search_rank' in queryset.query.annotations:
+                self.ordering = ('search_rank', 'id')
         
-        return queryset.order_by('last_name', 'first_name')
+        return queryset.order_by(*self.ordering)
     
     def get_context_data(self, **kwargs):
         '''add search parameters to context'''
-        context = super().get_context_data(**kwargs)
-        context['specialization'] = self.request.GET.get('specialization', '')
-        context['language'] = self.request.GET.get('language', '')
-        context['search'] = self.request.GET.get('search', '')
+        page = paginate_request(self.request, self.object_list, self.ordering, self.page_size)
+        context = super().get_context_data(object_list=page.object_list, **kwargs)
+        context['page'] = page
+        context['prev_query'], context['next_query'] = cursor_query(self.params, page)
+        context['provider_cards'] = caching.provider_cards(page.object_list)
+        context['specialization'] = self.params.get('specialization', '')
+        context['language'] = self.params.get('language', '')
+        context['search'] = self.params.get('search', '')
+        context['facets'] = self.get_facets(context['search'])
         
         if self.request.user.is_authenticated:
-            context['is_patient'] = Patient.objects.filter(user=self.request.user).exists()
-            context['is_provider'] = HealthProvider.objects.filter(user=self.request.user).exists()
+            role = get_role(self.request)
+            context['is_patient'] = role.is_patient
+            context['is_provider'] = role.is_provider
             if context['is_patient']:
-                context['patient'] = Patient.objects.get(user=self.request.user)
+                context['patient'] = role.patient
             if context['is_provider']:
-                context['provider'] = HealthProvider.objects.get(user=self.request.user)
+                context['provider'] = role.provider
         
         return context
-
-class ProviderDetailView(DetailView):
+    
+    def get_facets(self, search):
+        '''Language and specialization counts over the current results, without a query per facet'''
+        index = tags.get_index()
+        result_ids = self.tag_matches
+        if search:
+            result_ids = set(self.object_list.values_list('pk', flat=True))
+        
+        facets = []
+        for facet, label in (('specialization', 'Specializations'), ('language', 'Languages')):
+            selected = set(tags.parse_filter(self.params.get(facet, '')))
+            options = []
+            for slug, name, count in index.facet_counts(facet, result_ids)[:self.facet_limit]:
+                # a new filter starts from the first page of its results
+                params = self.filters.copy()
+                params[facet] = ','.join(sorted(selected ^ {slug}))
+                options.append({'name': name, 'count': count, 'selected': slug in selected, 'query': params.urlencode()})
+            facets.append({'label': label, 'options': options})
+        return facets
+
+class ProviderDetailView(caching.AnonymousPageCacheMixin, DetailView):
     '''Display one provider profile'''
     model = HealthProvider
     template_name = 'mindwell/provider_detail.html'
     context_object_name = 'provider'
     
+    def get_page_cache_key(self):
+        pk = self.kwargs['pk']
+        return f'provider_detail:{pk}:{caching.provider_versions([pk])[pk]}'
+    
     def get_context_data(self, **kwargs):
         '''add availability and plan types to context'''
         context = super().get_context_data(**kwargs)
-        provider = self.object
-        
-        context['availability_by_day'] = provider.get_availability_by_day()
-        context['plan_types'] = provider.get_supported_plan_types()
+        # availability and plan types are only queried when the fragment is not cached
+        context['provider_profile'] = caching.provider_profile(self.object)
         
         if self.request.user.is_authenticated:
-            context['is_patient'] = Patient.objects.filter(user=self.request.user).exists()
-            context['is_provider'] = HealthProvider.objects.filter(user=self.request.user).exists()
+            role = get_role(self.request)
+            context['is_patient'] = role.is_patient
+            context['is_provider'] = role.is_provider
             
             if context['is_patient']:
-                context['patient'] = Patient.objects.get(user=self.request.user)
+                context['patient'] = role.patient
             if context['is_provider']:
-                context['provider_user'] = HealthProvider.objects.get(user=self.request.user)
+                context['provider_user'] = role.provider
         
         return context
 
@@ -181,37 +266,29 @@ class PatientDashboardView(MethodLoginRequiredMixin, DetailView):
     context_object_name = 'patient'
     
     def dispatch(self, request, *args, **kwargs):
-        logged_in_patient = Patient.objects.filter(user=request.user).first()
+        logged_in_patient = get_role(request).patient
         if not logged_in_patient:
             return redirect("home")
 
-        requested_patient = self.get_object()
-        if logged_in_patient.pk != requested_patient.pk:
+        if logged_in_patient.pk != self.kwargs.get('pk'):
             return redirect("patient_dashboard", pk=logged_in_patient.pk)
 
         return super().dispatch(request, *args, **kwargs)
     
+    def get_object(self, queryset=None):
+        '''The dashboard always belongs to the logged in patient'''
+        return self.get_patient()
+    
     def get_context_data(self, **kwargs):
         '''Add therapy plans and sessions to context'''
         context = super().get_context_data(**kwargs)
         patient = self.object
         
-        context['active_plans'] = patient.get_active_plans()
-        context['all_plans'] = TherapyPlan.objects.filter(patient=patient).order_by('-created_at')
-        context['upcoming_sessions'] = patient.get_upcoming_sessions()
+        context.update(load_patient_dashboard(patient))
         context['is_patient'] = True
         
-        from datetime import date
-        context['past_sessions'] = Session.objects.filter(
-            therapy_plan__patient=patient,
-            status__in=['completed', 'cancelled', 'no-show']
-        ).order_by('-session_date', '-session_time')[:10]
-        
         # Get unread messages
-        context['unread_messages'] = Message.objects.filter(
-            recipient=self.request.user,
-            is_read=False
-        ).count()
+        context['unread_messages'] = unread.unread_total(self.request.user)
         
         return context
 
@@ -222,37 +299,29 @@ class ProviderDashboardView(MethodLoginRequiredMixin, DetailView):
     context_object_name = 'provider'
     
     def dispatch(self, request, *args, **kwargs):
-        logged_in_provider = HealthProvider.objects.filter(user=request.user).first()
+        logged_in_provider = get_role(request).provider
         if not logged_in_provider:
             return redirect("home")
 
-        requested_provider = self.get_object()
-        if logged_in_provider.pk != requested_provider.pk:
+        if logged_in_provider.pk != self.kwargs.get('pk'):
             return redirect("provider_dashboard", pk=logged_in_provider.pk)
 
         return super().dispatch(request, *args, **kwargs)
     
+    def get_object(self, queryset=None):
+        '''The dashboard always belongs to the logged in provider'''
+        return self.get_provider()
+    
     def get_context_data(self, **kwargs):
         '''Add therapy plans and sessions to context'''
         context = super().get_context_data(**kwargs)
         provider = self.object
         
-        context['active_plans'] = provider.get_active_plans()
-        context['upcoming_sessions'] = provider.get_upcoming_sessions()
+        context.update(load_provider_dashboard(provider))
         context['is_provider'] = True
         
-        from datetime import date
-        context['today_sessions'] = Session.objects.filter(
-            therapy_plan__health_provider=provider,
-            session_date=date.today(),
-            status='scheduled'
-        ).order_by('session_time')
-        
         # Get unread messages
-        context['unread_messages'] = Message.objects.filter(
-            recipient=self.request.user,
-            is_read=False
-        ).count()
+        context['unread_messages'] = unread.unread_total(self.request.user)
         
         return context
 
@@ -261,20 +330,22 @@ class CreateTherapyPlanView(MethodLoginRequiredMixin, CreateView):
     form_class = CreateTherapyPlanForm
     template_name = 'mindwell/create_therapyplan_form.html'
     
+    def get_plan_provider(self):
+        '''Get the provider this plan is being created with (loaded once)'''
+        if not hasattr(self, '_plan_provider'):
+            self._plan_provider = get_object_or_404(HealthProvider, pk=self.kwargs.get('provider_pk'))
+        return self._plan_provider
+    
     def get_form_kwargs(self):
         '''Pass provider to form'''
         kwargs = super().get_form_kwargs()
-        provider_pk = self.kwargs.get('provider_pk')
-        if provider_pk:
-            kwargs['provider'] = HealthProvider.objects.get(pk=provider_pk)
+        kwargs['provider'] = self.get_plan_provider()
         return kwargs
     
     def get_context_data(self, **kwargs):
         '''override context'''
         context = super().get_context_data(**kwargs)
-        provider_pk = self.kwargs.get('provider_pk')
-        if provider_pk:
-            context['provider'] = HealthProvider.objects.get(pk=provider_pk)
+        context['provider'] = self.get_plan_provider()
         context['is_patient'] = True
         context['patient'] = self.get_patient()
         return context
@@ -282,8 +353,7 @@ class CreateTherapyPlanView(MethodLoginRequiredMixin, CreateView):
     def form_valid(self, form):
         '''Set values'''
         patient = self.get_patient()
-        provider_pk = self.kwargs.get('provider_pk')
-        provider = HealthProvider.objects.get(pk=provider_pk)
+        provider = self.get_plan_provider()
         
         form.instance.patient = patient
         form.instance.health_provider = provider
@@ -303,43 +373,119 @@ class CreateSessionView(MethodLoginRequiredMixin, CreateView):
     form_class = CreateSessionForm
     template_name = 'mindwell/create_session_form.html'
     
+    def get_therapy_plan(self):
+        '''Get the therapy plan being booked (loaded once)'''
+        if not hasattr(self, '_therapy_plan'):
+            self._therapy_plan = get_object_or_404(
+                TherapyPlan.objects.select_related('patient', 'health_provider', 'plan_type'),
+                pk=self.kwargs.get('plan_pk'),
+                patient__user=self.request.user,
+            )
+        return self._therapy_plan
+    
+    def get_slot_duration(self):
+        '''Duration the open slots are computed for: the posted one, else the default'''
+        try:
+            duration = int(self.request.POST.get('duration') or Session._meta.get_field('duration').default)
+        except ValueError:
+            duration = Session._meta.get_field('duration').default
+        return max(duration, slots.SLOT_STEP_MINUTES)
+    
     def get_form_kwargs(self):
-        '''Pass therapy plan to form'''
+        '''Pass therapy plan and its open slots to form'''
         kwargs = super().get_form_kwargs()
-        plan_pk = self.kwargs.get('plan_pk')
-        if plan_pk:
-            kwargs['therapy_plan'] = TherapyPlan.objects.get(pk=plan_pk)
+        therapy_plan = self.get_therapy_plan()
+        kwargs['therapy_plan'] = therapy_plan
+        kwargs['slots'] = slots.upcoming_slots(therapy_plan.health_provider, self.get_slot_duration())
         return kwargs
     
     def get_context_data(self, **kwargs):
         '''Add therapy plan and availability to context'''
         context = super().get_context_data(**kwargs)
-        plan_pk = self.kwargs.get('plan_pk')
-        if plan_pk:
-            therapy_plan = TherapyPlan.objects.get(pk=plan_pk)
-            context['therapy_plan'] = therapy_plan
-            context['availability_by_day'] = therapy_plan.health_provider.get_availability_by_day()
+        therapy_plan = self.get_therapy_plan()
+        context['therapy_plan'] = therapy_plan
+        context['availability_by_day'] = therapy_plan.health_provider.get_availability_by_day()
         context['is_patient'] = True
         context['patient'] = self.get_patient()
         return context
     
     def form_valid(self, form):
-        '''Set therapy plans'''
-        plan_pk = self.kwargs.get('plan_pk')
-        therapy_plan = TherapyPlan.objects.get(pk=plan_pk)
-        
-        form.instance.therapy_plan = therapy_plan
-        form.instance.status = 'scheduled'
-        form.instance.payment_status = 'unpaid'
+        '''Reserve the session, checking availability and overlaps atomically'''
+        try:
+            self.object = reserve_session(
+                self.get_therapy_plan(),
+                form.cleaned_data['session_date'],
+                form.cleaned_data['session_time'],
+                form.cleaned_data['duration'],
+                session_type=form.cleaned_data['session_type'],
+            )
+        except BookingConflict as error:
+            form.add_error(None, error)
+            return self.form_invalid(form)
         
         messages.success(self.request, 'Session booked successfully!')
-        return super().form_valid(form)
+        return HttpResponseRedirect(self.get_success_url())
     
     def get_success_url(self):
         '''Redirect to dashboard'''
         patient = self.get_patient()
         return reverse('patient_dashboard', kwargs={'pk': patient.pk})
 
+class ProviderSlotsView(View):
+    '''JSON list of a provider's open session slots for a date range'''
+    
+    def get(self, request, *args, **kwargs):
+        provider = get_object_or_404(HealthProvider, pk=self.kwargs.get('pk'))
+        try:
+            return JsonResponse(slots.slots_for_query(provider, request.GET))
+        except slots.SlotQueryError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+
+class CreateSessionSeriesView(MethodLoginRequiredMixin, FormView):
+    '''Book a recurring series of sessions in one submission'''
+    form_class = SessionSeriesForm
+    template_name = 'mindwell/create_session_series_form.html'
+    
+    def get_therapy_plan(self):
+        '''Get the therapy plan being booked (loaded once)'''
+        if not hasattr(self, '_therapy_plan'):
+            self._therapy_plan = get_object_or_404(
+                TherapyPlan.objects.select_related('patient', 'health_provider', 'plan_type'),
+                pk=self.kwargs.get('plan_pk'),
+                patient__user=self.request.user,
+            )
+        return self._therapy_plan
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        therapy_plan = self.get_therapy_plan()
+        context['therapy_plan'] = therapy_plan
+        context['availability_by_day'] = therapy_plan.health_provider.get_availability_by_day()
+        context['is_patient'] = True
+        context['patient'] = self.get_patient()
+        return context
+    
+    def form_valid(self, form):
+        '''Check every occurrence at once, then book the series with one insert'''
+        try:
+            sessions, conflicts = reserve_series(
+                self.get_therapy_plan(),
+                form.dates(),
+                form.cleaned_data['session_time'],
+                form.cleaned_data['duration'],
+                skip_conflicts=form.cleaned_data['skip_conflicts'],
+                session_type=form.cleaned_data['session_type'],
+            )
+        except BookingConflict as error:
+            form.add_error(None, error)
+            return self.form_invalid(form)
+        
+        message = f'{len(sessions)} sessions booked.'
+        if conflicts:
+            message += f' Skipped {len(conflicts)} taken dates.'
+        messages.success(self.request, message)
+        return HttpResponseRedirect(reverse('patient_dashboard', args=[self.get_patient().pk]))
+
 class UpdateSessionView(MethodLoginRequiredMixin, UpdateView):
     '''Update session details'''
     model = Session
@@ -347,7 +493,7 @@ class UpdateSessionView(MethodLoginRequiredMixin, UpdateView):
     template_name = 'mindwell/update_session_form.html'
     
     def dispatch(self, request, *args, **kwargs):
-        provider = HealthProvider.objects.filter(user=request.user).first()
+        provider = get_role(request).provider
         if not provider:
             return redirect("home")
 
@@ -389,6 +535,7 @@ class UpdateProviderView(MethodLoginRequiredMixin, UpdateView):
         context = super().get_context_data(**kwargs)
         context['is_provider'] = True
         context['provider'] = self.get_provider()
+        context['availability_by_day'] = self.object.get_availability_by_day()
         return context
     
     def form_valid(self, form):
@@ -426,24 +573,38 @@ class UpdatePatientView(MethodLoginRequiredMixin, UpdateView):
         return reverse('patient_dashboard', kwargs={'pk': patient.pk})
 
 class ManageAvailabilityView(MethodLoginRequiredMixin, TemplateView):
-    '''Manage provider availability'''
+    '''Edit the whole weekly availability of a provider in one submission'''
     template_name = 'mindwell/manage_availability.html'
     
     def dispatch(self, request, *args, **kwargs):
-        self.provider = HealthProvider.objects.filter(user=request.user).first()
+        self.provider = get_role(request).provider
         if not self.provider:
             return redirect("home")
         return super().dispatch(request, *args, **kwargs)
     
+    def get_formset(self, data=None):
+        return WeeklyScheduleFormSet(data, queryset=Availability.objects.filter(health_provider=self.provider))
+    
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['provider'] = self.provider
-        context['availability_by_day'] = self.provider.get_availability_by_day()
-        context['form'] = AvailabilityForm()
+        context.setdefault('formset', self.get_formset())
         context['is_provider'] = True
         return context
     
     def post(self, request, *args, **kwargs):
+        if 'form-TOTAL_FORMS' not in request.POST:
+            return self.add_one(request)
+        formset = self.get_formset(request.POST)
+        if not formset.is_valid():
+            messages.error(request, "Please correct the schedule errors.")
+            return self.render_to_response(self.get_context_data(formset=formset))
+        created, updated, deleted = schedule.save_weekly_schedule(self.provider, formset.windows())
+        messages.success(request, f"Schedule saved: {created} added, {updated} changed, {deleted} removed.")
+        return redirect("provider_dashboard", pk=self.provider.pk)
+    
+    def add_one(self, request):
+        '''Single-window form on the profile page'''
         form = AvailabilityForm(request.POST)
         if form.is_valid():
             availability = form.save(commit=False)
@@ -460,7 +621,7 @@ class DeleteAvailabilityView(MethodLoginRequiredMixin, DeleteView):
     model = Availability
 
     def dispatch(self, request, *args, **kwargs):
-        provider = HealthProvider.objects.filter(user=request.user).first()
+        provider = get_role(request).provider
         if not provider:
             return redirect("home")
 
@@ -477,7 +638,7 @@ class DeleteAvailabilityView(MethodLoginRequiredMixin, DeleteView):
         return HttpResponseRedirect(success_url)
 
     def get_success_url(self):
-        provider = HealthProvider.objects.get(user=self.request.user)
+        provider = self.get_provider()
         return reverse("provider_dashboard", args=[provider.pk])
 
 # class AddPatientNoteView(MethodLoginRequiredMixin, CreateView):
@@ -515,44 +676,75 @@ class DeleteAvailabilityView(MethodLoginRequiredMixin, DeleteView):
 #         provider = self.get_provider()
 #         return reverse('provider_dashboard', kwargs={'pk': provider.pk})
 
-class SendMessageView(MethodLoginRequiredMixin, CreateView):
-    '''Send a message to a patient or provider'''
-    model = Message
-    form_class = MessageForm
-    template_name = 'mindwell/send_message.html'
+class ThreadParticipantMixin(MethodLoginRequiredMixin):
+    '''Load the therapy plan of the URL and only let its provider and patient in'''
+    page_size = 30
+    newer_limit = 100
+    ordering = ('-created_at', '-id')
     
     def dispatch(self, request, *args, **kwargs):
         '''Check if user has permission to send message'''
         plan_pk = self.kwargs.get('plan_pk')
-        self.therapy_plan = get_object_or_404(TherapyPlan, pk=plan_pk)
+        self.therapy_plan = get_object_or_404(
+            TherapyPlan.objects.select_related('patient', 'health_provider', 'plan_type'),
+            pk=plan_pk,
+        )
         
         # Check if user is either the provider or patient in this therapy plan
-        is_provider = HealthProvider.objects.filter(
-            user=request.user, 
-            id=self.therapy_plan.health_provider.id
-        ).exists()
-        is_patient = Patient.objects.filter(
-            user=request.user,
-            id=self.therapy_plan.patient.id
-        ).exists()
+        role = get_role(request)
+        is_provider = role.is_provider and role.provider.id == self.therapy_plan.health_provider_id
+        is_patient = role.is_patient and role.patient.id == self.therapy_plan.patient_id
         
         if not (is_provider or is_patient):
             return HttpResponseForbidden("You can only message within your therapy plans.")
         
         return super().dispatch(request, *args, **kwargs)
     
+    def thread_messages(self):
+        return self.therapy_plan.messages.select_related('sender')
+    
+    def older_page(self, cursor=None):
+        '''The page_size messages before cursor (the latest ones without), newest first'''
+        return KeysetPaginator(self.thread_messages(), self.ordering, self.page_size).page(after=cursor)
+    
+    def render_messages(self, thread_messages, status=200):
+        '''HTML fragment of some messages, oldest first'''
+        return render(self.request, 'mindwell/message_items.html', {'thread_messages': thread_messages}, status=status)
+
+class SendMessageView(ThreadParticipantMixin, CreateView):
+    '''Send a message to a patient or provider'''
+    model = Message
+    form_class = MessageForm
+    template_name = 'mindwell/send_message.html'
+    
+    def is_ajax(self):
+        return self.request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+    
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['therapy_plan'] = self.therapy_plan
         
-        if self.request.user == self.therapy_plan.patient.user:
+        if self.request.user.pk == self.therapy_plan.patient.user_id:
             context['is_patient'] = True
             context['patient'] = self.therapy_plan.patient
         else:
             context['is_provider'] = True
             context['provider'] = self.therapy_plan.health_provider
         
-        context['message_list'] = self.therapy_plan.messages.all().order_by('created_at')
+        # archived history is only read when the user asks for it, with the whole live thread
+        if 'archived' in self.request.GET:
+            context['archived_list'] = archive.archived_thread(self.therapy_plan)
+            context['message_list'] = list(self.thread_messages().order_by('created_at', 'id'))
+        else:
+            # the latest page only; older pages are fetched from message_older
+            page = self.older_page()
+            context['message_list'] = page.object_list[::-1]
+            context['older_cursor'] = page.next_cursor
+            context['has_archived'] = self.therapy_plan.archived_messages.exists()
+        
+        # the thread is read up to the newest message shown
+        if context['message_list']:
+            unread.mark_read(self.request.user, self.therapy_plan, up_to=context['message_list'][-1].pk)
         return context
     
     
@@ -561,51 +753,148 @@ class SendMessageView(MethodLoginRequiredMixin, CreateView):
         form.instance.sender = self.request.user
         
         # Set recipient
-        if self.request.user == self.therapy_plan.patient.user:
-            form.instance.recipient = self.therapy_plan.health_provider.user
+        if self.request.user.pk == self.therapy_plan.patient.user_id:
+            form.instance.recipient_id = self.therapy_plan.health_provider.user_id
         else:
-            form.instance.recipient = self.therapy_plan.patient.user
+            form.instance.recipient_id = self.therapy_plan.patient.user_id
         
+        self.object = self.save_message(form)
+        if self.is_ajax():
+            # the page appends the new message instead of reloading the thread
+            return self.render_messages([self.object], status=201)
         messages.success(self.request, 'Message sent successfully!')
-        return super().form_valid(form)
+        return HttpResponseRedirect(self.get_success_url())
+    
+    @retry_on_locked
+    def save_message(self, form):
+        '''Save the message and its unread counters in one transaction'''
+        with transaction.atomic():
+            return form.save()
+    
+    def form_invalid(self, form):
+        if self.is_ajax():
+            return JsonResponse({'errors': form.errors}, status=400)
+        return super().form_invalid(form)
     
     def get_success_url(self):
         return reverse('send_message', kwargs={'plan_pk': self.therapy_plan.pk})
 
+class OlderMessagesView(ThreadParticipantMixin, View):
+    '''Fragment of the page of messages before the ?before= cursor'''
+    
+    def get(self, request, *args, **kwargs):
+        try:
+            page = self.older_page(request.GET.get('before'))
+        except InvalidCursor:
+            return HttpResponse('Invalid cursor.', status=400)
+        response = self.render_messages(page.object_list[::-1])
+        # empty once the oldest live message has been sent
+        response['X-Older-Cursor'] = page.next_cursor or ''
+        return response
+
+class NewerMessagesView(ThreadParticipantMixin, View):
+    '''Fragment of the messages with an id above ?after=, for clients without the stream'''
+    
+    def get(self, request, *args, **kwargs):
+        after = request.GET.get('after', '')
+        if not after.isdigit():
+            return HttpResponse('after must be a message id.', status=400)
+        newer = list(self.thread_messages().filter(id__gt=after).order_by('id')[:self.newer_limit])
+        if newer:
+            unread.mark_read(request.user, self.therapy_plan, up_to=newer[-1].pk)
+        return self.render_messages(newer)
+
+class MessageStreamView(View):
+    '''Server-sent events of new messages in one therapy plan thread (needs ASGI)'''
+    heartbeat = 15
+    catch_up_limit = 100
+    read_delay = 1
+    
+    async def get(self, request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return HttpResponseForbidden("Log in to follow messages.")
+        plan_pk = self.kwargs.get('plan_pk')
+        if not await user_plans(user).filter(pk=plan_pk).aexists():
+            return HttpResponseForbidden("You can only follow your own therapy plans.")
+        if not isinstance(request, ASGIRequest):
+            # a sync server would buffer the endless stream; 204 tells EventSource to stop retrying
+            return HttpResponse(status=204)
+        
+        last_id = request.headers.get('Last-Event-ID') or request.GET.get('after', '')
+        last_id = int(last_id) if last_id.isdigit() else None
+        response = StreamingHttpResponse(self.events(user, plan_pk, last_id), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+    
+    def format_event(self, event):
+        return f"id: {event['id']}\nevent: message\ndata: {json.dumps(event)}\n\n"
+    
+    async def events(self, user, plan_pk, last_id):
+        '''Messages newer than last_id from the database, then live ones from the hub
+
+        The stream ends whenever the client may have missed messages (a full
+        catch-up page, or a listener queue that overflowed); EventSource then
+        reconnects with Last-Event-ID and the next catch-up replays them.
+        Streamed messages are shown, so they move the user's read cursor once
+        the stream has been quiet for read_delay seconds, one write per burst.
+        '''
+        mark_read = sync_to_async(unread.mark_read)
+        unmarked = None
+        # subscribe before catching up so a message saved in between is not missed
+        with realtime.get_hub().subscribe(realtime.plan_topic(plan_pk)) as subscription:
+            yield 'retry: 3000\n\n'
+            if last_id is not None:
+                missed = Message.objects.filter(therapy_plan_id=plan_pk, id__gt=last_id).select_related('sender')
+                caught_up = 0
+                async for message in missed.order_by('id')[:self.catch_up_limit]:
+                    yield self.format_event(realtime.message_event(message))
+                    last_id = unmarked = message.pk
+                    caught_up += 1
+                if caught_up == self.catch_up_limit:
+                    return
+            while True:
+                event = await subscription.get(self.heartbeat if unmarked is None else self.read_delay)
+                if subscription.overflowed:
+                    return
+                if event is None and unmarked is not None:
+                    await mark_read(user, plan_pk, up_to=unmarked)
+                    unmarked = None
+                elif event is None:
+                    yield ': ping\n\n'
+                elif last_id is None or event['id'] > last_id:
+                    last_id = event['id']
+                    if event['sender_id'] != user.pk:
+                        unmarked = last_id
+                    yield self.format_event(event)
+
 class ViewMessagesView(MethodLoginRequiredMixin, ListView):
-    model = Message
+    model = TherapyPlan
     template_name = "mindwell/view_messages.html"
     context_object_name = "user_messages"  # IMPORTANT: don't use "messages"
+    page_size = 50
+    ordering = ("-last_message_at", "-id")
 
     def get_queryset(self):
-        return Message.objects.filter(
-            Q(sender=self.request.user) | Q(recipient=self.request.user)
-        ).select_related(
-            "therapy_plan__patient",
-            "therapy_plan__health_provider",
-            "therapy_plan__plan_type",
-        ).order_by("-created_at")
+        # one row per thread with its latest message, newest thread first
+        return inbox_threads(self.request.user).order_by(*self.ordering)
 
     def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-
-        # mark unread as read
-        Message.objects.filter(recipient=self.request.user, is_read=False).update(is_read=True)
+        page = paginate_request(self.request, self.object_list, self.ordering, self.page_size)
+        context = super().get_context_data(object_list=page.object_list, **kwargs)
+        context["page"] = page
+        context["prev_query"], context["next_query"] = cursor_query(self.request.GET, page)
 
         # role context
-        context["is_provider"] = HealthProvider.objects.filter(user=self.request.user).exists()
-        context["is_patient"] = Patient.objects.filter(user=self.request.user).exists()
+        context["is_provider"] = self.is_provider()
+        context["is_patient"] = self.is_patient()
         if context["is_provider"]:
-            context["provider"] = HealthProvider.objects.get(user=self.request.user)
+            context["provider"] = self.get_provider()
         if context["is_patient"]:
-            context["patient"] = Patient.objects.get(user=self.request.user)
-
-        # build one "thread" per therapy plan (latest msg wins because queryset is -created_at)
-        threads_by_plan = {}
-        for m in context["user_messages"]:
-            if m.therapy_plan_id not in threads_by_plan:
-                threads_by_plan[m.therapy_plan_id] = m
-        context["threads"] = list(threads_by_plan.values())
+            context["patient"] = self.get_patient()
+
+        context["threads"] = page.object_list
 
         return context
 
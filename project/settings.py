@@ -11,7 +11,11 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
+import atexit
 import os
+import shutil
+import sys
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -43,14 +47,38 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'mindwell.staticfiles.StaticFilesMiddleware',
+    'mindwell.middleware.QueryInstrumentationMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'mindwell.middleware.MindwellRoleMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Query instrumentation (mindwell.middleware.QueryInstrumentationMiddleware)
+# fraction of requests to instrument, 0 disables the middleware
+MINDWELL_QUERY_SAMPLE_RATE = float(os.environ.get('MINDWELL_QUERY_SAMPLE_RATE', '0'))
+# per URL name budgets, requests going over them are logged to mindwell.queries
+MINDWELL_QUERY_BUDGETS = {
+    'default': {'queries': 20, 'ms': 100},
+    'provider_list': {'queries': 10, 'ms': 150},
+    'provider_detail': {'queries': 8, 'ms': 50},
+    'view_messages': {'queries': 8, 'ms': 100},
+}
+# a statement repeated this many times in one request is reported as a likely N+1
+MINDWELL_QUERY_REPEAT_THRESHOLD = 5
+
+# fan-out of new messages to streaming clients (mindwell.realtime); the
+# in-process hub only reaches clients connected to the same ASGI worker
+MINDWELL_REALTIME_HUB = 'mindwell.realtime.InProcessHub'
+
+# messages older than this many days, or of completed and cancelled plans,
+# are moved to ArchivedMessage by the archive_messages command
+MINDWELL_MESSAGE_ARCHIVE_DAYS = 365
+
 ROOT_URLCONF = 'project.urls'
 
 TEMPLATES = [
@@ -74,10 +102,65 @@ WSGI_APPLICATION = 'project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# SQLite tuned for several server processes writing at once. WAL lets reads run
+# alongside the one writer; IMMEDIATE takes the write lock when a transaction
+# begins, since a deferred one that reads first can fail upgrading its lock
+# without waiting; timeout is how long a writer queues for the lock.
+# MINDWELL_SQLITE_HARDENED=0 goes back to the stock backend settings.
+MINDWELL_SQLITE_HARDENED = os.environ.get('MINDWELL_SQLITE_HARDENED', '1') != '0'
+# Persistent connections keep the pragmas and page cache across requests, but
+# Django recommends disabling them under ASGI, where each request may run in a
+# different thread and connections are only closed at the end of a request.
+# project/wsgi.py turns them on for WSGI workers.
+MINDWELL_CONN_MAX_AGE = int(os.environ.get('MINDWELL_CONN_MAX_AGE', '0'))
+SQLITE_PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    # WAL stays consistent on power loss with NORMAL, it can only lose the last commits
+    'PRAGMA synchronous=NORMAL',
+    # in KiB when negative: 20 MB of page cache per connection
+    'PRAGMA cache_size=-20000',
+    'PRAGMA temp_store=MEMORY',
+]
+SQLITE_OPTIONS = {
+    'init_command': '; '.join(SQLITE_PRAGMAS),
+    'transaction_mode': 'IMMEDIATE',
+    'timeout': 20,
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': SQLITE_OPTIONS if MINDWELL_SQLITE_HARDENED else {},
+        'CONN_MAX_AGE': MINDWELL_CONN_MAX_AGE if MINDWELL_SQLITE_HARDENED else 0,
+        'CONN_HEALTH_CHECKS': MINDWELL_SQLITE_HARDENED,
+        # a file (not the default shared-cache memory database) so concurrency tests see real SQLite locking
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+    }
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+# The tag index version, provider fragment versions and anonymous pages must be
+# seen by every server process, which the default per-process memory cache is
+# not. SQLite already keeps the site on one host, so a directory on the same
+# disk is shared by all workers; a multi-host deployment needs Redis or
+# Memcached here instead.
+# The test suite gets a directory of its own for the run, so it never reads or
+# clears the live cache; processes it starts find it in MINDWELL_CACHE_DIR.
+MINDWELL_CACHE_DIR = os.environ.get('MINDWELL_CACHE_DIR')
+if MINDWELL_CACHE_DIR is None and sys.argv[1:2] == ['test']:
+    MINDWELL_CACHE_DIR = tempfile.mkdtemp(prefix='mindwell-test-cache-')
+    atexit.register(shutil.rmtree, MINDWELL_CACHE_DIR, ignore_errors=True)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': MINDWELL_CACHE_DIR or BASE_DIR / 'cache',
+        # one entry per provider card and profile plus cached pages; past this
+        # a third of the files are culled on the next write
+        'OPTIONS': {'MAX_ENTRIES': 20000},
     }
 }
 
@@ -123,6 +206,13 @@ STATICFILES_DIRS = [
     os.path.join(BASE_DIR, "static"),
 ]
 
+# collectstatic writes content-hashed names plus .gz/.br siblings, which
+# mindwell.staticfiles.StaticFilesMiddleware serves with immutable caching
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'mindwell.staticfiles.CompressedManifestStaticFilesStorage'},
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
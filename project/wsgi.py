@@ -12,5 +12,7 @@ import os
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+# WSGI workers serve one request per thread, so connections can be kept (not under ASGI)
+os.environ.setdefault('MINDWELL_CONN_MAX_AGE', '600')
 
 application = get_wsgi_application()